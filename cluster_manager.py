@@ -1,17 +1,79 @@
 import asyncio
 import importlib
+import json
 import logging
+import math
 import multiprocessing
+import multiprocessing.connection
 import os
 import signal
+import sys
+import time
 import types
+from logging.handlers import TimedRotatingFileHandler
+from typing import NamedTuple
 
-import requests
+import aiohttp
+import discord
+import psutil
+from discord.utils import _ColourFormatter
 
 import shinobu
+from ipc.stats_board import ClusterRestarts, RestartReason, StatsBoard
 
 cluster_logger = logging.getLogger('Cluster Manager')
 
+# fork: clusters are forked from the launcher, which reloads our packages before restarting a cluster.
+# forkserver: clusters are forked from a server that has only preloaded the stable third party modules
+#             in cluster_preload.py, so our packages are imported fresh in every cluster.
+# spawn: clusters are started from scratch.
+LAUNCH_MODES = ('fork', 'forkserver', 'spawn')
+PRELOAD_MODULES = ['cluster_preload']
+
+
+def setup_logging(bot_name: str):
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    # use discord.py's colored formatter
+    _format = _ColourFormatter()
+
+    # file handler
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    handler_f = TimedRotatingFileHandler(
+        filename=f"logs/{bot_name}.log",
+        when="d",
+        interval=1,
+        backupCount=5,
+        encoding="utf-8")
+
+    # stdout handler (that only shows INFO and DEBUG)
+    handler_c1 = logging.StreamHandler(stream=sys.stdout)
+    handler_c1.setLevel(logging.DEBUG)
+    handler_c1.addFilter(lambda msg: msg.levelno <= logging.INFO)
+
+    # stderr handler (that only shows warnings and above)
+    handler_c2 = logging.StreamHandler(stream=sys.stderr)
+    handler_c2.setLevel(logging.WARNING)
+
+    handler_f.setFormatter(_format)
+    handler_c1.setFormatter(_format)
+    handler_c2.setFormatter(_format)
+
+    logger.handlers = [handler_c1, handler_c2, handler_f]
+
+    # multiprocessing_logging.install_mp_handler()
+
+
+def run_cluster(launch_mode: str, **cluster_kwargs):
+    """Entry point of the cluster processes."""
+    # forked processes inherit the logging setup of the launcher
+    if launch_mode != 'fork':
+        setup_logging(cluster_kwargs['bot_name'])
+
+    shinobu.ShinobuBot(**cluster_kwargs)
+
 
 def _get_packages_to_reload(package):
     assert (hasattr(package, "__package__"))
@@ -52,19 +114,104 @@ def reload_package(package):
     cluster_logger.info(f"Successfully reloaded {len(packages_to_reload)} packages.")
 
 
+class GatewayInfo(NamedTuple):
+    shards: int
+    max_concurrency: int
+    remaining_sessions: int
+
+
+class ShardProfile:
+    """
+    Average resource usage of a shard, observed in previous runs and saved to a file.
+
+    Memory is modeled as a fixed cost per cluster process plus a cost per shard,
+    so that the estimates don't depend on the layout they were observed under.
+    """
+    SMOOTHING = 0.2  # weight of a new observation
+
+    def __init__(self, bot_name: str):
+        self.path = f'shard_profile_{bot_name}.json'
+
+        self.memory_per_process: float | None = None  # MB, before any guild is loaded
+        self.memory_per_shard: float | None = None  # MB, on top of the process
+        self.cpu_per_shard: float | None = None  # percentage of a core
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        else:
+            self.memory_per_process = data.get('memory_per_process')
+            self.memory_per_shard = data['memory_per_shard']
+            self.cpu_per_shard = data['cpu_per_shard']
+
+    @property
+    def exists(self) -> bool:
+        return self.memory_per_shard is not None
+
+    def _smooth(self, old: float | None, new: float) -> float:
+        return new if old is None else old + (new - old) * self.SMOOTHING
+
+    def observe(self, memory_per_process: float | None, memory_per_shard: float, cpu_per_shard: float):
+        if memory_per_process is not None:
+            self.memory_per_process = self._smooth(self.memory_per_process, memory_per_process)
+
+        self.memory_per_shard = self._smooth(self.memory_per_shard, memory_per_shard)
+        self.cpu_per_shard = self._smooth(self.cpu_per_shard, cpu_per_shard)
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'memory_per_process': self.memory_per_process,
+                       'memory_per_shard'  : self.memory_per_shard,
+                       'cpu_per_shard'     : self.cpu_per_shard}, f)
+
+
 class Launcher:
-    SHARDS_PER_CLUSTER = 8
+    DEFAULT_SHARDS_PER_CLUSTER = 8  # used until we have a shard profile
+
+    TARGET_CLUSTER_CPU = 70.0  # a cluster can use a single core at most, so leave some room for spikes
+    TARGET_MEMORY_USAGE = 0.9  # of the available memory
+    PROFILE_INTERVAL = 60 * 10
 
-    def __init__(self, bot_name: str = 'shinobu', loop=None):
+    SUPERVISOR_TICK = 1.0  # how often heartbeats are checked if nothing happens
+    KILL_TIMEOUT = 10.0  # clusters that don't exit this long after SIGTERM are sent SIGKILL
+
+    def __init__(self, bot_name: str = 'shinobu', loop=None, api_url: str = 'https://discord.com/api/v10'):
         self.bot_name = bot_name
-        self.bot_token = shinobu.ShinobuBot.get_config(bot_name, warn=True).token
+
+        config = shinobu.ShinobuBot.get_config(bot_name, warn=True)
+        self.bot_token = config.token
+
+        self.supervisor_config = config.supervisor
+
+        self.shards_per_cluster_override: int | None = config.shards_per_cluster
+        self.shard_profile = ShardProfile(bot_name)
+
+        self.launch_mode = config.cluster_launch_mode
+        if self.launch_mode not in LAUNCH_MODES:
+            raise ValueError(f"Unknown cluster launch mode: {self.launch_mode}. Choose one of: {LAUNCH_MODES}")
+
+        self.mp_context = multiprocessing.get_context(self.launch_mode)
+        if self.launch_mode == 'forkserver':
+            self.mp_context.set_forkserver_preload(PRELOAD_MODULES)
+
+        # can be pointed to a local stub of the gateway endpoint
+        self.api_url = api_url
+
+        # the last time a shard in each identify bucket has identified. shared with every cluster
+        self.identify_buckets: multiprocessing.Array | None = None
 
         self.clusters: list[Cluster] = []
         self.cluster_count = 0
 
+        self.stats_board: StatsBoard | None = None
+
         self.loop = loop or asyncio.new_event_loop()
         self.startup_task = None
-        self.rebooter_task = None
+        self.supervisor_task = None
+        self.rolling_restart_task = None
+        self.profiler_task = None
 
         self.alive = True
 
@@ -79,87 +226,332 @@ class Launcher:
             self.loop.stop()
             self.loop.close()
 
-    def get_shard_count(self):
+    async def get_gateway_info(self) -> GatewayInfo:
         cluster_logger.debug(f"Getting required shard count from DiscordAPI...")
 
-        data = requests.get('https://discord.com/api/v7/gateway/bot', headers={
-            "Authorization": "Bot " + self.bot_token,
-            "User-Agent"   : "DiscordBot (https://github.com/Rapptz/discord.py 1.7.3) Python/3.8 aiohttp/3.6.1"
-        })
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'{self.api_url}/gateway/bot', headers={
+                "Authorization": "Bot " + self.bot_token,
+                "User-Agent"   : f"DiscordBot (https://github.com/Rapptz/discord.py {discord.__version__})"
+            }) as response:
+                response.raise_for_status()
+                content = await response.json()
 
-        data.raise_for_status()
-        content = data.json()
+        session_start_limit = content['session_start_limit']
+        info = GatewayInfo(shards=content['shards'],
+                           max_concurrency=session_start_limit['max_concurrency'],
+                           remaining_sessions=session_start_limit['remaining'])
 
-        cluster_logger.info(f"Successfully got shard count of {content['shards']}.")
+        cluster_logger.info(f"Successfully got shard count of {info.shards} "
+                            f"with identify concurrency of {info.max_concurrency}.")
 
-        return content['shards']
+        if info.remaining_sessions < info.shards:
+            cluster_logger.warning(f"Only {info.remaining_sessions} sessions can be started until the limit resets, "
+                                   f"but we need {info.shards}. Some shards will not be able to connect.")
+
+        return info
 
     async def prepare_and_start_clusters(self):
-        shards = list(range(self.get_shard_count()))
-        cluster_shard_ids = [shards[x:x + self.SHARDS_PER_CLUSTER]
-                             for x in range(0, len(shards), self.SHARDS_PER_CLUSTER)]
+        gateway_info = await self.get_gateway_info()
+
+        shards = list(range(gateway_info.shards))
+        self.identify_buckets = self.mp_context.Array('d', gateway_info.max_concurrency)
+
+        shards_per_cluster = self.get_shards_per_cluster(len(shards))
+        cluster_shard_ids = [shards[x:x + shards_per_cluster]
+                             for x in range(0, len(shards), shards_per_cluster)]
 
         self.cluster_count = len(cluster_shard_ids)
         cluster_logger.info(f"Preparing {self.cluster_count} clusters.")
 
+        # clusters publish their stats here
+        self.stats_board = StatsBoard.create(f'{self.bot_name}_stats', cluster_count=self.cluster_count)
+
         for i, shard_ids in enumerate(cluster_shard_ids, 0):
             self.clusters.append(
                 Cluster(bot_name=self.bot_name, cluster_id=i,
                         launcher=self, shard_ids=shard_ids, max_shards=len(shards),
-                        total_clusters=self.cluster_count))
+                        total_clusters=self.cluster_count, shards_per_cluster=shards_per_cluster,
+                        stats_board_name=self.stats_board.name, identify_buckets=self.identify_buckets))
 
+        cluster_logger.info(f"Starting all clusters. Identifying every shard should take at least "
+                            f"{math.ceil(len(shards) / gateway_info.max_concurrency) * shinobu.IDENTIFY_WINDOW:.0f} "
+                            f"seconds.")
         await self.start_clusters()
 
-        self.rebooter_task = self.loop.create_task(self.rebooter())
-        self.rebooter_task.add_done_callback(self.task_complete)
+        self.supervisor_task = self.loop.create_task(self.supervisor())
+        self.supervisor_task.add_done_callback(self.task_complete)
+
+        self.profiler_task = self.loop.create_task(self.profile_shards())
 
         cluster_logger.info(f"Startup complete.")
 
+    def get_shards_per_cluster(self, shard_count: int) -> int:
+        if self.shards_per_cluster_override:
+            cluster_logger.info(f"Using {self.shards_per_cluster_override} shards per cluster from the config.")
+            return self.shards_per_cluster_override
+
+        if not self.shard_profile.exists:
+            cluster_logger.info(f"There is no shard profile yet, so using {self.DEFAULT_SHARDS_PER_CLUSTER} "
+                                f"shards per cluster. The layout will be sized automatically in the next launches.")
+            return self.DEFAULT_SHARDS_PER_CLUSTER
+
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        available_memory = psutil.virtual_memory().available / 10 ** 6
+
+        # as few clusters as possible, as every cluster duplicates the memory of the process itself.
+        # but enough of them so that none of them maxes out its core
+        total_cpu = shard_count * self.shard_profile.cpu_per_shard
+        wanted_cluster_count = min(max(math.ceil(total_cpu / self.TARGET_CLUSTER_CPU), 1), cpu_count, shard_count)
+
+        # the shards take the same memory however they're laid out. what's left caps the number of processes
+        memory_per_process = self.shard_profile.memory_per_process or 0.0
+        shard_memory = shard_count * self.shard_profile.memory_per_shard
+        if memory_per_process:
+            usable_memory = available_memory * self.TARGET_MEMORY_USAGE
+            memory_cluster_limit = int((usable_memory - shard_memory) // memory_per_process)
+        else:
+            memory_cluster_limit = shard_count
+
+        cluster_count = max(min(wanted_cluster_count, memory_cluster_limit), 1)
+        shards_per_cluster = math.ceil(shard_count / cluster_count)
+
+        expected_cluster_cpu = shards_per_cluster * self.shard_profile.cpu_per_shard
+        expected_memory = cluster_count * memory_per_process + shard_memory
+
+        cluster_logger.info(f"Chose {cluster_count} clusters with {shards_per_cluster} shards each "
+                            f"for {cpu_count} cores and {available_memory:.0f} MB of available memory.\n"
+                            f"Expected CPU usage per cluster: {expected_cluster_cpu:.1f}% of a core "
+                            f"(headroom: {100 - expected_cluster_cpu:.1f}%)\n"
+                            f"Expected total memory usage: {expected_memory:.0f} MB "
+                            f"(headroom: {available_memory - expected_memory:.0f} MB)")
+
+        if cluster_count < wanted_cluster_count:
+            cluster_logger.warning(f"Memory only allows {cluster_count} clusters instead of {wanted_cluster_count}, "
+                                   f"so they'll use more CPU than targeted.")
+        if expected_cluster_cpu > 100:
+            cluster_logger.warning("Clusters are expected to max out their cores. This host needs more cores.")
+        if expected_memory > available_memory:
+            cluster_logger.warning("Clusters are expected to use more memory than available. This host needs more.")
+
+        return shards_per_cluster
+
+    async def profile_shards(self):
+        """Saves the average resource usage of a shard every once in a while, so that the next launch can use it."""
+        while self.alive:
+            await asyncio.sleep(self.PROFILE_INTERVAL)
+
+            # skip the clusters that are still starting up, as they don't represent the usual usage
+            stats = [x for x in self.stats_board.read_all() if x.uptime > self.PROFILE_INTERVAL]
+            if not stats:
+                continue
+
+            shard_count = sum(len(self.clusters[x.cluster_id].kwargs['shard_ids']) for x in stats)
+
+            baselines = [self.clusters[x.cluster_id].baseline_memory for x in stats
+                         if self.clusters[x.cluster_id].baseline_memory is not None]
+            memory_per_process = sum(baselines) / len(baselines) if baselines else None
+
+            # whatever a cluster uses on top of its baseline is what its shards take
+            known_memory_per_process = memory_per_process or self.shard_profile.memory_per_process or 0.0
+            shard_memory = max(sum(x.memory for x in stats) - known_memory_per_process * len(stats), 0.0)
+
+            self.shard_profile.observe(memory_per_process=memory_per_process,
+                                       memory_per_shard=shard_memory / shard_count,
+                                       cpu_per_shard=sum(x.cpu_usage for x in stats) / shard_count)
+
+            try:
+                self.shard_profile.save()
+            except OSError as e:
+                cluster_logger.error(f"Could not save the shard profile: {e}")
+
     async def start_clusters(self):
+        # shards wait for their identify bucket themselves, so every cluster can be started at once
         for cluster in self.clusters:
             if not cluster.is_alive():
                 await cluster.start()
                 cluster_logger.info(f"Started Cluster#{cluster.id}.")
-                await asyncio.sleep(1.0)
 
     async def shutdown(self):
         self.alive = False
 
-        if self.rebooter_task:
-            self.rebooter_task.cancel()
+        if self.supervisor_task:
+            self.supervisor_task.cancel()
+
+        if self.rolling_restart_task:
+            self.rolling_restart_task.cancel()
+
+        if self.profiler_task:
+            self.profiler_task.cancel()
 
         for cluster in self.clusters:
+            if cluster.restart_task:
+                cluster.restart_task.cancel()
+
             cluster.stop()
 
-    async def rebooter(self):
+        if self.stats_board:
+            self.stats_board.close()
+
+    async def supervisor(self):
         """
         Our exit codes:
 
         0 -> I was shutdown properly. Don't restart me.
         Literally anything else -> Restart.
+
+        Clusters that stop sending heartbeats (hung event loop) or that lag too much for too long are restarted too.
         """
         while self.alive:
+            # wait for a cluster to exit or to send us something
+            waitables = dict()
             for cluster in self.clusters:
-                if not cluster.process.is_alive() and cluster.dont_restart is False:
-                    cluster_logger.warning(f"Cluster#{cluster.id} exited with code {cluster.process.exitcode}.")
+                if cluster.process is not None and not cluster.exit_handled:
+                    waitables[cluster.process.sentinel] = (cluster, cluster.process)
+                waitables[cluster.parent_pipe] = (cluster, cluster.parent_pipe)
 
-                    cluster.stop()  # ensure stopped
+            ready = await self.loop.run_in_executor(
+                None, multiprocessing.connection.wait, list(waitables.keys()), self.SUPERVISOR_TICK)
 
-                    if cluster.process.exitcode != 0:
-                        cluster_logger.info(f"Restarting Cluster#{cluster.id}")
-                        await cluster.start()
-                    else:
-                        cluster.dont_restart = True
+            for waitable in ready:
+                cluster, obj = waitables[waitable]
+
+                # it might've been replaced by a rolling restart while we were waiting
+                if obj is not cluster.process and obj is not cluster.parent_pipe:
+                    continue
 
-            dead_and_dont_restart_cluster_count = len([x for x in self.clusters
-                                                       if not x.process.is_alive() and x.dont_restart is True])
+                if obj is cluster.parent_pipe:
+                    self.handle_cluster_messages(cluster)
+                else:
+                    self.handle_cluster_exit(cluster)
 
-            if dead_and_dont_restart_cluster_count == self.cluster_count:
+            self.check_heartbeats()
+
+            if all(x.dont_restart is True and not x.is_alive() for x in self.clusters):
                 cluster_logger.info("All clusters seem to be dead and they don't want to be restarted, "
                                     "so I'm killing myself too. Fuck this world.")
                 return await self.shutdown()
 
-            await asyncio.sleep(5)
+    def handle_cluster_messages(self, cluster: Cluster):
+        try:
+            while cluster.parent_pipe.poll():
+                message: dict = cluster.parent_pipe.recv()
+
+                if message['type'] == 'heartbeat':
+                    cluster.last_heartbeat = time.monotonic()
+
+                    if message['loop_lag'] > self.supervisor_config['max_loop_lag']:
+                        cluster.lagging_heartbeats += 1
+                        cluster.logger.warning(f"Event loop lags by {message['loop_lag']:.2f} seconds.")
+                    else:
+                        cluster.lagging_heartbeats = 0
+
+                elif message['type'] == 'baseline':
+                    cluster.baseline_memory = message['memory']
+
+                elif message['type'] == 'rolling_restart':
+                    if self.rolling_restart_task and not self.rolling_restart_task.done():
+                        self.report("A rolling restart is already in progress.")
+                    else:
+                        self.rolling_restart_task = self.loop.create_task(self.rolling_restart())
+        except (EOFError, OSError):
+            pass
+
+    def report(self, content: str):
+        """Logs the content and posts it to the log channel through a cluster."""
+        cluster_logger.info(content)
+
+        for cluster in self.clusters:
+            if cluster.is_alive() and cluster.last_heartbeat is not None:
+                try:
+                    return cluster.parent_pipe.send({'type': 'log', 'content': f'**[Launcher]** {content}'})
+                except (BrokenPipeError, OSError):
+                    continue
+
+    async def rolling_restart(self):
+        """Replaces clusters one by one. Every cluster stays online until its replacement is ready."""
+        self.report(f"Rolling restart of {self.cluster_count} clusters has started.")
+        started = time.monotonic()
+
+        for cluster in self.clusters:
+            if not cluster.is_alive() or cluster.restart_reason is not None:
+                self.report(f"Skipping Cluster#{cluster.id} as it is not running.")
+                continue
+
+            if await cluster.replace(ready_timeout=self.supervisor_config['startup_timeout']):
+                self.report(f"Cluster#{cluster.id} has been replaced.")
+            else:
+                self.report(f"Replacement of Cluster#{cluster.id} did not get ready in time. "
+                            f"Aborting the rolling restart. The old process is still running.")
+                return
+
+        self.report(f"Rolling restart is complete in {time.monotonic() - started:.0f} seconds.")
+
+    def handle_cluster_exit(self, cluster: Cluster):
+        cluster.exit_handled = True
+        cluster.process.join(timeout=0)  # reap
+
+        cluster.logger.warning(f"Exited with code {cluster.process.exitcode}.")
+
+        if cluster.restart_reason is None and cluster.process.exitcode == 0:
+            cluster.dont_restart = True
+            return
+
+        self.schedule_restart(cluster, cluster.restart_reason or RestartReason.CRASHED)
+
+    def check_heartbeats(self):
+        now = time.monotonic()
+
+        for cluster in self.clusters:
+            # already being restarted
+            if not cluster.is_alive() or cluster.restart_reason is not None:
+                continue
+
+            if cluster.last_heartbeat is None:
+                silent_for = now - cluster.started_at
+                timeout = self.supervisor_config['startup_timeout']
+            else:
+                silent_for = now - cluster.last_heartbeat
+                timeout = self.supervisor_config['heartbeat_timeout']
+
+            if silent_for > timeout:
+                cluster.logger.warning(f"Has not sent a heartbeat for {silent_for:.0f} seconds. Killing it.")
+                self.kill_cluster(cluster, RestartReason.HUNG)
+
+            elif cluster.lagging_heartbeats >= self.supervisor_config['max_lagging_heartbeats']:
+                cluster.logger.warning(f"Has been lagging for {cluster.lagging_heartbeats} heartbeats. Killing it.")
+                self.kill_cluster(cluster, RestartReason.LAGGING)
+
+    def kill_cluster(self, cluster: Cluster, reason: RestartReason):
+        """Kills the cluster. The supervisor restarts it once it exits."""
+        cluster.restart_reason = reason
+        cluster.stop()
+
+        # a hung cluster might not be able to handle SIGTERM
+        self.loop.call_later(self.KILL_TIMEOUT, cluster.kill_if_alive, cluster.process)
+
+    def schedule_restart(self, cluster: Cluster, reason: RestartReason):
+        if time.monotonic() - cluster.started_at > self.supervisor_config['backoff_reset_after']:
+            cluster.restarts_in_a_row = 0
+
+        delay = min(self.supervisor_config['restart_backoff'] * 2 ** cluster.restarts_in_a_row,
+                    self.supervisor_config['max_restart_backoff'])
+        cluster.restarts_in_a_row += 1
+
+        cluster.restarts.append((time.time(), reason))
+        self.stats_board.write_restarts(ClusterRestarts(cluster_id=cluster.id,
+                                                        restarts=len(cluster.restarts),
+                                                        last_restart_at=time.time(),
+                                                        last_restart_reason=reason))
+
+        cluster.logger.info(f"Restarting in {delay:.0f} seconds. Reason: {reason.name.lower()}")
+        cluster.restart_task = self.loop.create_task(self.restart_later(cluster, delay))
+
+    async def restart_later(self, cluster: Cluster, delay: float):
+        await asyncio.sleep(delay)
+
+        if self.alive:
+            await cluster.start()
 
     def task_complete(self, task):
         try:
@@ -167,8 +559,8 @@ class Launcher:
             if task.exception():
                 task.print_stack()
 
-                self.rebooter_task = self.loop.create_task(self.rebooter())
-                self.rebooter_task.add_done_callback(self.task_complete)
+                self.supervisor_task = self.loop.create_task(self.supervisor())
+                self.supervisor_task.add_done_callback(self.task_complete)
                 return
 
         except asyncio.CancelledError:
@@ -177,11 +569,12 @@ class Launcher:
 
 class Cluster:
     def __init__(self, bot_name: str, cluster_id: int, launcher: Launcher, shard_ids: list[int], max_shards: int,
-                 total_clusters: int):
+                 total_clusters: int, shards_per_cluster: int, stats_board_name: str,
+                 identify_buckets: multiprocessing.Array):
         self.bot_name = bot_name
         self.launcher = launcher
 
-        self.parent_pipe, self.child_pipe = multiprocessing.Pipe()
+        self.parent_pipe, self.child_pipe = self.launcher.mp_context.Pipe()
 
         self.kwargs = dict(
             shard_ids=shard_ids,
@@ -189,7 +582,9 @@ class Cluster:
             cluster_id=cluster_id,
             bot_name=bot_name,
             total_clusters=total_clusters,
-            pipe=self.child_pipe
+            shards_per_cluster=shards_per_cluster,
+            stats_board_name=stats_board_name,
+            identify_buckets=identify_buckets
         )
 
         self.id = cluster_id
@@ -202,6 +597,20 @@ class Cluster:
         self.dont_restart = False
         self.first_time = True
 
+        # supervisor stuff
+        self.started_at = time.monotonic()
+        self.last_heartbeat: float | None = None
+        self.lagging_heartbeats = 0
+        self.exit_handled = False
+
+        # memory usage of the process before it loaded any guild, in MB
+        self.baseline_memory: float | None = None
+
+        self.restart_reason: RestartReason | None = None  # set if we kill it on purpose
+        self.restart_task: asyncio.Task | None = None
+        self.restarts_in_a_row = 0
+        self.restarts: list[tuple[float, RestartReason]] = []
+
     def wait_close(self):
         return self.process.join()
 
@@ -218,18 +627,99 @@ class Cluster:
             self.process.terminate()
             self.process.close()
 
-        # reload the bot so that the changes we've made takes effect
-        if not self.first_time:
+        self.process = self._start_process(self.child_pipe)
+        self._reset_supervisor_state()
+
+    def _start_process(self, child_pipe, publish_stats: bool = True) -> multiprocessing.Process:
+        # reload the bot so that the changes we've made takes effect.
+        # other launch modes import everything from scratch in the cluster
+        if not self.first_time and self.launcher.launch_mode == 'fork':
             reload_package(shinobu)
 
-        self.process = multiprocessing.Process(name=f'{self.bot_name} #{self.kwargs["cluster_id"]}',
-                                               target=shinobu.ShinobuBot, kwargs=self.kwargs, daemon=True)
-        self.process.start()
+        process = self.launcher.mp_context.Process(name=f'{self.bot_name} #{self.kwargs["cluster_id"]}',
+                                                   target=run_cluster,
+                                                   args=(self.launcher.launch_mode,),
+                                                   kwargs={**self.kwargs,
+                                                           'pipe': child_pipe,
+                                                           'publish_stats': publish_stats},
+                                                   daemon=True)
+        process.start()
 
-        self.logger.debug(f"Process started with PID {self.process.pid}")
+        self.logger.debug(f"Process started with PID {process.pid}")
 
         self.first_time = False
 
+        return process
+
+    def _reset_supervisor_state(self):
+        self.started_at = time.monotonic()
+        self.last_heartbeat = None
+        self.lagging_heartbeats = 0
+        self.exit_handled = False
+        self.baseline_memory = None
+        self.restart_reason = None
+
+    async def replace(self, ready_timeout: float) -> bool:
+        """Starts a new process and closes the current one once the new one is ready.
+        Kills the new one and returns False if it doesn't get ready in time."""
+        parent_pipe, child_pipe = self.launcher.mp_context.Pipe()
+
+        # both processes would write to the same slot of the stats board,
+        # so the new one doesn't publish its stats until the current one is gone
+        process = self._start_process(child_pipe, publish_stats=False)
+        baseline_memory = None
+
+        deadline = time.monotonic() + ready_timeout
+        while True:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.kill()
+                await asyncio.get_running_loop().run_in_executor(None, process.join)
+                process.close()
+
+                parent_pipe.close()
+                child_pipe.close()
+                return False
+
+            # heartbeats and such are ignored until it's ready
+            try:
+                if await asyncio.get_running_loop().run_in_executor(None, parent_pipe.poll, 1.0):
+                    message = parent_pipe.recv()
+                    if message['type'] == 'baseline':
+                        baseline_memory = message['memory']
+                    elif message['type'] == 'ready':
+                        break
+            except (EOFError, OSError):
+                pass  # it died, which is handled above
+
+        old_process, old_pipe, old_child_pipe = self.process, self.parent_pipe, self.child_pipe
+
+        self.process, self.parent_pipe, self.child_pipe = process, parent_pipe, child_pipe
+        self._reset_supervisor_state()
+        self.baseline_memory = baseline_memory
+
+        try:
+            old_pipe.send({'type': 'close'})
+        except (BrokenPipeError, OSError):
+            pass
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, old_process.join, self.launcher.KILL_TIMEOUT)
+        if old_process.is_alive():
+            old_process.kill()
+            await loop.run_in_executor(None, old_process.join)
+        old_process.close()
+
+        old_pipe.close()
+        old_child_pipe.close()
+
+        # the slot is ours now
+        try:
+            parent_pipe.send({'type': 'publish_stats'})
+        except (BrokenPipeError, OSError):
+            pass
+
+        return True
+
     def stop(self, sign=signal.SIGTERM):
         self.logger.info(f"Shutting down with signal {sign!r}.")
 
@@ -237,3 +727,8 @@ class Cluster:
             os.kill(self.process.pid, sign)
         except (ProcessLookupError, PermissionError):
             pass
+
+    def kill_if_alive(self, process: multiprocessing.Process):
+        # make sure that we don't kill the process that replaced it
+        if process is self.process and self.is_alive():
+            self.stop(signal.SIGKILL)
@@ -0,0 +1,27 @@
+"""
+Imported once by the fork server when the clusters are launched in forkserver mode.
+
+Only stable third party modules belong here. Our own packages (cogs, mido_utils, models, services, ipc)
+are imported in the clusters so that a restarted cluster always gets the latest code.
+"""
+import gc
+
+import aiohttp
+import asyncpg
+import asyncpraw
+import asyncurban
+import bs4
+import discord
+import discord.ext.commands
+import discord.ext.tasks
+import msgpack
+import psutil
+import redis.asyncio
+import setproctitle
+import topgg
+import wavelink
+import websockets
+
+# move everything imported above to the permanent generation,
+# so that the garbage collector doesn't touch (and copy) the shared pages in the clusters
+gc.freeze()
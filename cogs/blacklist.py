@@ -1,3 +1,5 @@
+import asyncio
+
 from discord.ext import commands
 
 import mido_utils
@@ -8,29 +10,72 @@ from shinobu import ShinobuBot
 # TODO: use ipc to find guild and fix blacklist commands
 
 class Blacklist(commands.Cog, command_attrs=dict(hidden=True)):
+    LOAD_RETRY_DELAY = 10.0
+
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
+        # the blacklist is small and rarely changes, so we keep all of it in memory
+        # and keep it up to date through IPC
+        self.blacklisted_ids: dict[BlacklistDB.BlacklistType, set[int]] = {
+            bl_type: set() for bl_type in BlacklistDB.BlacklistType
+        }
+        # until it's loaded, every command checks the db instead
+        self.blacklist_is_loaded = False
+        self.load_blacklist_task = self.bot.loop.create_task(self.load_blacklist())
+
+    def cog_unload(self):
+        self.load_blacklist_task.cancel()
+
+    async def load_blacklist(self):
+        while True:
+            try:
+                self.blacklisted_ids = await BlacklistDB.get_all_ids(bot=self.bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception(f"Error while loading the blacklist. "
+                                          f"Retrying in {self.LOAD_RETRY_DELAY} seconds...")
+                await asyncio.sleep(self.LOAD_RETRY_DELAY)
+            else:
+                break
+
+        self.blacklist_is_loaded = True
+        self.bot.logger.debug(f"Loaded {sum(len(x) for x in self.blacklisted_ids.values())} blacklist entries.")
+
+    async def is_blacklisted(self, user_or_guild_id: int, bl_type: BlacklistDB.BlacklistType) -> bool:
+        if not self.blacklist_is_loaded:
+            return await BlacklistDB.get(bot=self.bot, user_or_guild_id=user_or_guild_id, bl_type=bl_type) is not None
+
+        return user_or_guild_id in self.blacklisted_ids[bl_type]
+
+    def update_blacklist(self, bl_type: BlacklistDB.BlacklistType, ids: list[int], blacklisted: bool):
+        if blacklisted:
+            self.blacklisted_ids[bl_type].update(ids)
+        else:
+            self.blacklisted_ids[bl_type].difference_update(ids)
+
+    async def blacklist_and_broadcast(self, bl_type: BlacklistDB.BlacklistType, ids: list[int], blacklisted: bool):
+        self.update_blacklist(bl_type, ids, blacklisted)
+        await self.bot.ipc.update_blacklist(bl_type=bl_type.name, ids=ids, blacklisted=blacklisted)
+
     async def bot_check(self, ctx: mido_utils.Context):
-        time = mido_utils.Time()
-        user_is_blacklisted = await BlacklistDB.get(bot=ctx.bot, user_or_guild_id=ctx.author.id,
-                                                    bl_type=BlacklistDB.BlacklistType.user)
+        user_is_blacklisted = await self.is_blacklisted(ctx.author.id, BlacklistDB.BlacklistType.user)
         guild_is_blacklisted = False
 
         if user_is_blacklisted and ctx.guild:
             # if the guild owner is blacklisted but the guild is not blacklisted,
             # blacklist their guild too, fuck'em
-            guild_is_blacklisted = await BlacklistDB.get(bot=ctx.bot, user_or_guild_id=ctx.guild.id,
-                                                         bl_type=BlacklistDB.BlacklistType.guild)
+            guild_is_blacklisted = await self.is_blacklisted(ctx.guild.id, BlacklistDB.BlacklistType.guild)
             if ctx.author.id == ctx.guild.owner.id and not guild_is_blacklisted:
                 await BlacklistDB.blacklist(bot=ctx.bot,
                                             user_or_guild_id=ctx.guild.id,
                                             bl_type=BlacklistDB.BlacklistType.guild,
                                             reason=f'Automatically blacklisted '
                                                    f'because the owner {ctx.author.id} was blacklisted')
+                await self.blacklist_and_broadcast(BlacklistDB.BlacklistType.guild, [ctx.guild.id], True)
                 guild_is_blacklisted = True
 
-        self.bot.logger.debug('Blacklist checking took:\t' + time.passed_seconds_in_float_formatted)
         if user_is_blacklisted:
             raise mido_utils.UserIsBlacklisted("The user is blacklisted.")
         if guild_is_blacklisted:
@@ -50,10 +95,7 @@ class Blacklist(commands.Cog, command_attrs=dict(hidden=True)):
 
         bl_type = BlacklistDB.BlacklistType[bl_type]
 
-        is_blacklisted = await BlacklistDB.get(bot=ctx.bot,
-                                               user_or_guild_id=_id,
-                                               bl_type=bl_type)
-        if is_blacklisted:
+        if await self.is_blacklisted(_id, bl_type):
             raise commands.BadArgument(f"{bl_type.name.title()} `{_id}` is already blacklisted!")
 
         await BlacklistDB.blacklist(bot=ctx.bot,
@@ -61,16 +103,20 @@ class Blacklist(commands.Cog, command_attrs=dict(hidden=True)):
                                     bl_type=bl_type,
                                     reason=reason or f'Blacklisted by the owner {ctx.author.id}')
 
+        await self.blacklist_and_broadcast(bl_type, [_id], True)
+
         if bl_type is BlacklistDB.BlacklistType.user:
-            counter = 0
+            guild_ids = []
             for guild in self.bot.guilds:
                 if guild.owner.id == _id:
-                    counter += 1
+                    guild_ids.append(guild.id)
                     await BlacklistDB.blacklist(bot=ctx.bot,
                                                 user_or_guild_id=guild.id,
                                                 bl_type=BlacklistDB.BlacklistType.guild,
                                                 reason=f'Automatically blacklisted because the owner {_id}'
                                                        f' has been blacklisted by the owner {ctx.author.id}')
+            await self.blacklist_and_broadcast(BlacklistDB.BlacklistType.guild, guild_ids, True)
+            counter = len(guild_ids)
 
             await ctx.send_success(f"Successfully blacklisted the user <@{_id}> and **{counter}** servers they have.")
         else:
@@ -87,24 +133,25 @@ class Blacklist(commands.Cog, command_attrs=dict(hidden=True)):
 
         bl_type = BlacklistDB.BlacklistType[bl_type]
 
-        is_blacklisted = await BlacklistDB.get(bot=ctx.bot,
-                                               user_or_guild_id=_id,
-                                               bl_type=bl_type)
-        if not is_blacklisted:
+        if not await self.is_blacklisted(_id, bl_type):
             raise commands.BadArgument(f"{bl_type.title()} `{_id}` is not blacklisted!")
 
         await BlacklistDB.unblacklist(bot=ctx.bot,
                                       user_or_guild_id=_id,
                                       bl_type=bl_type)
 
+        await self.blacklist_and_broadcast(bl_type, [_id], False)
+
         if bl_type is BlacklistDB.BlacklistType.user:
-            counter = 0
+            guild_ids = []
             for guild in self.bot.guilds:
                 if guild.owner.id == _id:
-                    counter += 1
+                    guild_ids.append(guild.id)
                     await BlacklistDB.unblacklist(bot=ctx.bot,
                                                   user_or_guild_id=guild.id,
                                                   bl_type=BlacklistDB.BlacklistType.guild)
+            await self.blacklist_and_broadcast(BlacklistDB.BlacklistType.guild, guild_ids, False)
+            counter = len(guild_ids)
 
             await ctx.send_success(f"Successfully unblacklisted the user <@{_id}> and **{counter}** servers they have.")
         else:
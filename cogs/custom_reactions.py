@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 
 import mido_utils
+import services
 from models.db import CustomReaction
 from shinobu import ShinobuBot
 
@@ -22,26 +23,20 @@ class CustomReactions(
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
-        self.bot.loop.create_task(self.check_cr_db_func())
+        self.cr_service = services.CustomReactionService(self.bot)
 
-    async def check_cr_db_func(self):
-        """PSQL function to escape special characters"""
-        await self.bot.wait_until_ready()
+    def cog_unload(self):
+        self.cr_service.stop()
 
-        time = mido_utils.Time()
-        exists = await self.bot.db.fetchval("SELECT EXISTS(SELECT * FROM pg_proc WHERE proname = 'f_like_escape');")
-        if not exists:
-            await self.bot.db.execute("""
-                CREATE OR REPLACE FUNCTION f_like_escape(text)
-                  RETURNS text  LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS
-                $func$
-                SELECT REPLACE(REPLACE(REPLACE($1
-                         , '\', '\\')  -- must come 1st
-                         , '%', '\%')
-                         , '_', '\_');
-                $func$;
-                """)
-        self.bot.logger.debug("Checking CR DB function took:\t" + time.passed_seconds_in_float_formatted)
+    async def on_cr_change(self, cr: CustomReaction, deleted: bool = False):
+        """Keeps the matchers up to date. Global custom reactions are matched in every cluster, so use IPC for them."""
+        if cr.guild_id is None:
+            return await self.bot.ipc.drop_custom_reactions(guild_id=None)
+
+        if deleted:
+            self.cr_service.remove(cr)
+        else:
+            self.cr_service.update(cr)
 
     async def base_cr_on_message(self, message: discord.Message):
         """This on_message function is used to check whether a message triggered a custom reaction or not."""
@@ -49,8 +44,7 @@ class CustomReactions(
             return False
 
         try:
-            cr = await CustomReaction.try_get(
-                self.bot,
+            cr = await self.cr_service.find(
                 msg=message.content.replace('\x00', ''),  # remove 0x00
                 guild_id=message.guild.id)
 
@@ -86,6 +80,7 @@ class CustomReactions(
                         f"Please try to put a properly built embed next time.\n"
                     )
                     await cr.delete_from_db()
+                    await self.on_cr_change(cr, deleted=True)
 
                     self.bot.logger.debug(f"Was not able to send the embed "
                                           f"in custom reaction with ID: {cr.id}\n"
@@ -131,6 +126,7 @@ class CustomReactions(
                                       trigger=trigger,
                                       response=response,
                                       guild_id=guild_id)
+        await self.on_cr_change(cr)
 
         e = self.get_cr_embed(cr)
         e.title = "New Custom Reaction"
@@ -176,6 +172,7 @@ class CustomReactions(
         yes = await mido_utils.Embed.yes_no(bot=self.bot, author_id=ctx.author.id, msg=msg)
         if yes:
             await CustomReaction.delete_all(bot=ctx.bot, guild_id=ctx.guild.id)
+            self.cr_service.drop(ctx.guild.id)
 
             await ctx.edit_custom(msg, "All custom reactions have been successfully deleted.")
         else:
@@ -189,6 +186,7 @@ class CustomReactions(
         You need Administrator permission to use this command."""
 
         await custom_reaction.delete_from_db()
+        await self.on_cr_change(custom_reaction, deleted=True)
 
         e = self.get_cr_embed(custom_reaction)
         e.title = "Custom Reaction Deleted"
@@ -201,6 +199,7 @@ class CustomReactions(
         """Toggles whether the custom reaction will trigger
         if the triggering message contains the keyword (instead of only starting with it)."""
         await custom_reaction.toggle_contains_anywhere()
+        await self.on_cr_change(custom_reaction)
 
         await ctx.send_success(
             cr_toggle_message(option_name='Contains Anywhere',
@@ -211,6 +210,7 @@ class CustomReactions(
     async def toggle_custom_reaction_dm(self, ctx: mido_utils.Context, custom_reaction: CustomReaction):
         """Toggles whether the response message of the custom reaction will be sent as a direct message."""
         await custom_reaction.toggle_dm()
+        await self.on_cr_change(custom_reaction)
 
         await ctx.send_success(
             cr_toggle_message(option_name='Respond in DM',
@@ -221,6 +221,7 @@ class CustomReactions(
     async def toggle_custom_reaction_auto_delete(self, ctx: mido_utils.Context, custom_reaction: CustomReaction):
         """Toggles whether the message triggering the custom reaction will be automatically deleted."""
         await custom_reaction.toggle_delete_trigger()
+        await self.on_cr_change(custom_reaction)
 
         await ctx.send_success(
             cr_toggle_message(option_name='Delete the Trigger',
@@ -1,5 +1,6 @@
 import math
 import random
+from datetime import datetime
 
 import discord
 import topgg
@@ -42,12 +43,16 @@ class Gambling(
     commands.Cog,
     description='Use the `{ctx.prefix}daily` command to get '
                 '**{bot.config.daily_amount}{mido_utils.emotes.currency}** and use them in gambling and other games!'):
+    DONUT_EVENT_JOB_KIND = 'donut_event'
+
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
         # donut event stuff
         self.active_donut_events: list[DonutEvent] = list()
         self.active_donut_task = self.bot.loop.create_task(self.get_active_donut_events())
+        self.bot.scheduler.register(self.DONUT_EVENT_JOB_KIND, load=self.load_ending_donut_events,
+                                    run=self.end_donut_event)
 
         # things that only cluster 0 provides
         if self.bot.cluster_id == 0:
@@ -75,7 +80,7 @@ class Gambling(
         """Manual posting is required due to clustering"""
         if hasattr(self, 'topgg'):
             await self.topgg.http.post_guild_count(
-                guild_count=await self.bot.ipc.get_guild_count(),
+                guild_count=self.bot.stats_board.get_totals().guilds,
                 shard_count=None,
                 shard_id=None)
 
@@ -88,6 +93,18 @@ class Gambling(
             self.bot.loop.create_task(self.topgg.close())
 
         self.active_donut_task.cancel()
+        self.bot.scheduler.unregister(self.DONUT_EVENT_JOB_KIND)
+
+    async def load_ending_donut_events(self, ends_before: datetime):
+        donut_events = await DonutEvent.get_ending_ones(self.bot, ends_before=ends_before)
+
+        return [(donut_event.id, donut_event.end_date.end_date, donut_event) for donut_event in donut_events]
+
+    async def end_donut_event(self, donut_event: DonutEvent):
+        if donut_event in self.active_donut_events:
+            self.active_donut_events.remove(donut_event)
+
+        await donut_event.delete_msg_and_mark_as_deleted()
 
     async def get_active_donut_events(self):
         """This function gets active donut events and processes them"""
@@ -96,16 +113,17 @@ class Gambling(
         self.active_donut_events = await DonutEvent.get_active_ones(self.bot)
 
         for donut_event in self.active_donut_events:
+            # the scheduler ends the ones that have expired
+            if donut_event.end_date.end_date_has_passed:
+                continue
+
             msg_obj: discord.Message = await donut_event.fetch_message_object()
 
-            # if we can't fetch the msg object or the end date has passed, delete
-            if not msg_obj or donut_event.end_date.end_date_has_passed:
+            # if we can't fetch the msg object, delete
+            if not msg_obj:
                 await donut_event.delete_msg_and_mark_as_deleted()
                 continue
 
-            self.bot.loop.create_task(
-                donut_event.delete_msg_and_mark_as_deleted(delay=donut_event.end_date.remaining_seconds))
-
             try:
                 # find the event reaction obj
                 event_reaction = next(x for x in msg_obj.reactions
@@ -229,7 +247,7 @@ class Gambling(
                 content=f"Your daily is ready! You can vote [here]({mido_utils.links.upvote}).",
                 date_obj=mido_utils.Time.add_to_current_date_and_get(seconds=self.bot.config.cooldowns['daily'])
             )
-            ctx.bot.get_cog('Reminder').reminder_service.add_reminder(reminder)
+            await ctx.bot.get_cog('Reminder').reminder_service.add_reminder(reminder)
 
             await ctx.edit_custom(m, base_msg + f"Success! I will remind you to get your daily again "
                                                 f"in {reminder.time_obj.initial_remaining_string}.")
@@ -511,8 +529,6 @@ class Gambling(
         msg = await ctx.send(embed=e)
         await msg.add_reaction(mido_utils.emotes.currency)
 
-        self.bot.loop.create_task(msg.delete(delay=length.remaining_seconds))
-
         event = await DonutEvent.create(bot=ctx.bot,
                                         guild_id=ctx.guild.id,
                                         channel_id=ctx.channel.id,
@@ -520,6 +536,7 @@ class Gambling(
                                         length=length,
                                         reward=reward)
         self.active_donut_events.append(event)
+        self.bot.scheduler.schedule(self.DONUT_EVENT_JOB_KIND, event.id, event.end_date.end_date, event)
 
     @commands.command(aliases=['curtrs'])  # not hybrid because of slash command limit
     async def transactions(self, ctx: mido_utils.Context, *, target: mido_utils.UserConverter() = None):
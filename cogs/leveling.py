@@ -7,7 +7,8 @@ import discord
 from discord.ext import commands
 
 import mido_utils
-from models.db import MemberDB, UserDB, XpAnnouncement, XpRoleReward
+import services
+from models.db import GuildDB, MemberDB, UserDB, XpAnnouncement, XpRoleReward
 
 if TYPE_CHECKING:
     from shinobu import ShinobuBot
@@ -39,6 +40,11 @@ class Leveling(
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
+        self.xp_service = services.XpService(self.bot)
+
+    def cog_unload(self):
+        self.xp_service.stop()
+
     async def get_xp_embed(self, user_or_member, db: MemberDB | UserDB) -> discord.Embed:
         e = mido_utils.Embed(bot=self.bot, title=str(user_or_member))
 
@@ -85,29 +91,34 @@ class Leveling(
 
     async def check_for_level_up(self,
                                  message: discord.Message,
-                                 member_db: MemberDB,
-                                 added=0,
-                                 added_globally=False):
-        if member_db.user.level_up_notification == XpAnnouncement.SILENT:
-            return
-
-        level, progress, required_xp_to_level_up = calculate_xp_data(member_db.total_xp)
-        global_level, global_progress, global_required_xp_to_level_up = calculate_xp_data(member_db.user.total_xp)
+                                 guild_db: GuildDB,
+                                 gain: services.XpGain,
+                                 added=0):
+        level, progress, required_xp_to_level_up = calculate_xp_data(gain.member_xp)
+        global_level, global_progress, global_required_xp_to_level_up = calculate_xp_data(gain.user_xp)
 
-        lvld_up_in_guild = progress < added
-        lvld_up_globally = global_progress < added
+        lvld_up_in_guild = gain.added_in_guild and progress < added
+        lvld_up_globally = gain.added_globally and global_progress < added
 
         if not (lvld_up_globally or lvld_up_in_guild):
             return
 
+        if lvld_up_in_guild:
+            await self.check_member_xp_role_reward(message.author, total_xp=gain.member_xp)
+
+        # level ups are rare, so getting the preference from the db here is fine
+        user_db = await UserDB.get_or_create(bot=self.bot, user_id=message.author.id)
+        if user_db.level_up_notification == XpAnnouncement.SILENT:
+            return
+
         msg = f"🎉 **Congratulations {message.author.mention}!** 🎉\n"
 
         if lvld_up_in_guild:
             msg += f"You've just leveled up to **{level}** in {str(message.guild)}!\n"
-        if lvld_up_globally and added_globally:
+        if lvld_up_globally:
             msg += f"You've just leveled up to **{global_level}** globally!"
 
-        if member_db.user.level_up_notification == XpAnnouncement.DM or member_db.guild.level_up_notifs_silenced:
+        if user_db.level_up_notification == XpAnnouncement.DM or guild_db.level_up_notifs_silenced:
             # if the preference is DMs or notifs are silenced in that guild, send it in DMs
             channel = message.author
         else:
@@ -118,19 +129,19 @@ class Leveling(
         except discord.Forbidden:
             pass
 
-        if lvld_up_in_guild:
-            await self.check_member_xp_role_reward(message.author, member_db=member_db)
-
     async def check_guild_xp_role_rewards(self, guild_id: int = None):
         guild_discord: discord.Guild = self.bot.get_guild(guild_id)
         for member in guild_discord.members:
             await self.check_member_xp_role_reward(member)
 
-    async def check_member_xp_role_reward(self, member: discord.Member, member_db: MemberDB = None):
-        member_db = member_db or await MemberDB.get_or_create(self.bot, member.guild.id, member.id)
-        level, progress, required_xp_to_level_up = calculate_xp_data(member_db.total_xp)
+    async def check_member_xp_role_reward(self, member: discord.Member, total_xp: int = None):
+        if total_xp is None:
+            member_db = await MemberDB.get_or_create(self.bot, member.guild.id, member.id)
+            total_xp = member_db.total_xp
 
-        role_rewards = await XpRoleReward.get_all(bot=self.bot, guild_id=member_db.guild.id)
+        level, progress, required_xp_to_level_up = calculate_xp_data(total_xp)
+
+        role_rewards = await XpRoleReward.get_all(bot=self.bot, guild_id=member.guild.id)
         eligible_role_rewards = [reward for reward in role_rewards if reward.level <= level]
 
         for reward in eligible_role_rewards:
@@ -145,26 +156,17 @@ class Leveling(
         if not self.bot.should_listen_to_msg(message, guild_only=True):
             return
 
-        member_db = await MemberDB.get_or_create(bot=self.bot,
-                                                 guild_id=message.guild.id,
-                                                 member_id=message.author.id)
-        if message.channel.id in member_db.guild.xp_excluded_channels:
+        guild_db = await GuildDB.get_or_create(bot=self.bot, guild_id=message.guild.id)
+        if message.channel.id in guild_db.xp_excluded_channels:
             return
 
-        can_gain_xp = member_db.xp_status.end_date_has_passed
-        can_gain_xp_global = member_db.user.xp_status.end_date_has_passed
+        gain = await self.xp_service.gain_xp(guild_id=message.guild.id, user_id=message.author.id, amount=3)
 
         # if on cooldown
-        if not can_gain_xp and not can_gain_xp_global:
+        if not gain:
             return
 
-        if can_gain_xp:
-            await member_db.add_xp(amount=3)
-
-        if can_gain_xp_global:
-            await member_db.user.add_xp(amount=3)
-
-        await self.check_for_level_up(message, member_db, added=3, added_globally=can_gain_xp_global)
+        await self.check_for_level_up(message, guild_db, gain, added=3)
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
@@ -375,6 +377,7 @@ class Leveling(
 
         member_db = await MemberDB.get_or_create(bot=ctx.bot, guild_id=ctx.guild.id, member_id=member.id)
         await member_db.add_xp(amount, owner=True)
+        self.xp_service.forget(guild_id=ctx.guild.id, user_id=member.id)
 
         await ctx.send_success("Success!")
 
@@ -386,6 +389,7 @@ class Leveling(
 
         user_db = await UserDB.get_or_create(bot=ctx.bot, user_id=member.id)
         await user_db.add_xp(amount, owner=True)
+        self.xp_service.forget(user_id=member.id)
 
         await ctx.send_success("Success!")
 
@@ -397,6 +401,7 @@ class Leveling(
 
         member_db = await MemberDB.get_or_create(bot=ctx.bot, guild_id=ctx.guild.id, member_id=member.id)
         await member_db.remove_xp(amount)
+        self.xp_service.forget(guild_id=ctx.guild.id, user_id=member.id)
 
         await ctx.send_success("Success!")
 
@@ -408,6 +413,7 @@ class Leveling(
 
         member_db = await UserDB.get_or_create(bot=ctx.bot, user_id=member.id)
         await member_db.remove_xp(amount)
+        self.xp_service.forget(user_id=member.id)
 
         await ctx.send_success("Success!")
 
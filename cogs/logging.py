@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime
 from enum import Enum, auto
 from io import StringIO
@@ -6,7 +7,8 @@ import discord
 from discord.ext import commands, tasks
 
 import mido_utils
-from models.db import GuildLoggingDB, LoggedMessage
+from models.db import GuildDB, GuildLoggingDB, LoggedMessage, MessageDictionaryDB
+from services import CachedMessage, MessageCache, WebhookOutbox
 from shinobu import ShinobuBot
 
 
@@ -30,28 +32,139 @@ class Logging(
     commands.Cog,
     description="Disable or enable logging in the current channel using `{ctx.prefix}logging` "
                 "and toggle between simple and detailed mode using `{ctx.prefix}loggingmode`."):
+    MAX_PENDING_MESSAGES = 5_000
+    LOAD_RETRY_DELAY = 10.0
+
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
         self.guild_config_cache: dict[int, GuildLoggingDB] = dict()
 
-        self.message_cache = list()
+        # messages are only captured in the guilds that have logging enabled
+        self.logging_guild_ids: set[int] = set()
+        self.load_logging_guilds_task = self.bot.loop.create_task(self.load_logging_guilds())
+
+        # recent messages of the logging guilds. also buffers them until they're written to the db
+        self.message_cache = MessageCache()
+        # guilds that had a message since the last insert
+        self.active_guild_ids: set[int] = set()
+
+        # a single insert at a time. message storms start one before the loop does
+        self.insert_lock = asyncio.Lock()
+        self.early_insert_task: asyncio.Task | None = None
+        # early inserts wait for the loop to get through after a failure
+        self.last_insert_failed = False
+
+        # batches the log entries of every logging channel into as few webhook messages as it can
+        self.outbox = WebhookOutbox(self.bot, on_forbidden=self.on_logging_channel_forbidden)
 
-        # delete old messages if we're the first cluster
-        if self.bot.cluster_id == 0:
-            self.bot.loop.create_task(LoggedMessage.delete_old_messages(self.bot))
+        # creates the upcoming partitions of message_log and drops the expired ones
+        self.bot.cluster_jobs.add_singleton_job('message_log_retention', self.maintain_message_log)
 
         self.cache_to_db_task.start()
 
+    async def maintain_message_log(self):
+        while True:
+            await LoggedMessage.create_partitions(self.bot)
+
+            dropped = await LoggedMessage.drop_old_partitions(self.bot)
+            if dropped:
+                self.bot.logger.info(f"Dropped expired message log partitions: {', '.join(dropped)}")
+
+            # keep the compression dictionary in line with what people are currently sending
+            if self.bot.message_codec.needs_training():
+                dictionary_id = await self.bot.message_codec.train_dictionary()
+                if dictionary_id:
+                    self.bot.logger.info(f"Trained message dictionary #{dictionary_id}.")
+
+            # messages live up to a day longer than RETENTION_DAYS, and clusters switch dictionaries a bit late
+            await MessageDictionaryDB.delete_expired(self.bot, keep_days=LoggedMessage.RETENTION_DAYS + 2)
+
+            await asyncio.sleep(60 * 60)
+
+    async def load_logging_guilds(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                # update instead of assigning, as the logging command might have been used in the meantime
+                self.logging_guild_ids.update(await GuildLoggingDB.get_logging_guild_ids(self.bot))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception(f"Error while loading the logging guilds. "
+                                          f"Retrying in {self.LOAD_RETRY_DELAY} seconds...")
+                await asyncio.sleep(self.LOAD_RETRY_DELAY)
+            else:
+                break
+
+    async def set_logging_channel(self, guild_settings: GuildLoggingDB, channel_id: int | None):
+        await guild_settings.set_log_channel(channel_id)
+
+        if channel_id is None:
+            self.logging_guild_ids.discard(guild_settings.id)
+        else:
+            self.logging_guild_ids.add(guild_settings.id)
+
+    async def on_logging_channel_forbidden(self, channel: discord.TextChannel):
+        try:
+            guild_settings = self.guild_config_cache[channel.guild.id]
+        except KeyError:
+            guild_settings = await GuildLoggingDB.get_or_create(bot=self.bot, guild_id=channel.guild.id)
+
+        try:
+            await channel.send("Due to missing permissions, I am stopping the logging feature.")
+        except discord.Forbidden:
+            pass
+        finally:
+            await self.set_logging_channel(guild_settings, None)  # disable
+
     async def insert_cache_to_db(self):
-        time = mido_utils.Time()
-        to_db, self.message_cache = self.message_cache, []
-        await LoggedMessage.insert_bulk(self.bot, to_db)
-        self.bot.logger.debug("Inserting cached messages to DB took:\t" + time.passed_seconds_in_float_formatted)
+        async with self.insert_lock:
+            time = mido_utils.Time()
+            to_db = self.message_cache.take_pending()
+            active_guild_ids, self.active_guild_ids = self.active_guild_ids, set()
+
+            try:
+                if to_db:
+                    await LoggedMessage.insert_bulk(self.bot, to_db)
+            except BaseException:  # including cancellation
+                # they're written with the next insert
+                self.message_cache.restore_pending(to_db)
+                self.active_guild_ids.update(active_guild_ids)
+                self.last_insert_failed = True
+                raise
+
+            try:
+                if active_guild_ids:
+                    await GuildDB.update_active_guilds(self.bot, list(active_guild_ids))
+            except BaseException:
+                self.active_guild_ids.update(active_guild_ids)
+                self.last_insert_failed = True
+                raise
+
+            self.last_insert_failed = False
+
+            self.bot.logger.debug("Inserting cached messages to DB took:\t" + time.passed_seconds_in_float_formatted)
+
+    async def insert_cache_to_db_early(self):
+        try:
+            await self.insert_cache_to_db()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.bot.logger.exception("Error while inserting a message storm to the DB. "
+                                      "The messages will be retried with the next insert.")
 
     @tasks.loop(seconds=30.0)
     async def cache_to_db_task(self):
-        await self.insert_cache_to_db()
+        try:
+            await self.insert_cache_to_db()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the loop stops for good if this raises. the messages are retried with the next insert
+            await self.bot.get_cog('ErrorHandling').on_error("Error while inserting cached messages to DB.")
 
     @cache_to_db_task.before_loop
     async def wait_for_bot_before_loop(self):
@@ -59,36 +172,50 @@ class Logging(
 
     @cache_to_db_task.after_loop
     async def on_cache_to_db_cancel(self):
-        if self.cache_to_db_task.is_being_cancelled() and len(self.message_cache) != 0:
+        if self.cache_to_db_task.is_being_cancelled() and self.message_cache.pending:
             await self.insert_cache_to_db()
 
-    @cache_to_db_task.error
-    async def on_cache_to_db_error(self, error):
-        await self.bot.get_cog('ErrorHandling').on_error(error)
+    def store_edited_message(self, payload: discord.RawMessageUpdateEvent) -> LoggedMessage | None:
+        """Replaces the cached and logged version of an edited message, so that its deletion logs the latest one."""
+        if 'author' not in payload.data:
+            return None
+
+        edited = CachedMessage.from_data(payload.data, payload.guild_id)
+
+        # older messages have no partition to be written to, and they'd fail the whole insert
+        if LoggedMessage.is_retained(edited.created_at):
+            self.message_cache.add(edited)
 
-    async def get_cached_message(self, guild_id: int, channel_id: int,
-                                 message_id: int) -> discord.Message | LoggedMessage:
-        for msg in self.message_cache:
-            if msg.id == message_id:
-                return msg
+        return LoggedMessage.from_cached(self.bot, edited)
+
+    async def get_cached_message(self, guild_id: int, channel_id: int, message_id: int) -> LoggedMessage:
+        cached = self.message_cache.get(message_id)
+        if cached:
+            return LoggedMessage.from_cached(self.bot, cached)
 
         return await LoggedMessage.get(self.bot, guild_id, channel_id, message_id)
 
-    async def get_cached_message_bulk(self, guild_id: int, channel_id: int, message_ids: list[int]) -> list[
-        discord.Message | LoggedMessage]:
+    async def get_cached_message_bulk(self, guild_id: int, channel_id: int,
+                                      message_ids: set[int]) -> list[LoggedMessage]:
         ret = []
-        for msg in self.message_cache:
-            if msg.id in message_ids:
-                ret.append(msg)
-                message_ids.remove(msg.id)
+        missing_ids = []
+        for message_id in message_ids:
+            cached = self.message_cache.get(message_id)
+            if cached:
+                ret.append(LoggedMessage.from_cached(self.bot, cached))
+            else:
+                missing_ids.append(message_id)
 
-        if message_ids:  # if there are messages left
-            ret.extend(await LoggedMessage.get_bulk(self.bot, guild_id, channel_id, message_ids))
+        if missing_ids:  # if there are messages left
+            ret.extend(await LoggedMessage.get_bulk(self.bot, guild_id, channel_id, missing_ids))
 
         return ret
 
     def cog_unload(self):
+        self.bot.cluster_jobs.remove_job('message_log_retention')
+        self.load_logging_guilds_task.cancel()
         self.cache_to_db_task.cancel()
+        self.outbox.stop()
 
     @staticmethod
     def detailed(obj: discord.Member | discord.Role | discord.TextChannel) -> str:
@@ -122,7 +249,7 @@ class Logging(
 
     async def base_logging_func(self, logging_type: LoggedEvents, *args):
         guild_id = self.get_guild_id_out_of_event(args[0])
-        if not guild_id:
+        if not guild_id or guild_id not in self.logging_guild_ids:
             return
 
         try:
@@ -132,6 +259,8 @@ class Logging(
                                                                                                     guild_id=guild_id)
 
         if not guild_settings.logging_is_enabled:
+            # the channel is gone
+            self.logging_guild_ids.discard(guild_id)
             return
 
         e = None
@@ -218,31 +347,34 @@ class Logging(
                 or logging_type is LoggedEvents.MESSAGE_EDIT:
             payload: discord.RawMessageDeleteEvent | discord.RawMessageUpdateEvent = args[0]
 
-            msg: discord.Message | LoggedMessage = payload.cached_message or await self.get_cached_message(
-                payload.guild_id, payload.channel_id, payload.message_id)
-
             if logging_type is LoggedEvents.MESSAGE_EDIT:
-                try:
-                    new_msg = await msg.channel.fetch_message(msg.id)
-                except discord.Forbidden:
+                # our cache has the version before the edit as well, so the old one is always a LoggedMessage
+                msg = await self.get_cached_message(payload.guild_id, payload.channel_id, payload.message_id)
+                if payload.data['content'] == msg.raw_content:
+                    # if the contents are identical, return
                     return
 
-                # todo: compare embed contents too
-                if new_msg.content == msg.content:
-                    # if the contents are identical, return
+                # the payload has the whole message, so there's no need to fetch it
+                new_msg = self.store_edited_message(payload)
+                if new_msg is None:
                     return
 
+                author = new_msg.author
+                if not author.id:
+                    # not in the member cache
+                    author = discord.User(state=self.bot._connection, data=payload.data['author'])
+
                 if guild_settings.simple_mode_is_enabled:
-                    e = self.get_member_event_embed(new_msg.author)
-                    e.description = f"**Message sent by {new_msg.author.mention} in {msg.channel.mention} " \
+                    e = self.get_member_event_embed(author)
+                    e.description = f"**Message sent by {author.mention} in {msg.channel.mention} " \
                                     f"has just been edited.** [Jump]({msg.jump_url})\n\n" \
                                     f"**Before:**\n" \
                                     f"{msg.content}\n" \
                                     f"**After:**\n" \
                                     f"{new_msg.content}"
-                    e.set_footer(text=f"Author ID: {new_msg.author.id} | Message ID: {msg.id}")
+                    e.set_footer(text=f"Author ID: {author.id} | Message ID: {msg.id}")
                 else:
-                    content = f"{time} :x: {self.detailed(new_msg.author)} edited their message (`{msg.id}`) " \
+                    content = f"{time} :x: {self.detailed(author)} edited their message (`{msg.id}`) " \
                               f"in {self.detailed(msg.channel)}.\n" \
                               f"**Before:**\n" \
                               f"```{msg.content}```\n" \
@@ -250,6 +382,9 @@ class Logging(
                               f"```{new_msg.content}```\n" \
                               f"<{msg.jump_url}>"
             else:
+                msg: discord.Message | LoggedMessage = payload.cached_message or await self.get_cached_message(
+                    payload.guild_id, payload.channel_id, payload.message_id)
+
                 if guild_settings.simple_mode_is_enabled:
                     e = self.get_member_event_embed(msg.author)
                     e.description = f"**Message sent by {msg.author.mention} in {msg.channel.mention} " \
@@ -293,27 +428,29 @@ class Logging(
         # length checks
         if e and isinstance(e.description, str):
             e.description = e.description[:4090]
-        content = content[:2040] if content else None
+        content = content[:WebhookOutbox.MAX_CONTENT] if content else None
 
-        try:
-            await self.bot.send_as_webhook(guild_settings.logging_channel,
-                                           content=content,
-                                           embed=e,
-                                           file=file or discord.utils.MISSING,
-                                           allowed_mentions=discord.AllowedMentions.none())
-        except discord.Forbidden:
-            try:
-                await guild_settings.logging_channel.send(
-                    "Due to missing permissions, I am stopping the logging feature.")
-            except (discord.Forbidden, AttributeError):
-                pass
-            finally:
-                await guild_settings.set_log_channel(None)  # disable
+        self.outbox.send(guild_settings.logging_channel, content=content, embed=e, file=file)
 
     @commands.Cog.listener()
     async def on_message(self, msg: discord.Message):
         if msg.guild:
-            self.message_cache.append(msg)
+            self.active_guild_ids.add(msg.guild.id)
+
+            if msg.guild.id in self.logging_guild_ids:
+                self.message_cache.add(CachedMessage.from_message(msg))
+
+                # don't let a message storm pile up until the next insert
+                if len(self.message_cache.pending) >= self.MAX_PENDING_MESSAGES \
+                        and not self.last_insert_failed \
+                        and (self.early_insert_task is None or self.early_insert_task.done()):
+                    self.early_insert_task = self.bot.loop.create_task(self.insert_cache_to_db_early())
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        # the guild might have had logging enabled before it removed us
+        if await GuildLoggingDB.get_logging_guild_ids(self.bot, guild_ids=[guild.id]):
+            self.logging_guild_ids.add(guild.id)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
@@ -346,14 +483,21 @@ class Logging(
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
         await self.base_logging_func(LoggedEvents.MESSAGE_DELETE, payload)
+        self.message_cache.pop(payload.message_id)
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # embed unfurls are partial updates or come without an edit timestamp. they're not edits of the author
+        if 'content' not in payload.data or not payload.data.get('edited_timestamp'):
+            return
+
         await self.base_logging_func(LoggedEvents.MESSAGE_EDIT, payload)
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
         await self.base_logging_func(LoggedEvents.MESSAGE_DELETE_BULK, payload)
+        for message_id in payload.message_ids:
+            self.message_cache.pop(message_id)
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member,
@@ -372,10 +516,10 @@ class Logging(
         You need Administrator permission to use this command."""
         guild_settings = await GuildLoggingDB.get_or_create(bot=self.bot, guild_id=ctx.guild.id)
         if not guild_settings.logging_is_enabled:
-            await guild_settings.set_log_channel(ctx.channel.id)
+            await self.set_logging_channel(guild_settings, ctx.channel.id)
             await ctx.send_success(f"You've successfully **enabled logging** in {ctx.channel.mention}.")
         else:
-            await guild_settings.set_log_channel(None)  # disable
+            await self.set_logging_channel(guild_settings, None)  # disable
             await ctx.send_success("You've successfully **disabled logging**.")
 
         self.guild_config_cache[ctx.guild.id] = guild_settings
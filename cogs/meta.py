@@ -1,5 +1,6 @@
 import ast
 import os
+import time
 import traceback
 from datetime import datetime
 
@@ -211,7 +212,7 @@ class Meta(commands.Cog,
         """Ping me to check the latency!"""
         color = ctx.guild.me.top_role.color if ctx.guild else self.bot.color
 
-        cluster_stats = await self.bot.ipc.get_cluster_stats()
+        cluster_stats = self.bot.stats_board.read_all()
 
         embed_msg = mido_utils.Embed(bot=ctx.bot,
                                      title='Ping!',
@@ -224,7 +225,7 @@ class Meta(commands.Cog,
             latency = float(f"{cluster.latency:.3f}")
 
             latency = mido_utils.readable_bigint(latency * 1000)
-            embed_msg.description += f'Cluster**#{cluster.author}**: **Pong! 🏓** | `{latency} ms`\n'
+            embed_msg.description += f'Cluster**#{cluster.cluster_id}**: **Pong! 🏓** | `{latency} ms`\n'
 
         await ctx.send(embed=embed_msg)
 
@@ -270,7 +271,7 @@ class Meta(commands.Cog,
         """See some info and stats about me!"""
         mido = await self.bot.get_user_using_ipc(90076279646212096)
 
-        cluster_stats = await self.bot.ipc.get_cluster_stats()
+        totals = self.bot.stats_board.get_totals()
 
         embed = mido_utils.Embed(bot=ctx.bot)
 
@@ -292,9 +293,9 @@ class Meta(commands.Cog,
                         value=mido_utils.Time.parse_seconds_to_str(self.bot.uptime.remaining_seconds, sep='\n'),
                         inline=True)
 
-        guild_count = mido_utils.readable_bigint(sum(x.guilds for x in cluster_stats))
-        channel_count = mido_utils.readable_bigint(sum(x.channels for x in cluster_stats))
-        member_count = mido_utils.readable_bigint(sum(x.members for x in cluster_stats))
+        guild_count = mido_utils.readable_bigint(totals.guilds)
+        channel_count = mido_utils.readable_bigint(totals.channels)
+        member_count = mido_utils.readable_bigint(totals.members)
         embed.add_field(name="Discord Stats",
                         value=f"{guild_count} Guilds\n"
                               f"{channel_count} Channels\n"
@@ -306,22 +307,27 @@ class Meta(commands.Cog,
         #                       f"{self.bot.command_counter} Commands",
         #                 inline=True)
 
-        music_players = mido_utils.readable_bigint(sum(x.music_players for x in cluster_stats))
-        memory = mido_utils.readable_bigint(sum(x.memory for x in cluster_stats), small_precision=True)
-
-        cpu_usages = [x.cpu_usage for x in cluster_stats]
-        try:
-            average_cpu = sum(cpu_usages) / len(cpu_usages)
-        except ZeroDivisionError:
-            average_cpu = 0
+        music_players = mido_utils.readable_bigint(totals.music_players)
+        memory = mido_utils.readable_bigint(totals.memory, small_precision=True)
 
         embed.add_field(name="Performance",
-                        value=f"Clusters: {len(cluster_stats)}/{self.bot.cluster_count}\n"
-                              f"Average CPU: {average_cpu:.2f}%\n"
+                        value=f"Clusters: {totals.clusters}/{self.bot.cluster_count}\n"
+                              f"Average CPU: {totals.average_cpu:.2f}%\n"
                               f"Total Memory: {memory} MB\n"
                               f"Music Players: {music_players}\n",
                         inline=True)
 
+        restarts = [x for x in self.bot.stats_board.read_all_restarts() if x.restarts]
+        if restarts:
+            last = max(restarts, key=lambda x: x.last_restart_at)
+            ago = mido_utils.Time.parse_seconds_to_str(time.time() - last.last_restart_at, short=True)
+
+            embed.add_field(name="Cluster Restarts",
+                            value=f"Total: {sum(x.restarts for x in restarts)}\n"
+                                  f"Last: Cluster**#{last.cluster_id}** "
+                                  f"({last.last_restart_reason.name.lower()}) {ago} ago",
+                            inline=True)
+
         if mido:  # intents disabled
             embed.set_footer(icon_url=mido.display_avatar.url,
                              text=f"Made by {mido} with ♥")
@@ -331,6 +337,16 @@ class Meta(commands.Cog,
     @commands.command(hidden=True)
     @mido_utils.is_owner()
     async def reload(self, ctx: mido_utils.Context, cog_name: str = None):
+        """Reloads every cog or the specified one.
+        Use `{ctx.prefix}reload clusters` to restart every cluster one by one without downtime."""
+        if cog_name == 'clusters':
+            if self.bot.pipe_connection is None:
+                raise commands.UserInputError("I'm not launched by the cluster manager.")
+
+            self.bot.send_to_launcher({'type': 'rolling_restart'})
+            return await ctx.send_success("Rolling restart has been requested. "
+                                          "Progress will be posted to the log channel.")
+
         # TODO: reload config inside ipc function so that all clusters reload the config
         self.bot.config = self.bot.get_config(self.bot.name, warn=False)
 
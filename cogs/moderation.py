@@ -1,7 +1,8 @@
 import typing
+from datetime import datetime
 
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 import mido_utils
 from models import ModLog
@@ -19,10 +20,12 @@ class Moderation(
     commands.Cog,
     description="Ban/mute temporarily, hold logs, manage roles, "
                 "prune messages quickly to moderate your server easily."):
+    MODLOG_JOB_KIND = 'modlog'
+
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
-        self.check_modlogs.start()
+        self.bot.scheduler.register(self.MODLOG_JOB_KIND, load=self.load_open_modlogs, run=self.complete_modlog)
 
     def cog_check(self, ctx):  # guild only
         if not ctx.guild:
@@ -30,43 +33,37 @@ class Moderation(
         else:
             return True
 
-    @tasks.loop(seconds=30.0)
-    async def check_modlogs(self):
-        time = mido_utils.Time()
-        open_modlogs = await ModLog.get_open_logs(bot=self.bot)
-
-        for modlog in open_modlogs:
-            # if its the time
-            if modlog.time_status.end_date_has_passed:
-                guild = self.bot.get_guild(modlog.guild_id)
-                if guild:
-                    if modlog.type == ModLog.Type.BAN:
-                        member = discord.Object(id=modlog.user_id)
-                        try:
-                            await guild.unban(member, reason='ModLog time has expired. (Auto-Unban)')
-                        except discord.NotFound:
-                            pass
-
-                    elif modlog.type == ModLog.Type.MUTE:
-                        member = guild.get_member(modlog.user_id)
-                        if member:
-                            mute_role = await self.get_or_create_muted_role(guild)
-                            if mute_role in member.roles:
-                                await member.remove_roles(mute_role, reason='ModLog time has expired. (Auto-Unmute)')
-
-                await modlog.complete()
-        self.bot.logger.debug("Checking modlogs took:\t\t" + time.passed_seconds_in_float_formatted)
-
-    @check_modlogs.before_loop
-    async def wait_for_bot_before_loop(self):
-        await self.bot.wait_until_ready()
-
-    @check_modlogs.error
-    async def task_error(self, error):
-        await self.bot.get_cog('ErrorHandling').on_error(error)
+    async def load_open_modlogs(self, due_before: datetime):
+        open_modlogs = await ModLog.get_open_logs(bot=self.bot, due_before=due_before)
+
+        return [(modlog.id, modlog.due_at, modlog) for modlog in open_modlogs]
+
+    def schedule_modlog(self, modlog: ModLog):
+        # permanent punishments don't expire
+        if modlog.due_at:
+            self.bot.scheduler.schedule(self.MODLOG_JOB_KIND, modlog.id, modlog.due_at, modlog)
+
+    async def complete_modlog(self, modlog: ModLog):
+        guild = self.bot.get_guild(modlog.guild_id)
+        if guild:
+            if modlog.type == ModLog.Type.BAN:
+                member = discord.Object(id=modlog.user_id)
+                try:
+                    await guild.unban(member, reason='ModLog time has expired. (Auto-Unban)')
+                except discord.NotFound:
+                    pass
+
+            elif modlog.type == ModLog.Type.MUTE:
+                member = guild.get_member(modlog.user_id)
+                if member:
+                    mute_role = await self.get_or_create_muted_role(guild)
+                    if mute_role in member.roles:
+                        await member.remove_roles(mute_role, reason='ModLog time has expired. (Auto-Unmute)')
+
+        await modlog.complete()
 
     def cog_unload(self):
-        self.check_modlogs.cancel()
+        self.bot.scheduler.unregister(self.MODLOG_JOB_KIND)
 
     @staticmethod
     def get_reason_string(reason=None) -> str:
@@ -196,6 +193,7 @@ class Moderation(
                                          executor_id=ctx.author.id,
                                          _type=ModLog.Type.BAN,
                                          length=length)
+        self.schedule_modlog(modlog)
 
         await ctx.send_success(f"`{modlog.id}` {action_emotes['ban']} "
                                f"User **{getattr(target, 'mention', target.id)}** "
@@ -281,6 +279,7 @@ class Moderation(
                                          executor_id=ctx.author.id,
                                          _type=ModLog.Type.MUTE,
                                          length=length)
+        self.schedule_modlog(modlog)
 
         await ctx.send_success(f"`{modlog.id}` {action_emotes['mute']} "
                                f"User **{getattr(target, 'mention', target.id)}** "
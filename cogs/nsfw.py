@@ -1,8 +1,9 @@
 import asyncio
 import random
+from datetime import timedelta
 
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 import mido_utils
 from mido_utils.apis import NsfwDAPIs
@@ -28,11 +29,14 @@ class NSFW(commands.Cog,
         self.active_auto_nsfw_services = list()
         self.start_auto_nsfw_task = self.bot.loop.create_task(self.start_auto_nsfw_services())
 
+        # these work on the shared api_cache table, so they run on a single cluster
         if self.bot.config.reddit_automatically_pull_hot_posts:
-            self.fetch_and_save_hot_posts_from_reddit.start()
+            self.bot.cluster_jobs.add_periodic_job('reddit_hot_posts',
+                                                   self.fetch_and_save_hot_posts_from_reddit,
+                                                   interval=timedelta(hours=12))
 
         if self.bot.config.reddit_automatically_check_saved_posts:
-            self.start_checking_urls_task = self.bot.loop.create_task(self.start_checking_urls_in_db())
+            self.bot.cluster_jobs.add_partitioned_job('nsfw_url_checker', self.start_checking_urls_in_db)
 
         self.cache: RedisCache = RedisCache(self.bot)
         self.cache_expiration_in_seconds = 3600
@@ -114,13 +118,13 @@ class NSFW(commands.Cog,
 
         return ret
 
-    async def start_checking_urls_in_db(self):
-        await self.bot.wait_until_ready()
-
-        self.bot.logger.info("Dead image checking service has started.")
+    async def start_checking_urls_in_db(self, partition: int, partition_count: int):
+        self.bot.logger.info(f"Dead image checking service has started for partition {partition}.")
 
         while True:
-            images = await CachedImage.get_oldest_checked_images(self.bot, limit=100)
+            images = await CachedImage.get_oldest_checked_images(self.bot, limit=100,
+                                                                 partition=partition,
+                                                                 partition_count=partition_count)
             for image in images:
                 time = mido_utils.Time()
                 try:
@@ -218,7 +222,6 @@ class NSFW(commands.Cog,
                 f"for NSFW type {nsfw_type.name} "
                 f"crashed due to the following exception:")
 
-    @tasks.loop(hours=12.0)
     async def fetch_and_save_hot_posts_from_reddit(self):
         time = mido_utils.Time()
 
@@ -228,14 +231,6 @@ class NSFW(commands.Cog,
 
         self.bot.logger.debug('Checking hot posts from Reddit took:\t' + time.passed_seconds_in_float_formatted)
 
-    @fetch_and_save_hot_posts_from_reddit.before_loop
-    async def wait_for_bot_before_loop(self):
-        await self.bot.wait_until_ready()
-
-    @fetch_and_save_hot_posts_from_reddit.error
-    async def task_error(self, error):
-        await self.bot.get_cog('ErrorHandling').on_error(error)
-
     async def cog_check(self, ctx: mido_utils.Context):
         bucket = self._cd.get_bucket(ctx.message)
         retry_after = bucket.update_rate_limit()
@@ -251,8 +246,8 @@ class NSFW(commands.Cog,
         self.bot.loop.create_task(self.cache.disconnect())
 
         self.start_auto_nsfw_task.cancel()
-        self.start_checking_urls_task.cancel()
-        self.fetch_and_save_hot_posts_from_reddit.cancel()
+        self.bot.cluster_jobs.remove_job('reddit_hot_posts')
+        self.bot.cluster_jobs.remove_job('nsfw_url_checker')
 
         for task in self.active_auto_nsfw_services:
             task.cancel()
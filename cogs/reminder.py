@@ -13,8 +13,6 @@ if TYPE_CHECKING:
     from shinobu import ShinobuBot
 
 
-# todo: share reminders across clusters so that not all of them send a message
-
 class Reminder(commands.Cog, description='Use `{ctx.prefix}remind` to remind yourself or someone of something.'):
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
@@ -61,8 +59,9 @@ class Reminder(commands.Cog, description='Use `{ctx.prefix}remind` to remind you
                                            channel_id=channel_id,
                                            channel_type=channel_type,
                                            content=str(message),
-                                           date_obj=length)
-        self.reminder_service.add_reminder(reminder)
+                                           date_obj=length,
+                                           guild_id=getattr(getattr(channel, 'guild', None), 'id', None))
+        await self.reminder_service.add_reminder(reminder)
 
         e = mido_utils.Embed(bot=ctx.bot,
                              description=f"Success! "
@@ -122,8 +121,8 @@ class Reminder(commands.Cog, description='Use `{ctx.prefix}remind` to remind you
         except IndexError:
             raise commands.UserInputError("Invalid reminder index!")
 
-        self.reminder_service.cancel_reminder(reminder_to_remove)
         await reminder_to_remove.complete()
+        await self.reminder_service.cancel_reminder(reminder_to_remove)
 
         await ctx.send_success(f"Reminder **#{reminder_index}** has been successfully deleted.")
 
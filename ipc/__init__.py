@@ -1,2 +1,3 @@
 from .ipc_errors import *
 from .ipc_funcs import *
+from .stats_board import *
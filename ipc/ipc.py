@@ -6,6 +6,9 @@ import sys
 
 import websockets
 
+# this is run as a script, so ipc_wire is imported as a top level module
+import ipc_wire
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--port",
                     type=int,
@@ -50,18 +53,45 @@ async def serve(ws: websockets.WebSocketServerProtocol):
 
     try:
         async for msg in ws:
-            logger.info(f'< Cluster[{cluster_id}]: {msg}')
-            await dispatch_to_all_clusters(msg)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'< Cluster[{cluster_id}]: {msg}')
+
+            try:
+                target = ipc_wire.get_target(msg)
+            except (TypeError, ValueError, IndexError):
+                logger.warning(f'! Cluster[{cluster_id}] sent a message that is not in the binary format. Dropping.')
+                continue
+
+            if target is None:
+                await dispatch_to_all_clusters(msg)
+            else:
+                await dispatch_to_cluster(f'{cluster_id.rsplit("#", 1)[0]}#{target}', msg)
     except websockets.ConnectionClosed as e:
         logger.error(f'$ Cluster[{cluster_id}]\'s connection has been closed: {e}')
     finally:
-        CLIENTS.pop(cluster_id)
+        # don't remove the connection that replaced this one
+        if CLIENTS.get(cluster_id) is ws:
+            CLIENTS.pop(cluster_id)
         logger.info(f"$ Cluster[{cluster_id}] disconnected.")
 
 
 async def dispatch_to_all_clusters(data):
     websockets.broadcast(CLIENTS.values(), data)
-    logger.debug(f'> Sent message to clusters {",".join(CLIENTS.keys())}: {data}')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f'> Sent message to clusters {",".join(CLIENTS.keys())}: {data}')
+
+
+async def dispatch_to_cluster(cluster_id: str, data):
+    try:
+        await CLIENTS[cluster_id].send(data)
+    except KeyError:
+        logger.warning(f'! Cluster[{cluster_id}] is not connected. Dropping the message: {data}')
+    except websockets.ConnectionClosed:
+        # serve() will clean it up
+        pass
+    else:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'> Sent message to cluster {cluster_id}: {data}')
 
 
 async def main():
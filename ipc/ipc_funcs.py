@@ -1,19 +1,18 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import os
-import uuid
-from datetime import datetime
+import random
+import time
 from typing import TYPE_CHECKING, Type
 
 import discord
-import psutil
 import websockets
 from async_timeout import timeout
 
-from ipc import ipc_errors
-from mido_utils import Time
+import models
+from ipc import ipc_errors, ipc_wire
+from ipc.ipc_wire import MessageType
 from models.patreon import PatreonPledger
 
 __all__ = ['IPCClient', 'SerializedObject']
@@ -21,20 +20,25 @@ __all__ = ['IPCClient', 'SerializedObject']
 if TYPE_CHECKING:
     from shinobu import ShinobuBot
 
-DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
-
-# todo: possibly rewrite this
 class IPCMessage:
-    MANDATORY_ATTRS = ('author', 'type', 'key')
+    __slots__ = ('author', 'type', 'key', 'target', 'successful', 'created_at', '_data')
+
+    def __init__(self, author: int, type: MessageType, key: int, data: dict, created_at: float = None,
+                 successful: bool = True, target: int = None):
+        # data fields that share a name with a slot would be shadowed by it on the receiving end
+        shadowed = data.keys() & set(self.__slots__)
+        if shadowed:
+            raise ValueError(f"IPC message data can't have these fields: {', '.join(sorted(shadowed))}")
 
-    def __init__(self, author: id, type: str, key: str, data: dict, created_at: str = None, successful: bool = True):
         self._data = data
 
         # cluster id
         self.author = author
 
-        # 'response' or 'command'
+        # id of the cluster this message is for. None means every cluster
+        self.target = target
+
         self.type = type
 
         # unique key to identify the requester
@@ -43,48 +47,46 @@ class IPCMessage:
         # whether the response is successful or not
         self.successful = successful
 
-        # creation date
-        self.created_at: Time = Time(datetime.strptime(created_at, DATE_FORMAT), offset_naive=True) if created_at \
-            else Time(datetime.now())
+        # creation date as a unix timestamp
+        self.created_at = created_at if created_at is not None else time.time()
 
     def __getattr__(self, item):
-        if self.type == 'response' and isinstance(self._data['return_value'], dict) and item != 'return_value':
+        # only called for the data fields as everything else is a slot
+        if item.startswith('_'):
+            raise AttributeError(item)
+
+        if self.type is MessageType.RESPONSE and isinstance(self._data['return_value'], dict) \
+                and item != 'return_value':
             data_to_look_for = self._data['return_value']
         else:
             data_to_look_for = self._data
 
-        if item in data_to_look_for.keys():
+        try:
             return data_to_look_for[item]
+        except KeyError:
+            raise AttributeError(item) from None
+
+    def dumps(self) -> bytes:
+        return ipc_wire.pack(type=self.type,
+                             author=self.author,
+                             target=self.target,
+                             key=self.key,
+                             created_at=self.created_at,
+                             successful=self.successful,
+                             payload=self._data)
 
-        return super().__getattribute__(item)
-
-    # def __setattr__(self, key, value):
-    #     if key in self.MANDATORY_ATTRS:
-    #         return super().__setattr__(key, value)
-    #
-    #     self._data[key] = value
-
-    def to_json(self) -> dict:
-        return {'author'    : self.author,
-                'type'      : self.type,
-                'key'       : self.key,
-                'successful': self.successful,
-                'created_at': self.created_at.start_date.strftime(DATE_FORMAT),
-                'data'      : self._data}
-
-    def dumps(self) -> str:
-        return json.dumps(self.to_json())
+    @classmethod
+    def loads(cls, frame: bytes) -> IPCMessage:
+        type, author, target, key, created_at, successful, data = ipc_wire.unpack(frame)
+        return cls(author=author, type=type, key=key, data=data, created_at=created_at, successful=successful,
+                   target=target)
 
     def __str__(self):
         return self.__repr__()
 
     def __repr__(self):
-        return self.dumps()
-
-    @classmethod
-    def get_from_raw(cls, response: str) -> IPCMessage:
-        response = json.loads(response.encode('utf8'))
-        return cls(**response)
+        return f'<IPCMessage type={self.type.name} author={self.author} target={self.target} key={self.key} ' \
+               f'successful={self.successful} data={self._data}>'
 
 
 class SerializedObject:
@@ -106,9 +108,66 @@ class SerializedObject:
         return cls
 
 
+class _ResponseCollector:
+    """Collects the responses of a single request and resolves as soon as the expected responses arrive."""
+    __slots__ = ('expected', 'first_non_null', 'responses', 'future')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, expected: int, first_non_null: bool = False):
+        self.expected = expected
+
+        # resolve with the first response that returns something instead of waiting for every cluster
+        self.first_non_null = first_non_null
+
+        self.responses: list[IPCMessage] = []
+        self.future: asyncio.Future = loop.create_future()
+
+    def add(self, response: IPCMessage):
+        # we might've timed out already
+        if self.future.done():
+            return
+
+        # if there was an error, raise it
+        if response.successful is False:
+            self.future.set_exception(ipc_errors.RequestFailed(response.return_value))
+            return
+
+        self.responses.append(response)
+
+        if (self.first_non_null and response.return_value is not None) or len(self.responses) >= self.expected:
+            self.future.set_result(self.responses)
+
+
+class _EndpointStats:
+    """Execution time stats of an endpoint in this cluster."""
+    __slots__ = ('calls', 'failures', 'total_seconds', 'max_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds: float, failed: bool = False):
+        self.calls += 1
+        if failed:
+            self.failures += 1
+
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_dict(self) -> dict:
+        return {'calls'          : self.calls,
+                'failures'       : self.failures,
+                'average_seconds': self.total_seconds / self.calls if self.calls else 0.0,
+                'max_seconds'    : self.max_seconds}
+
+
 class _InternalIPCHandler:
     """Handles receiving and sending requests."""
 
+    # the code the ipc server closes the connection with when another client connects with the same identity
+    REPLACED_CLOSE_CODE = 4029
+
     # noinspection PyTypeChecker
     def __init__(self, server: IPCServer):
         self.server = server
@@ -120,15 +179,23 @@ class _InternalIPCHandler:
         self.ws: websockets.WebSocketClientProtocol | None = None
         self.ws_task: asyncio.Task | None = None
 
-        self.responses = asyncio.Queue()  # or LifoQueue() ?
-        self.key_queue = []
+        # request key -> collector of the request's responses
+        self.collectors: dict[int, _ResponseCollector] = dict()
+
+        # commands that other clusters sent us
+        self.command_semaphore = asyncio.Semaphore(self.bot.config.ipc_max_concurrent_commands)
+        self.command_tasks: set[asyncio.Task] = set()
+        self.endpoint_stats: dict[str, _EndpointStats] = dict()
 
         self.bot.loop.create_task(self._connect_to_ipc())
         self.attempting_reconnect = True
 
+        # whether another process with our identity (our replacement in a rolling restart) took over
+        self.replaced = False
+
     @staticmethod
-    def get_key() -> str:
-        return uuid.uuid4().hex[:7]
+    def get_key() -> int:
+        return random.getrandbits(32)
 
     async def _connect_to_ipc(self):
         await self.bot.wait_until_ready()
@@ -154,6 +221,9 @@ class _InternalIPCHandler:
         self.assign_ws_task()
 
     def assign_ws_task(self):
+        if self.replaced:
+            return
+
         if not self.ws_task or self.ws_task.done() is True:
             # if self.ws_task:  # make sure its stopped
             #     self.ws_task.cancel()
@@ -165,36 +235,32 @@ class _InternalIPCHandler:
         self.bot.logger.info("IPC websocket loop has started.")
         while True:
             try:
-                data = IPCMessage.get_from_raw(await self.ws.recv())
+                data = IPCMessage.loads(await self.ws.recv())
 
-                if data.type == 'response':
+                if data.type is MessageType.RESPONSE:
                     # if we're waiting for this, get it, else, ignore
-                    if data.key in self.key_queue:
-                        await self.responses.put(data)
+                    collector = self.collectors.get(data.key)
+                    if collector is not None:
+                        collector.add(data)
                         self.bot.logger.debug(f"Websocket received: {data}")
-                    continue
-
-                elif data.type == 'command':
-                    try:
-                        returned_value = await getattr(self.server, data.endpoint)(data)
-                    except Exception as e:
-                        ret = IPCMessage(author=self.bot.cluster_id,
-                                         type='response',
-                                         key=data.key,
-                                         successful=False,
-                                         data={'return_value': str(e)})
-                    else:
-                        ret = IPCMessage(author=self.bot.cluster_id,
-                                         type='response',
-                                         key=data.key,
-                                         data={'return_value': returned_value})
-
-                    await self._send(ret.dumps())
-                    self.bot.logger.debug("Responded with: " + ret.dumps())
+
+                elif data.type in (MessageType.COMMAND, MessageType.EVENT):
+                    # run it in the background so that a slow endpoint doesn't block the others
+                    task = self.bot.loop.create_task(self._run_command(data))
+                    self.command_tasks.add(task)
+                    task.add_done_callback(self.command_tasks.discard)
                 else:
                     raise ipc_errors.UnknownRequestType
 
+            except ipc_wire.UnsupportedWireVersion as e:
+                # probably sent by a cluster that's running a newer version
+                self.bot.logger.warning(f"Ignoring an IPC message: {e}")
+
             except websockets.ConnectionClosed as exc:
+                if exc.code == self.REPLACED_CLOSE_CODE:
+                    self.replaced = True
+                    return self.bot.logger.info("Another process with our identity took over the IPC connection.")
+
                 self.bot.logger.error(f"Websocket connection seems to be closed with code {exc.code}.")
                 await self._try_to_reconnect(sleep=3.0)
 
@@ -209,58 +275,97 @@ class _InternalIPCHandler:
             except Exception:
                 self.bot.logger.exception("Unexpected error in websocket loop!")
 
-            await asyncio.sleep(0.01)  # small sleep to not hog
+    async def _run_command(self, data: IPCMessage):
+        async with self.command_semaphore:
+            start = time.perf_counter()
+            try:
+                returned_value = await getattr(self.server, data.endpoint)(data)
+            except Exception as e:
+                self._record_endpoint_stats(data.endpoint, time.perf_counter() - start, failed=True)
+                ret = IPCMessage(author=self.bot.cluster_id,
+                                 type=MessageType.RESPONSE,
+                                 key=data.key,
+                                 successful=False,
+                                 target=data.author,
+                                 data={'return_value': str(e)})
+            else:
+                self._record_endpoint_stats(data.endpoint, time.perf_counter() - start)
+                ret = IPCMessage(author=self.bot.cluster_id,
+                                 type=MessageType.RESPONSE,
+                                 key=data.key,
+                                 target=data.author,
+                                 data={'return_value': returned_value})
+
+        # events don't expect a response
+        if data.type is MessageType.EVENT:
+            return
 
-    async def _get_responses(self, key: str) -> list[IPCMessage]:
-        ret = []
+        await self._send(ret.dumps())
+        self.bot.logger.debug(f"Responded with: {ret}")
 
+    def _record_endpoint_stats(self, endpoint: str, seconds: float, failed: bool = False):
         try:
-            async with timeout(2.0):
-                while len(ret) < self.bot.cluster_count:
-                    item: IPCMessage = await self.responses.get()
-
-                    if item.key == str(key):
-                        # if there was an error, raise it
-                        if item.successful is False:
-                            raise ipc_errors.RequestFailed(item.return_value)
-
-                        ret.append(item)
-                    else:
-                        # if it was sent less than 10 seconds ago, put it back
-                        # as something else might be waiting to get it
-                        if item.created_at.passed_seconds < 10.0:
-                            await self.responses.put(item)
-                        await asyncio.sleep(0.001)
+            stats = self.endpoint_stats[endpoint]
+        except KeyError:
+            stats = self.endpoint_stats[endpoint] = _EndpointStats()
+
+        stats.add(seconds, failed)
 
+    async def _get_responses(self, key: int) -> list[IPCMessage]:
+        collector = self.collectors[key]
+
+        try:
+            async with timeout(2.0):
+                await collector.future
         except asyncio.TimeoutError:
             pass
-
         finally:
-            self.key_queue.remove(key)
+            del self.collectors[key]
 
         # sort responses
-        ret.sort(key=lambda x: x.author)
+        return sorted(collector.responses, key=lambda x: x.author)
 
-        return ret
+    async def request(self, endpoint: str, *, target: int = None, first_non_null: bool = False,
+                      **kwargs) -> list[IPCMessage]:
+        """Sends a request to the target cluster (or every cluster if it's None) and waits for the responses.
 
-    async def request(self, endpoint: str, **kwargs) -> list[IPCMessage]:
+        If first_non_null is True, returns as soon as a cluster returns something other than None."""
         key = self.get_key()
 
-        # put the key in the queue so that the response doesn't get ignored
-        self.key_queue.append(key)
+        # register the collector before sending so that the response doesn't get ignored
+        self.collectors[key] = _ResponseCollector(self.bot.loop,
+                                                  expected=self.bot.cluster_count if target is None else 1,
+                                                  first_non_null=first_non_null)
 
         msg = IPCMessage(author=self.bot.cluster_id,
-                         type='command',
+                         type=MessageType.COMMAND,
                          data={'endpoint': endpoint,
                                **kwargs},
-                         key=key)
+                         key=key,
+                         target=target)
 
         await self._send(msg.dumps())
-        self.bot.logger.debug("Made request to the websocket: " + msg.dumps())
+        self.bot.logger.debug(f"Made request to the websocket: {msg}")
 
         return await self._get_responses(msg.key)
 
+    async def send_event(self, endpoint: str, *, target: int = None, **kwargs) -> None:
+        """Like request, but does not wait for (or receive) any response."""
+        msg = IPCMessage(author=self.bot.cluster_id,
+                         type=MessageType.EVENT,
+                         data={'endpoint': endpoint,
+                               **kwargs},
+                         key=self.get_key(),
+                         target=target)
+
+        await self._send(msg.dumps())
+        self.bot.logger.debug(f"Sent event to the websocket: {msg}")
+
     async def _try_to_reconnect(self, sleep=1.0):
+        # reconnecting would kick our replacement
+        if self.replaced:
+            return
+
         if self.attempting_reconnect is False:
             self.attempting_reconnect = True
             self.bot.logger.info("Attempting reconnect...")
@@ -277,7 +382,10 @@ class _InternalIPCHandler:
 
         await asyncio.sleep(sleep)
 
-    async def _send(self, data: str):
+    async def _send(self, data: bytes):
+        if self.replaced:
+            return
+
         attempt = 0
         while attempt < 5:
             attempt += 1
@@ -295,6 +403,9 @@ class _InternalIPCHandler:
             self.ws_task.cancel()
             self.ws_task = None
 
+        for task in self.command_tasks:
+            task.cancel()
+
         if self.ws is not None:
             await self.ws.close(code=1000, reason=reason)
 
@@ -315,21 +426,6 @@ class IPCServer:
     def __init__(self, bot: ShinobuBot):
         self.bot = bot
 
-        self.process = psutil.Process(os.getpid())
-
-        self.cpu_usage_cache = 0
-
-        self.bot.loop.create_task(self.update_cpu_usage_cache())
-
-    async def update_cpu_usage_cache(self):
-        """Calculates the cpu usage in the last second in a non-blocking way"""
-        await self.bot.wait_until_ready()
-
-        while True:
-            self.process.cpu_percent(interval=0)
-            await asyncio.sleep(1.0)
-            self.cpu_usage_cache = self.process.cpu_percent(interval=0)
-
     async def send_to_log_channel(self, data: IPCMessage):
         await self.bot.wait_until_ready()
 
@@ -340,9 +436,6 @@ class IPCServer:
             await self.bot.log_channel.send(content=content, embed=embed)
             return True
 
-    async def get_guild_count(self, data: IPCMessage):
-        return len(self.bot.guilds)
-
     async def user_has_voted(self, data: IPCMessage):
         cog = self.bot.get_cog('Gambling')
         return await cog.user_has_voted(data.user_id)
@@ -371,19 +464,20 @@ class IPCServer:
         return False
 
     async def get_cluster_stats(self, data: IPCMessage):
+        """Detailed stats of the cluster. Use the stats board for the basic ones."""
+        logging_cog = self.bot.get_cog('Logging')
+
         return {
-            "uptime"       : self.bot.uptime.passed_seconds_in_float,
-            "cluster_id"   : self.bot.cluster_id,
-            "latency"      : self.bot.latency,
-
-            "guilds"       : len(self.bot.guilds),
-            "channels"     : len([channel for guild in self.bot.guilds for channel in guild.channels]),
-            "members"      : len(list(self.bot.get_all_members())),
-
-            "memory"       : self.process.memory_info().rss / 10 ** 6,
-            "threads"      : self.process.num_threads(),
-            "cpu_usage"    : self.cpu_usage_cache,
-            "music_players": 0  # FIXME
+            **self.bot.stats_publisher.get_stats()._asdict(),
+
+            "db_cache"     : {"GuildDB"    : models.GuildDB.CACHE.get_stats(),
+                              "GuildNSFWDB": models.GuildNSFWDB.CACHE.get_stats()},
+
+            "logging"      : {"message_cache": logging_cog.message_cache.get_stats(),
+                              "outbox"       : logging_cog.outbox.get_stats()} if logging_cog else None,
+
+            "ipc_endpoints": {endpoint: stats.to_dict()
+                              for endpoint, stats in self.bot.ipc.handler.endpoint_stats.items()}
         }
 
     async def get_patron(self, data: IPCMessage):
@@ -393,21 +487,62 @@ class IPCServer:
             if ret:
                 return ret.to_str()
 
+    async def drop_custom_reactions(self, data: IPCMessage):
+        cog = self.bot.get_cog('Custom Reactions')
+        if cog:
+            cog.cr_service.drop(data.guild_id)
+            return True
+
+    async def drop_db_cache(self, data: IPCMessage):
+        # the author has the latest copy already
+        if data.author == self.bot.cluster_id:
+            return
+
+        getattr(models, data.model_name).CACHE.drop(data.entity_id)
+
+    async def update_blacklist(self, data: IPCMessage):
+        cog = self.bot.get_cog('Blacklist')
+        if cog:
+            cog.update_blacklist(models.BlacklistDB.BlacklistType[data.bl_type], data.ids, data.blacklisted)
+
     async def convert_currency(self, data: IPCMessage):
         cog = self.bot.get_cog('Searches')
         if hasattr(cog, 'exchange_api'):
             return await cog.exchange_api.convert(data.amount, data.base_currency, data.target_currency)
 
+    async def schedule_reminder(self, data: IPCMessage):
+        cog = self.bot.get_cog('Reminder')
+        if cog:
+            reminder = await models.ReminderDB.get(bot=self.bot, reminder_id=data.reminder_id)
+            if reminder and not reminder.done:
+                cog.reminder_service.schedule_reminder(reminder)
+
+    async def cancel_reminder(self, data: IPCMessage):
+        cog = self.bot.get_cog('Reminder')
+        if cog:
+            cog.reminder_service.unschedule_reminder(data.reminder_id)
+
 
 class IPCClient:
     """Makes requests and parses args/returned values"""
 
+    # patreon, top.gg and exchange rate apis only run in the first cluster
+    MAIN_CLUSTER = 0
+
     def __init__(self, bot):
         self.bot = bot
 
         self.server = IPCServer(bot=self.bot)
         self.handler = _InternalIPCHandler(self.server)
 
+    def get_cluster_id_of_guild(self, guild_id: int) -> int:
+        """Returns the ID of the cluster that has the shard of the guild."""
+        if not self.bot.shard_count or not self.bot.shards_per_cluster:
+            return self.bot.cluster_id
+
+        shard_id = (guild_id >> 22) % self.bot.shard_count
+        return shard_id // self.bot.shards_per_cluster
+
     async def send_to_log_channel(self, content: str, embed: discord.Embed = None) -> None:
         responses = await self.handler.request('send_to_log_channel', content=content,
                                                embed=embed.to_dict() if embed else None)
@@ -418,16 +553,12 @@ class IPCClient:
                 f"Content: {content}\n"
                 f"Embed: {embed.to_dict() if embed else None}")
 
-    async def get_guild_count(self) -> int:
-        responses = await self.handler.request('get_guild_count')
-        return sum(x.return_value for x in responses)
-
     async def user_has_voted(self, user_id: int) -> bool:
-        responses = await self.handler.request('user_has_voted', user_id=user_id)
+        responses = await self.handler.request('user_has_voted', target=self.MAIN_CLUSTER, user_id=user_id)
         return any(x.return_value for x in responses)
 
     async def get_user(self, user_id: int) -> Type[SerializedObject] | None:
-        responses = await self.handler.request('get_user', user_id=user_id)
+        responses = await self.handler.request('get_user', first_non_null=True, user_id=user_id)
         for response in responses:
             if response.return_value:
                 return SerializedObject.from_dict(response.return_value)
@@ -439,23 +570,46 @@ class IPCClient:
         return [(x.author, x.return_value) for x in responses]
 
     async def shutdown(self, cluster_id: int = None) -> None:
-        await self.handler.request('shutdown', cluster_id=cluster_id)
+        await self.handler.request('shutdown', target=cluster_id, cluster_id=cluster_id)
 
     async def close_ipc(self, reason: str = 'Close called by bot.') -> None:
         await self.handler.close(reason)
 
     async def get_cluster_stats(self) -> list[IPCMessage]:
+        """Detailed stats of every cluster. Use bot.stats_board for the basic ones, which doesn't need IPC."""
         return await self.handler.request('get_cluster_stats')
 
     async def get_patron(self, user_id: int) -> PatreonPledger | None:
-        responses = await self.handler.request('get_patron', user_id=user_id)
+        responses = await self.handler.request('get_patron', target=self.MAIN_CLUSTER, user_id=user_id)
         for response in responses:
             if response.return_value is not None:
                 return PatreonPledger.from_str(response.return_value)
 
+    async def drop_custom_reactions(self, guild_id: int = None) -> None:
+        """Makes the cluster of the guild (or every cluster for global ones) reload the custom reactions
+        on the next message."""
+        target = self.get_cluster_id_of_guild(guild_id) if guild_id is not None else None
+        await self.handler.request('drop_custom_reactions', target=target, guild_id=guild_id)
+
+    async def drop_db_cache(self, model_name: str, entity_id: int) -> None:
+        """Tells other clusters to drop their cached copy of a database object."""
+        await self.handler.send_event('drop_db_cache', model_name=model_name, entity_id=entity_id)
+
+    async def update_blacklist(self, bl_type: str, ids: list[int], blacklisted: bool) -> None:
+        """Updates the in-memory blacklist of every cluster."""
+        await self.handler.send_event('update_blacklist', bl_type=bl_type, ids=ids, blacklisted=blacklisted)
+
+    async def schedule_reminder(self, cluster_id: int, reminder_id: int) -> None:
+        """Makes the cluster that owns a reminder schedule it."""
+        await self.handler.send_event('schedule_reminder', target=cluster_id, reminder_id=reminder_id)
+
+    async def cancel_reminder(self, cluster_id: int, reminder_id: int) -> None:
+        await self.handler.send_event('cancel_reminder', target=cluster_id, reminder_id=reminder_id)
+
     async def convert_currency(self, amount: float, base_currency: str, target_currency: str) -> tuple[float, float]:
         """Returns result and exchange rate"""
         responses = await self.handler.request('convert_currency',
+                                               target=self.MAIN_CLUSTER,
                                                amount=amount,
                                                base_currency=base_currency,
                                                target_currency=target_currency)
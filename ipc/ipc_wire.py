@@ -0,0 +1,85 @@
+"""
+Binary framing of the IPC messages.
+
+Every frame starts with a routing prefix that stays the same in every version,
+so that the IPC server can route frames without knowing the rest of the format:
+
+    version (u8) | target cluster (i16, -1 means every cluster)
+
+Version 1 continues with:
+
+    type (u8) | flags (u8) | author (i16) | key (u32) | created_at (f64, unix timestamp) | msgpack payload
+
+Clusters drop frames with a version they don't know, so a new version should only be sent
+once every cluster is able to read it.
+"""
+from __future__ import annotations
+
+import struct
+from enum import IntEnum
+
+import msgpack
+
+__all__ = ['WIRE_VERSION', 'MessageType', 'UnsupportedWireVersion', 'pack', 'unpack', 'get_target']
+
+WIRE_VERSION = 1
+
+ROUTING_PREFIX = struct.Struct('!Bh')
+
+# version -> header struct
+_HEADERS = {
+    1: struct.Struct('!BhBBhId')
+}
+
+_NO_TARGET = -1
+_FLAG_SUCCESSFUL = 1
+
+
+class MessageType(IntEnum):
+    COMMAND = 1
+    RESPONSE = 2
+    EVENT = 3  # a command that does not expect a response
+
+
+class UnsupportedWireVersion(Exception):
+    def __init__(self, version: int):
+        super().__init__(f"Unsupported IPC wire version: {version}")
+        self.version = version
+
+
+def pack(type: MessageType, author: int, target: int | None, key: int, created_at: float, successful: bool,
+         payload: dict) -> bytes:
+    header = _HEADERS[WIRE_VERSION].pack(WIRE_VERSION,
+                                         _NO_TARGET if target is None else target,
+                                         type,
+                                         _FLAG_SUCCESSFUL if successful else 0,
+                                         author,
+                                         key,
+                                         created_at)
+
+    return header + msgpack.packb(payload, use_bin_type=True)
+
+
+def unpack(frame: bytes) -> tuple[MessageType, int, int | None, int, float, bool, dict]:
+    """Returns type, author, target, key, created_at, successful and payload of a frame."""
+    try:
+        header = _HEADERS[frame[0]]
+    except KeyError:
+        raise UnsupportedWireVersion(frame[0])
+
+    _, target, type, flags, author, key, created_at = header.unpack_from(frame)
+    payload = msgpack.unpackb(memoryview(frame)[header.size:], raw=False, strict_map_key=False)
+
+    return (MessageType(type),
+            author,
+            None if target == _NO_TARGET else target,
+            key,
+            created_at,
+            bool(flags & _FLAG_SUCCESSFUL),
+            payload)
+
+
+def get_target(frame: bytes) -> int | None:
+    """Returns the target cluster of a frame without decoding the rest of it."""
+    target = ROUTING_PREFIX.unpack_from(frame)[1]
+    return None if target == _NO_TARGET else target
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import struct
+import time
+from enum import IntEnum
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple, TYPE_CHECKING
+
+import discord
+import psutil
+
+__all__ = ['ClusterStats', 'StatsTotals', 'RestartReason', 'ClusterRestarts', 'StatsBoard', 'StatsPublisher']
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+
+
+class ClusterStats(NamedTuple):
+    cluster_id: int
+    pid: int
+    updated_at: float
+    started_at: float
+
+    guilds: int
+    channels: int
+    members: int
+
+    latency: float
+    memory: float  # RSS in MB
+    cpu_usage: float
+    music_players: int
+    loop_lag: float
+
+    @property
+    def uptime(self) -> float:
+        return time.time() - self.started_at
+
+
+class StatsTotals(NamedTuple):
+    clusters: int
+    guilds: int
+    channels: int
+    members: int
+    music_players: int
+    memory: float
+    average_cpu: float
+
+
+class RestartReason(IntEnum):
+    CRASHED = 1
+    HUNG = 2
+    LAGGING = 3
+
+
+class ClusterRestarts(NamedTuple):
+    cluster_id: int
+    restarts: int
+    last_restart_at: float
+    last_restart_reason: RestartReason | None
+
+
+class StatsBoard:
+    """
+    A fixed-layout shared memory block that every cluster publishes its stats to.
+
+    The launcher creates it and every cluster writes to its own slot, so there is a single writer per slot.
+    The launcher also writes the restart history of every cluster to a second set of slots.
+    Slots are guarded by a sequence number which is odd while the slot is being written,
+    so readers retry instead of reading a half written slot.
+    """
+    MAGIC = b'SHST'
+    VERSION = 2
+
+    # slots that haven't been updated in this many seconds belong to clusters that are down
+    STALE_AFTER = 30.0
+
+    READ_ATTEMPTS = 100
+
+    _HEADER = struct.Struct('<4sBxH')  # magic, version, cluster count
+    _SEQ = struct.Struct('<Q')
+    _SLOT = struct.Struct('<QiddQQQdddId')  # seq + ClusterStats fields except cluster_id
+    _RESTARTS_SLOT = struct.Struct('<QIdB')  # seq + ClusterRestarts fields except cluster_id
+
+    def __init__(self, shm: SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+
+        magic, version, self.cluster_count = self._HEADER.unpack_from(shm.buf)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"Shared memory block {shm.name} is not a stats board of version {self.VERSION}.")
+
+        # offset -> sequence number of the slots we write to
+        self._seqs: dict[int, int] = dict()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, name: str | None, cluster_count: int) -> StatsBoard:
+        size = cls._HEADER.size + (cls._SLOT.size + cls._RESTARTS_SLOT.size) * cluster_count
+
+        try:
+            shm = SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a launcher that crashed
+            SharedMemory(name=name).unlink()
+            shm = SharedMemory(name=name, create=True, size=size)
+
+        shm.buf[:size] = bytes(size)
+        cls._HEADER.pack_into(shm.buf, 0, cls.MAGIC, cls.VERSION, cluster_count)
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> StatsBoard:
+        shm = SharedMemory(name=name)
+
+        # the launcher owns the block. without this, the resource tracker would unlink it when this process exits
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+        return cls(shm, owner=False)
+
+    def _offset(self, cluster_id: int) -> int:
+        if not 0 <= cluster_id < self.cluster_count:
+            raise IndexError(f"Cluster ID {cluster_id} is out of the board's range.")
+
+        return self._HEADER.size + self._SLOT.size * cluster_id
+
+    def _restarts_offset(self, cluster_id: int) -> int:
+        return self._HEADER.size + self._SLOT.size * self.cluster_count + self._RESTARTS_SLOT.size * cluster_id
+
+    def _write_slot(self, slot: struct.Struct, offset: int, fields: tuple):
+        try:
+            seq = self._seqs[offset]
+        except KeyError:
+            # carry on from the previous writer of the slot. it's odd if that one died in the middle of a write
+            seq = self._SEQ.unpack_from(self.shm.buf, offset)[0]
+            seq += seq % 2
+
+        # packed beforehand, so that a field that doesn't fit raises before the slot is left odd
+        data = slot.pack(seq + 1, *fields)
+
+        # odd while writing
+        self._SEQ.pack_into(self.shm.buf, offset, seq + 1)
+        self.shm.buf[offset:offset + slot.size] = data
+        self._SEQ.pack_into(self.shm.buf, offset, seq + 2)
+
+        self._seqs[offset] = seq + 2
+
+    def _read_slot(self, slot: struct.Struct, offset: int) -> list | None:
+        """Returns the fields of a slot. Returns None if it has never been written to."""
+        for _ in range(self.READ_ATTEMPTS):
+            seq, *fields = slot.unpack_from(self.shm.buf, offset)
+            if seq % 2 == 0 and self._SEQ.unpack_from(self.shm.buf, offset)[0] == seq:
+                break
+        else:
+            # the writer probably died in the middle of a write
+            return None
+
+        if seq == 0:
+            return None
+
+        return fields
+
+    def write(self, stats: ClusterStats):
+        self._write_slot(self._SLOT, self._offset(stats.cluster_id), stats[1:])
+
+    def read(self, cluster_id: int) -> ClusterStats | None:
+        """Returns the stats of a cluster. Returns None if the cluster has never published anything."""
+        fields = self._read_slot(self._SLOT, self._offset(cluster_id))
+        if fields is None:
+            return None
+
+        return ClusterStats(cluster_id, *fields)
+
+    def write_restarts(self, restarts: ClusterRestarts):
+        self._offset(restarts.cluster_id)  # range check
+        self._write_slot(self._RESTARTS_SLOT, self._restarts_offset(restarts.cluster_id),
+                         (restarts.restarts, restarts.last_restart_at, restarts.last_restart_reason or 0))
+
+    def read_restarts(self, cluster_id: int) -> ClusterRestarts:
+        self._offset(cluster_id)  # range check
+        fields = self._read_slot(self._RESTARTS_SLOT, self._restarts_offset(cluster_id))
+        if fields is None:
+            return ClusterRestarts(cluster_id, 0, 0.0, None)
+
+        restarts, last_restart_at, reason = fields
+        return ClusterRestarts(cluster_id, restarts, last_restart_at, RestartReason(reason) if reason else None)
+
+    def read_all_restarts(self) -> list[ClusterRestarts]:
+        return [self.read_restarts(cluster_id) for cluster_id in range(self.cluster_count)]
+
+    def read_all(self, include_stale: bool = False) -> list[ClusterStats]:
+        threshold = time.time() - self.STALE_AFTER
+
+        ret = []
+        for cluster_id in range(self.cluster_count):
+            stats = self.read(cluster_id)
+            if stats and (include_stale or stats.updated_at > threshold):
+                ret.append(stats)
+
+        return ret
+
+    def get_totals(self) -> StatsTotals:
+        clusters = self.read_all()
+
+        return StatsTotals(clusters=len(clusters),
+                           guilds=sum(x.guilds for x in clusters),
+                           channels=sum(x.channels for x in clusters),
+                           members=sum(x.members for x in clusters),
+                           music_players=sum(x.music_players for x in clusters),
+                           memory=sum(x.memory for x in clusters),
+                           average_cpu=sum(x.cpu_usage for x in clusters) / len(clusters) if clusters else 0.0)
+
+    def close(self):
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+
+
+class StatsPublisher:
+    """Keeps the counters of a cluster up to date using gateway events and publishes them to the stats board."""
+    UPDATE_INTERVAL = 1.0
+    RECOUNT_INTERVAL = 60 * 10  # counters are recounted from scratch every once in a while to fix any drift
+
+    def __init__(self, bot: ShinobuBot):
+        self.bot = bot
+
+        self.process = psutil.Process(os.getpid())
+        self.started_at = time.time()
+
+        self.guilds = 0
+        self.channels = 0
+        self.members = 0
+
+        self.cpu_usage = 0.0
+        self.memory = 0.0
+        self.loop_lag = 0.0
+
+        self.last_recount = 0.0
+
+        # whether we own our slot of the board yet
+        self.publishing = bot.publish_stats
+
+        for listener in (self.on_ready, self.on_guild_join, self.on_guild_remove,
+                         self.on_guild_channel_create, self.on_guild_channel_delete,
+                         self.on_member_join, self.on_member_remove):
+            self.bot.add_listener(listener)
+
+        self.update_task = self.bot.loop.create_task(self.update_loop())
+
+    def recount(self):
+        self.guilds = len(self.bot.guilds)
+        self.channels = sum(len(guild.channels) for guild in self.bot.guilds)
+        self.members = sum(guild.member_count or 0 for guild in self.bot.guilds)
+
+        self.last_recount = time.monotonic()
+
+    def get_stats(self) -> ClusterStats:
+        return ClusterStats(cluster_id=self.bot.cluster_id,
+                            pid=self.process.pid,
+                            updated_at=time.time(),
+                            started_at=self.started_at,
+                            guilds=self.guilds,
+                            channels=self.channels,
+                            members=self.members,
+                            latency=self.bot.latency,
+                            memory=self.memory,
+                            cpu_usage=self.cpu_usage,
+                            music_players=len(self.bot.voice_clients),
+                            loop_lag=self.loop_lag)
+
+    def publish(self):
+        if self.publishing:
+            self.bot.stats_board.write(self.get_stats())
+
+    async def update_loop(self):
+        self.process.cpu_percent(interval=None)
+
+        while True:
+            started_sleeping = self.bot.loop.time()
+            await asyncio.sleep(self.UPDATE_INTERVAL)
+            self.loop_lag = max(0.0, self.bot.loop.time() - started_sleeping - self.UPDATE_INTERVAL)
+
+            # cpu usage since the last call, without blocking
+            self.cpu_usage = self.process.cpu_percent(interval=None)
+            self.memory = self.process.memory_info().rss / 10 ** 6
+
+            if self.bot.is_ready() and time.monotonic() - self.last_recount > self.RECOUNT_INTERVAL:
+                self.recount()
+
+            try:
+                self.publish()
+            except Exception:
+                self.bot.logger.exception("Error while publishing the cluster stats.")
+
+            # let the launcher know that we're alive
+            self.bot.send_to_launcher({'type': 'heartbeat', 'loop_lag': self.loop_lag})
+
+    async def on_ready(self):
+        self.recount()
+        self.publish()
+
+    async def on_guild_join(self, guild: discord.Guild):
+        self.guilds += 1
+        self.channels += len(guild.channels)
+        self.members += guild.member_count or 0
+        self.publish()
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        # these can come before the first recount, so they're kept from going below zero
+        self.guilds = max(0, self.guilds - 1)
+        self.channels = max(0, self.channels - len(guild.channels))
+        self.members = max(0, self.members - (guild.member_count or 0))
+        self.publish()
+
+    async def on_guild_channel_create(self, _):
+        self.channels += 1
+        self.publish()
+
+    async def on_guild_channel_delete(self, _):
+        self.channels = max(0, self.channels - 1)
+        self.publish()
+
+    async def on_member_join(self, _):
+        self.members += 1
+        self.publish()
+
+    async def on_member_remove(self, _):
+        self.members = max(0, self.members - 1)
+        self.publish()
+
+    def stop(self):
+        self.update_task.cancel()
@@ -0,0 +1,90 @@
+"""
+Compares the binary IPC wire format against the old JSON one.
+
+Usage (from the ipc directory, like ipc.py):
+    python wire_benchmark.py --count 100000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+import ipc_wire
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# a get_cluster_stats response, which is one of the biggest messages we send
+PAYLOAD = {
+    'return_value': {
+        "uptime"       : 123456.789,
+        "cluster_id"   : 3,
+        "latency"      : 0.0421,
+        "guilds"       : 12345,
+        "channels"     : 456789,
+        "members"      : 2345678,
+        "memory"       : 512.34,
+        "threads"      : 17,
+        "cpu_usage"    : 4.2,
+        "music_players": 0,
+        "db_cache"     : {"GuildDB"    : {"size": 9000, "hits": 123456, "misses": 789},
+                          "GuildNSFWDB": {"size": 300, "hits": 4567, "misses": 89}}
+    }
+}
+
+
+def json_round_trip():
+    """What IPCMessage.dumps and IPCMessage.get_from_raw used to do."""
+    frame = json.dumps({'author'    : 3,
+                        'type'      : 'response',
+                        'key'       : '1a2b3c4',
+                        'successful': True,
+                        'target'    : 0,
+                        'created_at': datetime.now().strftime(DATE_FORMAT),
+                        'data'      : PAYLOAD})
+
+    msg = json.loads(frame.encode('utf8'))
+    datetime.strptime(msg['created_at'], DATE_FORMAT)
+
+    return frame
+
+
+def binary_round_trip():
+    frame = ipc_wire.pack(type=ipc_wire.MessageType.RESPONSE,
+                          author=3,
+                          target=0,
+                          key=random.getrandbits(32),
+                          created_at=time.time(),
+                          successful=True,
+                          payload=PAYLOAD)
+
+    ipc_wire.unpack(frame)
+
+    return frame
+
+
+def run(name: str, func, count: int):
+    size = len(func())
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(count):
+        func()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    print(f"{name:<7} {count / wall:>12,.0f} msg/s {cpu / count * 10 ** 6:>10.2f} µs CPU/msg {size:>8} bytes/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count",
+                        type=int,
+                        help="How many messages to encode and decode with each format.",
+                        default=100_000)
+    args = parser.parse_args()
+
+    run('json', json_round_trip, args.count)
+    run('binary', binary_round_trip, args.count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the startup time and memory usage of the cluster launch modes.
+
+Starts a number of processes with each launch mode. Every process imports what a cluster imports
+(shinobu and every cog) without connecting to Discord, then waits until its memory usage is measured.
+
+Usage:
+    python launch_benchmark.py --clusters 4
+
+PSS splits the shared pages between the processes that share them,
+so its total is the best estimate of how much memory the clusters actually take.
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import time
+
+import psutil
+
+from cluster_manager import LAUNCH_MODES, PRELOAD_MODULES
+
+
+def import_cluster_modules(conn):
+    import shinobu  # noqa
+
+    for file in sorted(os.listdir('cogs')):
+        if file.endswith('.py'):
+            importlib.import_module(f'cogs.{file[:-3]}')
+
+    conn.send(True)
+
+    # wait until the memory usage is measured
+    conn.recv()
+
+
+def measure(launch_mode: str, cluster_count: int):
+    ctx = multiprocessing.get_context(launch_mode)
+    if launch_mode == 'forkserver':
+        ctx.set_forkserver_preload(PRELOAD_MODULES)
+
+    start = time.perf_counter()
+
+    processes = []
+    for _ in range(cluster_count):
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=import_cluster_modules, args=(child_conn,), daemon=True)
+        process.start()
+        processes.append((process, parent_conn))
+
+    for _, conn in processes:
+        conn.recv()
+
+    elapsed = time.perf_counter() - start
+
+    memory = [psutil.Process(process.pid).memory_full_info() for process, _ in processes]
+
+    for process, conn in processes:
+        conn.send(True)
+        process.join()
+
+    print(f"{launch_mode:<11} {elapsed:>8.2f}s "
+          f"{sum(x.rss for x in memory) / 10 ** 6:>10.1f} MB RSS "
+          f"{sum(x.uss for x in memory) / 10 ** 6:>10.1f} MB USS "
+          f"{sum(x.pss for x in memory) / 10 ** 6:>10.1f} MB PSS")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clusters",
+                        type=int,
+                        help="How many cluster processes to start with each launch mode.",
+                        default=4)
+    args = parser.parse_args()
+
+    print(f"Starting {args.clusters} clusters with each launch mode. Memory usages are totals.")
+    for launch_mode in LAUNCH_MODES:
+        measure(launch_mode, args.clusters)
+
+
+if __name__ == '__main__':
+    main()
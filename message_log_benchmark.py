@@ -0,0 +1,146 @@
+"""
+Compares the plain message log format against the compressed one on a synthetic corpus.
+
+Writes the corpus to two temporary tables in the bot's database, one with each format,
+then reports their sizes and how long inserting and fetching (including decoding) takes.
+Nothing is left behind, as the tables are dropped when the connection is closed.
+
+Usage:
+    python message_log_benchmark.py shinobu --count 100000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+from models.config import ConfigFile
+from services import CachedMessage, MessageCodec, MessageCodecService
+
+WORDS = ("the a to i you it is and that of in lol what this for on my me no yes just so be like do have "
+         "not are was we can but get with gg bro guys anyone wanna play tonight server bot music queue "
+         "skip song why when how good nice thanks thank ok okay yeah idk lmao wtf omg rip brb hello hi").split()
+LINKS = ("https://tenor.com/view/", "https://www.youtube.com/watch?v=", "https://cdn.discordapp.com/attachments/")
+
+
+def random_content() -> str:
+    words = random.choices(WORDS, k=int(random.expovariate(1 / 8)) + 1)
+    if random.random() < 0.05:
+        words.append(random.choice(LINKS) + ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=11)))
+
+    return ' '.join(words)
+
+
+def random_embeds() -> tuple[str, ...]:
+    # mostly link unfurls and bot responses
+    if random.random() > 0.1:
+        return ()
+
+    return (json.dumps({'type'       : 'rich',
+                        'title'      : random_content()[:64],
+                        'description': random_content(),
+                        'color'      : random.randint(0, 0xFFFFFF),
+                        'footer'     : {'text': random_content()[:32]},
+                        'author'     : {'name'    : random.choice(WORDS),
+                                        'icon_url': 'https://cdn.discordapp.com/avatars/0/0.png'}}),)
+
+
+def make_corpus(count: int) -> list[CachedMessage]:
+    now = datetime.now(timezone.utc)
+
+    return [CachedMessage(message_id=i,
+                          author_id=random.getrandbits(60),
+                          channel_id=random.getrandbits(60),
+                          guild_id=random.getrandbits(60),
+                          content=random_content(),
+                          embeds=random_embeds(),
+                          created_at=now - timedelta(seconds=count - i))
+            for i in range(count)]
+
+
+async def measure(conn: asyncpg.Connection, name: str, table: str, records: list[tuple], columns: tuple,
+                  encode_time: float, decode):
+    start = time.perf_counter()
+    await conn.copy_records_to_table(table, records=records, columns=columns)
+    insert_time = time.perf_counter() - start + encode_time
+
+    size = await conn.fetchval("SELECT pg_total_relation_size($1::regclass);", table)
+
+    start = time.perf_counter()
+    for row in await conn.fetch(f"SELECT * FROM {table};"):
+        decode(row)
+    fetch_time = time.perf_counter() - start
+
+    print(f"{name:<11} {size / 10 ** 6:>10.2f} MB "
+          f"{len(records) / insert_time:>12,.0f} inserts/s "
+          f"{len(records) / fetch_time:>12,.0f} fetches/s")
+
+
+async def run(bot_name: str, count: int):
+    config = ConfigFile.get_config(bot_name)
+    conn = await asyncpg.connect(**config.db_credentials)
+
+    await conn.execute("""
+    CREATE TEMPORARY TABLE plain_log (message_id bigint, author_id bigint, channel_id bigint, guild_id bigint,
+    message_content text, message_embeds text[], created_at timestamp WITH TIME ZONE);
+    CREATE TEMPORARY TABLE compressed_log (message_id bigint, author_id bigint, channel_id bigint, guild_id bigint,
+    content_blob bytea, embeds_blob bytea, dictionary_id integer, created_at timestamp WITH TIME ZONE);""")
+
+    # the bot trains on the latest messages, then compresses the ones that come after.
+    # measuring on the training messages would overstate the ratio, so they're left out
+    messages = make_corpus(MessageCodecService.TRAINING_SAMPLES + count)
+    training, corpus = messages[:MessageCodecService.TRAINING_SAMPLES], messages[MessageCodecService.TRAINING_SAMPLES:]
+
+    codec = MessageCodec()
+    codec.add_dictionary(1, MessageCodec.train([m.content.encode() for m in training]
+                                               + [e.encode() for m in training for e in m.embeds]))
+
+    print(f"{count} messages, dictionary of {len(codec.dictionaries[1])} bytes "
+          f"trained on {len(training)} other messages.")
+
+    await measure(conn, 'plain', 'plain_log',
+                  records=[(m.id, m.author_id, m.channel_id, m.guild_id, m.content, list(m.embeds), m.created_at)
+                           for m in corpus],
+                  columns=('message_id', 'author_id', 'channel_id', 'guild_id',
+                           'message_content', 'message_embeds', 'created_at'),
+                  encode_time=0.0,
+                  decode=lambda row: (row['message_content'], [json.loads(x) for x in row['message_embeds']]))
+
+    start = time.perf_counter()
+    dictionary_id, encode = codec.get_encoder()
+    blobs = [MessageCodec.encode_message(encode, m) for m in corpus]
+    encode_time = time.perf_counter() - start
+
+    def decode(row):
+        content = codec.decode(row['content_blob'], row['dictionary_id']).decode()
+        embeds = json.loads(codec.decode(row['embeds_blob'], row['dictionary_id'])) if row['embeds_blob'] else []
+        return content, embeds
+
+    await measure(conn, 'compressed', 'compressed_log',
+                  records=[(m.id, m.author_id, m.channel_id, m.guild_id, content, embeds, dictionary_id, m.created_at)
+                           for m, (content, embeds) in zip(corpus, blobs)],
+                  columns=('message_id', 'author_id', 'channel_id', 'guild_id',
+                           'content_blob', 'embeds_blob', 'dictionary_id', 'created_at'),
+                  encode_time=encode_time,
+                  decode=decode)
+
+    await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", help="The name of the bot whose database will be used.")
+    parser.add_argument("--count",
+                        type=int,
+                        help="How many messages to write and read with each format.",
+                        default=100_000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.name, args.count))
+
+
+if __name__ == '__main__':
+    main()
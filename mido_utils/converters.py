@@ -1,8 +1,11 @@
+import copy
+import functools
 import json
+import re
+import time
 from datetime import datetime
 
 import discord
-from discord import ShardInfo
 from discord.ext import commands
 
 import mido_utils
@@ -110,146 +113,206 @@ def readable_currency(number: int) -> str:
     return readable_bigint(number) + mido_utils.emotes.currency
 
 
-async def parse_text_with_context(text: str, bot,
-                                  guild: discord.Guild,
-                                  channel: discord.TextChannel,
-                                  author: discord.Member = None,
-                                  message_obj: discord.Message = None) -> tuple[str | None, discord.Embed | None]:
-    # missing or not-properly-working placeholders:
-    # misc stuff
-    # local time stuff
+_DATE_FORMAT = '%Y-%m-%d, %H:%M:%S UTC'
+_COUNTER_TTL = 60.0
+
+
+def _utc_now_str(_) -> str:
+    return datetime.utcnow().strftime(_DATE_FORMAT)
+
+
+class _PlaceholderContext:
+    __slots__ = ('bot', 'guild', 'channel', 'author', 'message_obj', 'bot_member')
+
+    def __init__(self, bot, guild: discord.Guild, channel, author, message_obj):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message_obj = message_obj
 
-    bot_member: discord.Member = guild.me
+        self.bot_member: discord.Member = guild.me
 
-    base_dict = {}
 
+# requirement name -> whether the context satisfies it.
+# placeholders whose requirement is not satisfied are left as they are
+_REQUIREMENTS = {
+    None     : lambda c: True,
+    'channel': lambda c: isinstance(c.channel, discord.TextChannel),
+    'author' : lambda c: c.author is not None,
+    'message': lambda c: c.message_obj is not None,
+}
+
+# placeholder -> (requirement, getter)
+_PLACEHOLDERS = {
     # bot placeholders
-    base_dict.update(
-        {
-            # old
-            "%mention%"    : bot_member.mention,
-            "%time%"       : datetime.utcnow().strftime('%Y-%m-%d, %H:%M:%S UTC'),
-
-            # new
-            "%bot.status%" : str(bot_member.status),
-            "%bot.latency%": bot.latency,
-            "%bot.name%"   : bot_member.display_name,
-            "%bot.mention%": bot_member.mention,
-            "%bot.fullname%": str(bot_member),
-            "%bot.time%"    : datetime.utcnow().strftime('%Y-%m-%d, %H:%M:%S UTC'),
-            "%bot.discrim%" : str(bot_member).split('#')[-1],
-            "%bot.id%"      : bot_member.id,
-            "%bot.avatar%" : bot_member.display_avatar.url
-        }
-    )
+    "%mention%"          : (None, lambda c: c.bot_member.mention),  # old
+    "%time%"             : (None, _utc_now_str),  # old
+    "%bot.status%"       : (None, lambda c: c.bot_member.status),
+    "%bot.latency%"      : (None, lambda c: c.bot.latency),
+    "%bot.name%"         : (None, lambda c: c.bot_member.display_name),
+    "%bot.mention%"      : (None, lambda c: c.bot_member.mention),
+    "%bot.fullname%"     : (None, lambda c: c.bot_member),
+    "%bot.time%"         : (None, _utc_now_str),
+    "%bot.discrim%"      : (None, lambda c: str(c.bot_member).split('#')[-1]),
+    "%bot.id%"           : (None, lambda c: c.bot_member.id),
+    "%bot.avatar%"       : (None, lambda c: c.bot_member.display_avatar.url),
 
     # guild placeholders
-    base_dict.update(
-        {
-            # old
-            "%shardid%"       : guild.shard_id,
-
-            # new
-            "%server.id%"     : guild.id,
-            "%server.name%"   : guild.name,
-            "%server.members%": guild.member_count if hasattr(guild, '_member_count') else 0,
-            "%server.time%"   : datetime.utcnow().strftime('%Y-%m-%d, %H:%M:%S UTC'),
-        }
-    )
+    "%shardid%"          : (None, lambda c: c.guild.shard_id),  # old
+    "%server.id%"        : (None, lambda c: c.guild.id),
+    "%server.name%"      : (None, lambda c: c.guild.name),
+    "%server.members%"   : (None, lambda c: c.guild.member_count if hasattr(c.guild, '_member_count') else 0),
+    "%server.time%"      : (None, _utc_now_str),
 
     # channel placeholders
-    if isinstance(channel, discord.TextChannel):
-        base_dict.update(
-            {
-                "%channel.mention%": channel.mention,
-                "%channel.name%"   : channel.name,
-                "%channel.id%"     : channel.id,
-                "%channel.created%": channel.created_at.strftime('%Y-%m-%d, %H:%M:%S UTC'),
-                "%channel.nsfw%"   : channel.is_nsfw(),
-                "%channel.topic%"  : channel.topic
-            }
-        )
+    "%channel.mention%"  : ('channel', lambda c: c.channel.mention),
+    "%channel.name%"     : ('channel', lambda c: c.channel.name),
+    "%channel.id%"       : ('channel', lambda c: c.channel.id),
+    "%channel.created%"  : ('channel', lambda c: c.channel.created_at.strftime(_DATE_FORMAT)),
+    "%channel.nsfw%"     : ('channel', lambda c: c.channel.is_nsfw()),
+    "%channel.topic%"    : ('channel', lambda c: c.channel.topic),
 
     # user placeholders
-    if author:
-        base_dict.update(
-            {
-                # old
-                "%user%"             : author.mention,
-
-                # new
-                "%user.mention%"     : author.mention,
-                "%user.fullname%"    : str(author),
-                "%user.name%"        : author.display_name,
-                "%user.discrim%"     : str(author).split('#')[-1],
-                "%user.avatar%"      : author.display_avatar.url,
-                "%user.id%"          : author.id,
-                "%user.created_time%": author.created_at.strftime('%Y-%m-%d, %H:%M:%S UTC'),
-                "%user.created_date%": author.created_at.strftime('%Y-%m-%d, %H:%M:%S UTC'),
-                "%user.joined_time%" : author.joined_at.strftime(
-                    '%Y-%m-%d, %H:%M:%S UTC') if author.joined_at else 'None',
-                "%user.joined_date%" : author.joined_at.strftime(
-                    '%Y-%m-%d, %H:%M:%S UTC') if author.joined_at else 'None'
-            }
-        )
+    "%user%"             : ('author', lambda c: c.author.mention),  # old
+    "%user.mention%"     : ('author', lambda c: c.author.mention),
+    "%user.fullname%"    : ('author', lambda c: c.author),
+    "%user.name%"        : ('author', lambda c: c.author.display_name),
+    "%user.discrim%"     : ('author', lambda c: str(c.author).split('#')[-1]),
+    "%user.avatar%"      : ('author', lambda c: c.author.display_avatar.url),
+    "%user.id%"          : ('author', lambda c: c.author.id),
+    "%user.created_time%": ('author', lambda c: c.author.created_at.strftime(_DATE_FORMAT)),
+    "%user.created_date%": ('author', lambda c: c.author.created_at.strftime(_DATE_FORMAT)),
+    "%user.joined_time%" : ('author', lambda c: c.author.joined_at.strftime(_DATE_FORMAT)
+                                                if c.author.joined_at else 'None'),
+    "%user.joined_date%" : ('author', lambda c: c.author.joined_at.strftime(_DATE_FORMAT)
+                                                if c.author.joined_at else 'None'),
 
     # bot stats placeholders
-    clusters = await bot.ipc.get_cluster_stats()
-
-    base_dict.update(
-        {
-            "%servers%": mido_utils.readable_bigint(sum(x.guilds for x in clusters)),
-            "%users%"  : mido_utils.readable_bigint(sum(x.members for x in clusters))
-        }
-    )
+    "%servers%"          : (None, lambda c: mido_utils.readable_bigint(c.bot.stats_board.get_totals().guilds)),
+    "%users%"            : (None, lambda c: mido_utils.readable_bigint(c.bot.stats_board.get_totals().members)),
 
     # shard stats placeholders
-    shard: ShardInfo = bot.get_shard(guild.shard_id)
-    base_dict.update(
-        {
-            "%shard.servercount%": len([g for g in bot.guilds if g.shard_id == shard.id]),
-            "%shard.usercount%"  : sum(
-                [g.member_count for g in bot.guilds if g.shard_id == shard.id and hasattr(g, '_member_count')]),
-            "%shard.id"          : shard.id
-        }
-    )
+    "%shard.servercount%": (None, lambda c: _get_shard_counts(c.bot, c.guild.shard_id)[0]),
+    "%shard.usercount%"  : (None, lambda c: _get_shard_counts(c.bot, c.guild.shard_id)[1]),
+    "%shard.id%"         : (None, lambda c: c.guild.shard_id),
 
     # Miscellaneous placeholders
-    if message_obj:
-        base_dict.update(
-            {
-                "%target%": message_obj.mentions[0].mention if message_obj.mentions else ''
-            }
-        )
+    "%target%"           : ('message', lambda c: c.message_obj.mentions[0].mention if c.message_obj.mentions else ''),
+}
+
+# longest first, so that a placeholder never shadows a longer one
+_PLACEHOLDER_REGEX = re.compile('|'.join(re.escape(x) for x in sorted(_PLACEHOLDERS, key=len, reverse=True)))
+
+_counter_cache: dict[int, tuple[float, tuple[int, int]]] = dict()
 
-    for placeholder, to_place in base_dict.items():
-        text = text.replace(placeholder, str(to_place))
 
+def _get_shard_counts(bot, shard_id: int) -> tuple[int, int]:
+    """Returns the server and user count of a shard. Cached as it has to go through every guild."""
+    try:
+        expires_at, counts = _counter_cache[shard_id]
+        if expires_at > time.monotonic():
+            return counts
+    except KeyError:
+        pass
+
+    guilds = [g for g in bot.guilds if g.shard_id == shard_id]
+    counts = len(guilds), sum(g.member_count for g in guilds if hasattr(g, '_member_count'))
+
+    _counter_cache[shard_id] = (time.monotonic() + _COUNTER_TTL, counts)
+    return counts
+
+
+class _CompiledTemplate:
+    """A text split into literal and placeholder segments. Texts that don't have any placeholder
+    and are embeds keep the parsed embed, so that we don't have to parse them again."""
+    __slots__ = ('segments', 'placeholders', 'parsed')
+
+    def __init__(self, text: str):
+        # placeholders are at odd indexes
+        self.segments: list[str] = []
+
+        last_end = 0
+        for match in _PLACEHOLDER_REGEX.finditer(text):
+            self.segments.append(text[last_end:match.start()])
+            self.segments.append(match.group())
+            last_end = match.end()
+        self.segments.append(text[last_end:])
+
+        self.placeholders = frozenset(self.segments[1::2])
+
+        self.parsed: tuple[str | None, dict | None] | None = _parse_embed(text) if not self.placeholders else None
+
+    def render(self, context: _PlaceholderContext) -> str:
+        if not self.placeholders:
+            return self.segments[0]
+
+        values = {}
+        for placeholder in self.placeholders:
+            requirement, getter = _PLACEHOLDERS[placeholder]
+            if _REQUIREMENTS[requirement](context):
+                values[placeholder] = str(getter(context))
+
+        return ''.join(values.get(segment, segment) if i % 2 else segment for i, segment in enumerate(self.segments))
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile(text: str) -> _CompiledTemplate:
+    return _CompiledTemplate(text)
+
+
+def _parse_embed(text: str) -> tuple[str | None, dict | None]:
+    """Returns the content and the embed dict if the text is an embed json. Otherwise, returns the text."""
     try:
         embed: dict = json.loads(text)
         if not isinstance(embed, dict):  # avoid loads returning something else (such as int)
             raise NotDict
     except (json.JSONDecodeError, NotDict):
         return text, None
+
+    # plainText is for legacy messages
+    content = embed.get('plainText', None) or embed.get('content', None)
+    embed = embed.get('embed', None) or embed
+
+    # if image/thumbnail is just a str, we need to convert it to dict
+    # legacy, again
+    for field in ('image', 'thumbnail'):
+        if field in embed.keys() and isinstance(embed[field], str):
+            embed[field] = {'url': embed[field]}
+
+    return content, embed
+
+
+async def parse_text_with_context(text: str, bot,
+                                  guild: discord.Guild,
+                                  channel: discord.TextChannel,
+                                  author: discord.Member = None,
+                                  message_obj: discord.Message = None) -> tuple[str | None, discord.Embed | None]:
+    # missing or not-properly-working placeholders:
+    # misc stuff
+    # local time stuff
+    template = _compile(text)
+
+    if template.parsed is not None:
+        content, embed = template.parsed
     else:
-        # plainText is for legacy messages
-        content = embed.get('plainText', None) or embed.get('content', None)
-        embed = embed.get('embed', None) or embed
+        context = _PlaceholderContext(bot, guild, channel, author, message_obj)
+        content, embed = _parse_embed(template.render(context))
 
-        # if image/thumbnail is just a str, we need to convert it to dict
-        # legacy, again
-        for field in ('image', 'thumbnail'):
-            if field in embed.keys() and isinstance(embed[field], str):
-                embed[field] = {'url': embed[field]}
+    if embed is None:
+        return content, None
 
-        try:
-            embed: discord.Embed = discord.Embed.from_dict(embed)
-        except ValueError:
-            # probably wrong timestamp
-            embed.pop('timestamp')
-            embed: discord.Embed = discord.Embed.from_dict(embed)
+    # from_dict keeps references to the nested dicts, so never give it the cached one
+    embed = copy.deepcopy(embed)
+
+    try:
+        embed: discord.Embed = discord.Embed.from_dict(embed)
+    except ValueError:
+        # probably wrong timestamp
+        embed.pop('timestamp')
+        embed: discord.Embed = discord.Embed.from_dict(embed)
 
-        return content, embed
+    return content, embed
 
 
 def html_to_discord(text: str):
@@ -43,6 +43,27 @@ class ConfigFile:
 
         self.redis_host: str = data.get('redis_host')
 
+        # how many ipc commands from other clusters can run at the same time
+        self.ipc_max_concurrent_commands: int = data.get('ipc_max_concurrent_commands', 32)
+
+        # None to size the clusters automatically based on the host and the previous runs
+        self.shards_per_cluster: int | None = data.get('shards_per_cluster')
+
+        # fork, forkserver or spawn. check cluster_manager.py for details
+        self.cluster_launch_mode: str = data.get('cluster_launch_mode', 'fork')
+
+        # thresholds of the cluster supervisor, in seconds unless stated otherwise
+        self.supervisor: dict[str, float] = {
+            "heartbeat_timeout"     : 30,  # restart clusters that haven't sent a heartbeat for this long
+            "startup_timeout"       : 300,  # same, but for the first heartbeat after a start
+            "max_loop_lag"          : 10,  # event loop lag that counts as lagging
+            "max_lagging_heartbeats": 6,  # restart clusters that lag in this many heartbeats in a row
+            "restart_backoff"       : 5,  # doubled for each restart in a row
+            "max_restart_backoff"   : 300,
+            "backoff_reset_after"   : 600,  # a cluster that stays up this long is not restarting in a row anymore
+            **data.get('supervisor', {})
+        }
+
         self.check_validity(warn)
 
     def check_validity(self, warn: bool):
@@ -4,8 +4,11 @@ import asyncio
 import json
 import random
 import re
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from enum import Enum, auto
+from functools import cached_property
 from typing import TYPE_CHECKING
 
 import aiohttp
@@ -22,11 +25,12 @@ import models
 __all__ = ['XpAnnouncement', 'NSFWImage',  # these 2 are not actual tables
            'ModLog', 'UserDB', 'MemberDB',
            'GuildDB', 'GuildLoggingDB', 'GuildNSFWDB',
-           'LoggedMessage', 'ReminderDB', 'CustomReaction',
+           'LoggedMessage', 'MessageDictionaryDB', 'ClusterJobRunDB', 'ReminderDB', 'CustomReaction',
            'CachedImage', 'DonutEvent', 'TransactionLog',
            'BlacklistDB', 'XpRoleReward', 'HangmanWord', 'RepeatDB']
 
 if TYPE_CHECKING:
+    from services import CachedMessage
     from shinobu import ShinobuBot
 
 
@@ -44,9 +48,57 @@ class XpAnnouncement(Enum):
     GUILD = 2
 
 
+class EntityCache:
+    """A bounded LRU cache of database objects whose entries expire after some time."""
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 60 * 10):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._data: OrderedDict[int, tuple[float, BaseDBModel]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            expires_at, obj = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj: BaseDBModel):
+        self._data[key] = (time.monotonic() + self.ttl, obj)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def drop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def get_stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+
 class BaseDBModel:
     TABLE_DEFINITION = None
 
+    # models that have a cache should call write_through() in their mutators
+    CACHE: EntityCache | None = None
+
     def __init__(self, data: Record, bot):
         self.bot = bot
         self.db = self.bot.db
@@ -65,6 +117,17 @@ class BaseDBModel:
         bot.logger.debug(f"Creating database table for class {cls.__name__}.")
         await bot.db.execute(cls.TABLE_DEFINITION)
 
+    @classmethod
+    def get_cached(cls, key):
+        return cls.CACHE.get(key) if cls.CACHE is not None else None
+
+    async def write_through(self):
+        """Puts this object in the cache and tells other clusters to drop their copy."""
+        self.CACHE.put(self.id, self)
+
+        if self.bot.ipc:
+            await self.bot.ipc.drop_db_cache(model_name=self.__class__.__name__, entity_id=self.id)
+
     def __eq__(self, other):
         raise NotImplemented
 
@@ -83,8 +146,29 @@ class ModLog(BaseDBModel):
     length_in_seconds bigint,
     date              timestamp WITH TIME ZONE DEFAULT NOW() NOT NULL,
     done              boolean,
-    hidden            boolean                  DEFAULT FALSE NOT NULL
+    hidden            boolean                  DEFAULT FALSE NOT NULL,
+    due_at            timestamp WITH TIME ZONE
 );
+
+-- set for temporary punishments
+DO
+$$
+    BEGIN
+        -- backfilled only when the column is added, instead of scanning the table on every boot
+        IF NOT EXISTS(SELECT 1
+                      FROM information_schema.columns
+                      WHERE table_schema = current_schema() AND table_name = 'modlogs' AND column_name = 'due_at') THEN
+            ALTER TABLE modlogs
+                ADD COLUMN IF NOT EXISTS due_at timestamp WITH TIME ZONE;
+            UPDATE modlogs
+            SET due_at = date + length_in_seconds * INTERVAL '1 second'
+            WHERE length_in_seconds IS NOT NULL AND length_in_seconds != 0 AND done IS NOT TRUE;
+        END IF;
+    END
+$$;
+
+CREATE INDEX IF NOT EXISTS modlogs_due_at_index
+    ON modlogs (due_at) WHERE due_at IS NOT NULL AND done IS NOT TRUE;
 """
 
     class Type(Enum):
@@ -108,6 +192,8 @@ class ModLog(BaseDBModel):
         self.time_status = mido_utils.Time.add_to_previous_date_and_get(
             modlog_db.get('date'), modlog_db.get('length_in_seconds')
         )
+        # when a temporary punishment expires
+        self.due_at: datetime | None = modlog_db.get('due_at')
 
         self.done = modlog_db.get('done')
 
@@ -126,7 +212,7 @@ class ModLog(BaseDBModel):
         return [cls(log, bot) for log in logs]
 
     @classmethod
-    async def get_open_logs(cls, bot):
+    async def get_open_logs(cls, bot, due_before: datetime):
         ret = await bot.db.fetch(
             """
             SELECT 
@@ -134,10 +220,11 @@ class ModLog(BaseDBModel):
             FROM 
                 modlogs 
             WHERE 
-                length_in_seconds IS NOT NULL AND length_in_seconds != 0
-                AND type = ANY($1) 
+                due_at IS NOT NULL AND due_at < $1
+                AND type = ANY($2) 
                 AND done IS NOT TRUE
-                AND guild_id=ANY($2);""", (ModLog.Type.MUTE.value, ModLog.Type.BAN.value), [x.id for x in bot.guilds])
+                AND guild_id=ANY($3);""",
+            due_before, (ModLog.Type.MUTE.value, ModLog.Type.BAN.value), [x.id for x in bot.guilds])
 
         return [cls(x, bot) for x in ret]
 
@@ -151,18 +238,22 @@ class ModLog(BaseDBModel):
                          reason: str = None,
                          length: mido_utils.Time = None,
                          ):
+        now = datetime.now(timezone.utc)
+        length_in_seconds = getattr(length, 'remaining_seconds', None)
+
         new_modlog_db = await bot.db.fetchrow(
             """INSERT INTO 
-            modlogs (guild_id, user_id, type, reason, executor_id, length_in_seconds, date) 
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            modlogs (guild_id, user_id, type, reason, executor_id, length_in_seconds, date, due_at) 
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
             RETURNING *;""",
             guild_id,
             user_id,
             _type.value,
             reason,
             executor_id,
-            getattr(length, 'remaining_seconds', None),
-            datetime.now(timezone.utc)
+            length_in_seconds,
+            now,
+            now + timedelta(seconds=length_in_seconds) if length_in_seconds else None
         )
 
         return cls(new_modlog_db, bot)
@@ -348,8 +439,22 @@ CREATE INDEX IF NOT EXISTS user_xp_leaderboard_index
 
         self.total_xp += amount
         await self.db.execute(
-            """UPDATE users SET xp = $1, last_xp_gain = $2 WHERE id=$3""",
-            self.total_xp, datetime.now(timezone.utc), self.id)
+            """UPDATE users SET xp = xp + $1, last_xp_gain = $2 WHERE id=$3""",
+            amount, datetime.now(timezone.utc), self.id)
+
+    @staticmethod
+    async def add_xp_bulk(bot, rows: list[tuple[int, int, datetime]], cooldown: timedelta):
+        """Adds XP to users in one query. Rows are (user_id, amount, last_xp_gain).
+
+        Users can gain XP in multiple clusters, so rows of users who are still on cooldown are skipped."""
+        user_ids, amounts, dates = zip(*rows)
+        await bot.db.execute(
+            """INSERT INTO users (id, xp, last_xp_gain)
+            SELECT * FROM UNNEST($1::bigint[], $2::bigint[], $3::timestamptz[])
+            ON CONFLICT (id) DO UPDATE
+            SET xp = users.xp + excluded.xp, last_xp_gain = excluded.last_xp_gain
+            WHERE users.last_xp_gain IS NULL OR users.last_xp_gain <= excluded.last_xp_gain - $4::interval;""",
+            user_ids, amounts, dates, cooldown)
 
     async def remove_xp(self, amount: int) -> int:
         await self.db.execute(
@@ -441,22 +546,41 @@ CREATE INDEX IF NOT EXISTS member_xp_leaderboard_index
 
     @classmethod
     async def get_or_create(cls, bot, guild_id: int, member_id: int) -> MemberDB:
-        member_db = await bot.db.fetchrow(
-            """SELECT * FROM members WHERE guild_id=$1 AND user_id=$2;""", guild_id, member_id)
-
-        if not member_db:
-            try:
-                member_db = await bot.db.fetchrow(
-                    """INSERT INTO members (guild_id, user_id) VALUES($1, $2) RETURNING *;""", guild_id, member_id)
-            except asyncpg.UniqueViolationError:
-                return await cls.get_or_create(bot, guild_id, member_id)
-
-        user_db = await UserDB.get_or_create(bot, member_id)
-        guild_db = await GuildDB.get_or_create(bot, guild_id)
-
-        member_obj = cls(member_db, bot)
-        member_obj.guild = guild_db
-        member_obj.user = user_db
+        # gets or creates the member, the user and the guild in a single round trip.
+        # rows that are created by this query are not visible to the select parts of it,
+        # so the existing ones are read from the tables and the new ones from the RETURNING clauses
+        ret = await bot.db.fetchrow(
+            """
+            WITH 
+                new_guild AS (
+                    INSERT INTO guilds(id, prefix) VALUES ($1, $3) ON CONFLICT DO NOTHING RETURNING *
+                ),
+                new_user AS (
+                    INSERT INTO users(id) VALUES ($2) ON CONFLICT DO NOTHING RETURNING *
+                ),
+                new_member AS (
+                    INSERT INTO members(guild_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING RETURNING *
+                )
+            SELECT 
+                (SELECT x::members FROM (
+                    SELECT * FROM new_member UNION ALL SELECT * FROM members WHERE guild_id=$1 AND user_id=$2
+                ) x LIMIT 1) AS member,
+                (SELECT x::users FROM (
+                    SELECT * FROM new_user UNION ALL SELECT * FROM users WHERE id=$2
+                ) x LIMIT 1) AS "user",
+                (SELECT x::guilds FROM (
+                    SELECT * FROM new_guild UNION ALL SELECT * FROM guilds WHERE id=$1
+                ) x LIMIT 1) AS guild;""",
+            guild_id, member_id, bot.config.default_prefix)
+
+        # if a concurrent query created any of these after our snapshot, we won't see it. just try again
+        if ret['member'] is None or ret['user'] is None or ret['guild'] is None:
+            return await cls.get_or_create(bot, guild_id, member_id)
+
+        member_obj = cls(ret['member'], bot)
+        member_obj.guild = GuildDB(ret['guild'], bot)
+        GuildDB.CACHE.put(guild_id, member_obj.guild)  # we got a fresh copy anyway
+        member_obj.user = UserDB(ret['user'], bot)
 
         return member_obj
 
@@ -468,8 +592,32 @@ CREATE INDEX IF NOT EXISTS member_xp_leaderboard_index
 
         self.total_xp += amount
         await self.db.execute(
-            """UPDATE members SET xp = $1, last_xp_gain = $2 WHERE guild_id=$3 AND user_id=$4""",
-            self.total_xp, datetime.now(timezone.utc), self.guild.id, self.id)
+            """UPDATE members SET xp = xp + $1, last_xp_gain = $2 WHERE guild_id=$3 AND user_id=$4""",
+            amount, datetime.now(timezone.utc), self.guild.id, self.id)
+
+    @staticmethod
+    async def get_xp_state(bot, guild_id: int, user_id: int) -> Record:
+        """Returns the XP and the last XP gain date of both the member and the user in one query."""
+        return await bot.db.fetchrow(
+            """SELECT 
+                m.xp           AS member_xp, 
+                m.last_xp_gain AS member_last_xp_gain, 
+                u.xp           AS user_xp, 
+                u.last_xp_gain AS user_last_xp_gain
+            FROM (SELECT $1::bigint AS guild_id, $2::bigint AS user_id) AS k
+            LEFT JOIN members m ON m.guild_id = k.guild_id AND m.user_id = k.user_id
+            LEFT JOIN users u ON u.id = k.user_id;""", guild_id, user_id)
+
+    @staticmethod
+    async def add_xp_bulk(bot, rows: list[tuple[int, int, int, datetime]]):
+        """Adds XP to members in one query. Rows are (guild_id, user_id, amount, last_xp_gain)."""
+        guild_ids, user_ids, amounts, dates = zip(*rows)
+        await bot.db.execute(
+            """INSERT INTO members (guild_id, user_id, xp, last_xp_gain)
+            SELECT * FROM UNNEST($1::bigint[], $2::bigint[], $3::bigint[], $4::timestamptz[])
+            ON CONFLICT (guild_id, user_id) DO UPDATE
+            SET xp = members.xp + excluded.xp, last_xp_gain = excluded.last_xp_gain;""",
+            guild_ids, user_ids, amounts, dates)
 
     async def remove_xp(self, amount: int) -> int:
         await self.db.execute(
@@ -508,6 +656,7 @@ class GuildNSFWDB(BaseDBModel):
     blacklisted_tags       text[] DEFAULT '{}'::text[]
 );
 """
+    CACHE = EntityCache()
 
     def __init__(self, nsfw_db: Record, bot):
         super().__init__(nsfw_db, bot)
@@ -538,6 +687,7 @@ class GuildNSFWDB(BaseDBModel):
         await self.bot.db.execute("UPDATE guilds_nsfw_settings "
                                   "SET blacklisted_tags=ARRAY_APPEND(blacklisted_tags, $1) WHERE id=$2;",
                                   tag.lower(), self.id)
+        await self.write_through()
 
     async def whitelist_tag(self, tag: str):
         self.blacklisted_tags.remove(tag.lower())
@@ -545,6 +695,7 @@ class GuildNSFWDB(BaseDBModel):
         await self.bot.db.execute("UPDATE guilds_nsfw_settings "
                                   "SET blacklisted_tags=ARRAY_REMOVE(blacklisted_tags, $1) WHERE id=$2;",
                                   tag.lower(), self.id)
+        await self.write_through()
 
     async def set_auto_nsfw(self, nsfw_type: NSFWImage.Type, channel_id: int = None, tags: list[str] = None,
                             interval: int = None):
@@ -571,8 +722,14 @@ class GuildNSFWDB(BaseDBModel):
         else:
             raise mido_utils.UnknownNSFWType(nsfw_type)
 
+        await self.write_through()
+
     @classmethod
     async def get_or_create(cls, bot, guild_id: int) -> GuildNSFWDB:
+        cached = cls.get_cached(guild_id)
+        if cached:
+            return cached
+
         nsfw_db = await bot.db.fetchrow("""SELECT * FROM guilds_nsfw_settings WHERE id=$1;""", guild_id)
         if not nsfw_db:
             try:
@@ -582,7 +739,9 @@ class GuildNSFWDB(BaseDBModel):
             except asyncpg.UniqueViolationError:
                 return await cls.get_or_create(bot, guild_id)
 
-        return cls(nsfw_db, bot)
+        obj = cls(nsfw_db, bot)
+        cls.CACHE.put(guild_id, obj)
+        return obj
 
     @classmethod
     async def get_auto_nsfw_guilds(cls, bot):
@@ -618,6 +777,7 @@ class GuildDB(BaseDBModel):
     welcome_role_id            bigint
 );
 """
+    CACHE = EntityCache()
 
     def __init__(self, guild_db: Record, bot):
         super().__init__(guild_db, bot)
@@ -661,6 +821,10 @@ class GuildDB(BaseDBModel):
 
     @classmethod
     async def get_or_create(cls, bot, guild_id: int) -> GuildDB:
+        cached = cls.get_cached(guild_id)
+        if cached:
+            return cached
+
         guild_db = await bot.db.fetchrow("""SELECT * FROM guilds WHERE id=$1;""", guild_id)
         if not guild_db:
             try:
@@ -670,7 +834,9 @@ class GuildDB(BaseDBModel):
             except asyncpg.UniqueViolationError:
                 return await cls.get_or_create(bot, guild_id)
 
-        return cls(guild_db, bot)
+        obj = cls(guild_db, bot)
+        cls.CACHE.put(guild_id, obj)
+        return obj
 
     async def change_prefix(self, new_prefix: str):
         self.prefix = new_prefix
@@ -678,10 +844,12 @@ class GuildDB(BaseDBModel):
 
         await self.db.execute(
             """UPDATE guilds SET prefix=$1 WHERE id=$2;""", new_prefix, self.id)
+        await self.write_through()
 
     async def change_volume(self, new_volume: int):
         await self.db.execute("""UPDATE guilds SET volume=$1 WHERE id=$2;""", new_volume, self.id)
         self.volume = new_volume
+        await self.write_through()
 
     async def toggle_delete_commands(self) -> bool:
         await self.db.execute(
@@ -693,6 +861,7 @@ class GuildDB(BaseDBModel):
         )
 
         self.delete_commands = not self.delete_commands
+        await self.write_through()
         return self.delete_commands
 
     async def toggle_level_up_notifs(self) -> bool:
@@ -705,6 +874,7 @@ class GuildDB(BaseDBModel):
         )
 
         self.level_up_notifs_silenced = not self.level_up_notifs_silenced
+        await self.write_through()
         return self.level_up_notifs_silenced
 
     async def get_top_xp_people(self, limit: int = 10) -> list[MemberDB]:
@@ -719,6 +889,7 @@ class GuildDB(BaseDBModel):
         await self.db.execute(
             """UPDATE guilds SET welcome_role_id=$1 WHERE id=$2;""",
             role_id, self.id)
+        await self.write_through()
 
     async def set_welcome(self, channel_id: int = None, msg: str = None):
         self.welcome_channel_id = channel_id
@@ -727,6 +898,7 @@ class GuildDB(BaseDBModel):
         await self.db.execute(
             """UPDATE guilds SET welcome_channel_id=$1, welcome_message=$2 WHERE id=$3;""",
             channel_id, msg, self.id)
+        await self.write_through()
 
     async def set_bye(self, channel_id: int = None, msg: str = None):
         self.bye_channel_id = channel_id
@@ -735,28 +907,33 @@ class GuildDB(BaseDBModel):
         await self.db.execute(
             """UPDATE guilds SET bye_channel_id=$1, bye_message=$2 WHERE id=$3;""",
             channel_id, msg, self.id)
+        await self.write_through()
 
     async def add_xp_excluded_channel(self, channel_id: int):
         self.xp_excluded_channels.append(channel_id)
         await self.db.execute("UPDATE guilds SET xp_excluded_channels=$1 WHERE id=$2;",
                               self.xp_excluded_channels, self.id)
+        await self.write_through()
 
     async def remove_xp_excluded_channel(self, channel_id: int):
         self.xp_excluded_channels.remove(channel_id)
         await self.db.execute("UPDATE guilds SET xp_excluded_channels=$1 WHERE id=$2;",
                               self.xp_excluded_channels, self.id)
+        await self.write_through()
 
     async def add_assignable_role(self, role_id: int):
         self.assignable_role_ids.append(role_id)
         await self.db.execute(
             """UPDATE guilds SET assignable_role_ids = ARRAY_APPEND(assignable_role_ids, $1) WHERE id=$2;""",
             role_id, self.id)
+        await self.write_through()
 
     async def remove_assignable_role(self, role_id: int):
         self.assignable_role_ids.remove(role_id)
         await self.db.execute(
             """UPDATE guilds SET assignable_role_ids = ARRAY_REMOVE(assignable_role_ids, $1) WHERE id=$2;""",
             role_id, self.id)
+        await self.write_through()
 
     async def toggle_exclusive_assignable_roles(self):
         status = await self.db.fetchrow(
@@ -767,6 +944,7 @@ class GuildDB(BaseDBModel):
             self.id)
 
         self.assignable_roles_are_exclusive = status.get('exclusive_assignable_roles')
+        await self.write_through()
 
     def __eq__(self, other):
         if isinstance(other, GuildDB):
@@ -823,6 +1001,14 @@ class GuildLoggingDB(BaseDBModel):
 
         return cls(logging_db, bot)
 
+    @staticmethod
+    async def get_logging_guild_ids(bot, guild_ids: list[int] = None) -> list[int]:
+        """Returns the IDs of our guilds (or of the given guilds) that have logging enabled."""
+        ret = await bot.db.fetch("SELECT id FROM guilds_logging WHERE log_channel_id IS NOT NULL AND id=ANY($1);",
+                                 guild_ids if guild_ids is not None else [x.id for x in bot.guilds])
+
+        return [x['id'] for x in ret]
+
     async def set_modlog_channel(self, channel_id: int):
         self.modlog_channel_id = channel_id
         await self.db.execute("UPDATE guilds_logging SET modlog_channel_id=$1 WHERE id=$2;",
@@ -840,20 +1026,72 @@ class GuildLoggingDB(BaseDBModel):
 
 
 class LoggedMessage(BaseDBModel):
-    TABLE_DEFINITION = """CREATE TABLE IF NOT EXISTS message_log
+    TABLE_DEFINITION = """
+-- every cluster runs this at the same time, so they take turns
+SELECT pg_advisory_xact_lock(hashtext('message_log_definition'));
+
+-- message_log used to be a regular table. its rows are kept as a partition, which expires like the others
+DO
+$$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('message_log')) = 'r' THEN
+            ALTER TABLE message_log RENAME TO message_log_legacy;
+            ALTER TABLE message_log_legacy RENAME CONSTRAINT message_log_pk TO message_log_legacy_pk;
+        END IF;
+    END
+$$;
+
+-- partitioned by day. LoggedMessage.create_partitions creates them
+CREATE TABLE IF NOT EXISTS message_log
 (
-    message_id      bigint                                 NOT NULL
-        CONSTRAINT message_log_pk
-            PRIMARY KEY,
+    message_id      bigint                                 NOT NULL,
     author_id       bigint                                 NOT NULL,
     channel_id      bigint                                 NOT NULL,
     guild_id        bigint,
-    message_content text                                   NOT NULL,
+    message_content text,
     message_embeds  text[]                   DEFAULT '{}'::text[],
-    created_at      timestamp WITH TIME ZONE DEFAULT NOW() NOT NULL
-);
+    created_at      timestamp WITH TIME ZONE DEFAULT NOW() NOT NULL,
+    content_blob    bytea,
+    embeds_blob     bytea,
+    dictionary_id   integer,
+    CONSTRAINT message_log_pk
+        PRIMARY KEY (message_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+DO
+$$
+    BEGIN
+        IF to_regclass('message_log_legacy') IS NOT NULL
+            AND NOT (SELECT relispartition FROM pg_class WHERE oid = to_regclass('message_log_legacy')) THEN
+            -- a partition has to have the columns of message_log, and the primary key of message_log instead of its own
+            ALTER TABLE message_log_legacy
+                DROP CONSTRAINT IF EXISTS message_log_legacy_pk;
+            ALTER TABLE message_log_legacy
+                ADD COLUMN IF NOT EXISTS content_blob bytea,
+                ADD COLUMN IF NOT EXISTS embeds_blob bytea,
+                ADD COLUMN IF NOT EXISTS dictionary_id integer,
+                ALTER COLUMN message_content DROP NOT NULL;
+
+            EXECUTE format('ALTER TABLE message_log ATTACH PARTITION message_log_legacy FOR VALUES FROM (MINVALUE) TO (%L);',
+                           (date_trunc('day', NOW() AT TIME ZONE 'UTC') + INTERVAL '1 day') AT TIME ZONE 'UTC');
+        END IF;
+    END
+$$;
+
+-- compressed with services.MessageCodec. message_content and message_embeds are only set in older rows
+ALTER TABLE message_log
+    ADD COLUMN IF NOT EXISTS content_blob bytea;
+ALTER TABLE message_log
+    ADD COLUMN IF NOT EXISTS embeds_blob bytea;
+ALTER TABLE message_log
+    ADD COLUMN IF NOT EXISTS dictionary_id integer;
+ALTER TABLE message_log
+    ALTER COLUMN message_content DROP NOT NULL;
 """
 
+    PARTITION_DAYS_AHEAD = 3
+    RETENTION_DAYS = 7
+
     class UnknownUser:
         class Avatar:
             def __init__(self, url: str):
@@ -875,12 +1113,33 @@ class LoggedMessage(BaseDBModel):
         self.channel_id: int = data.get('channel_id')
         self.guild_id: int = data.get('guild_id')
 
-        self.content: str = data.get('message_content') or '**UNKNOWN**'
+        self.created_at: datetime = data.get('created_at') or datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-        self.embeds: list[discord.Embed] = [discord.Embed.from_dict(json.loads(x))
-                                            for x in data.get('message_embeds', [])]
+    # content and embeds are only decoded when they're used
 
-        self.created_at: datetime = data.get('created_at') or datetime(1970, 1, 1, tzinfo=timezone.utc)
+    @cached_property
+    def raw_content(self) -> str:
+        blob = self.data.get('content_blob')
+        if blob is not None:
+            return self.bot.message_codec.decode(blob, self.data.get('dictionary_id')).decode('utf-8', 'surrogatepass')
+
+        return self.data.get('message_content') or ''
+
+    @property
+    def content(self) -> str:
+        return self.raw_content or '**UNKNOWN**'
+
+    @cached_property
+    def embed_dicts(self) -> list[dict]:
+        blob = self.data.get('embeds_blob')
+        if blob is not None:
+            return json.loads(self.bot.message_codec.decode(blob, self.data.get('dictionary_id')))
+
+        return [json.loads(x) for x in self.data.get('message_embeds') or []]
+
+    @cached_property
+    def embeds(self) -> list[discord.Embed]:
+        return [discord.Embed.from_dict(x) for x in self.embed_dicts]
 
     @property
     def guild(self) -> discord.Guild:
@@ -907,6 +1166,8 @@ class LoggedMessage(BaseDBModel):
     @classmethod
     async def get(cls, bot, guild_id: int, channel_id: int, message_id: int) -> LoggedMessage:
         msg = await bot.db.fetchrow("SELECT * FROM message_log WHERE message_id=$1;", message_id)
+        if msg:
+            await bot.message_codec.ensure_dictionaries({msg.get('dictionary_id')})
 
         return cls(msg, bot) if msg else cls._uncached_msg_obj(bot, guild_id, channel_id, message_id)
 
@@ -916,11 +1177,12 @@ class LoggedMessage(BaseDBModel):
         ret = []
 
         msgs = await bot.db.fetch("SELECT * FROM message_log WHERE message_id=ANY($1);", message_ids)
+        await bot.message_codec.ensure_dictionaries({msg.get('dictionary_id') for msg in msgs})
 
         # append uncached message objects to the ret list
-        cached_id_list = [msg.get('message_id') for msg in msgs]
+        cached_ids = {msg.get('message_id') for msg in msgs}
         for msg_id in message_ids:
-            if msg_id not in cached_id_list:
+            if msg_id not in cached_ids:
                 ret.append(cls._uncached_msg_obj(bot, guild_id, channel_id, msg_id))
 
         # append cached messages
@@ -929,43 +1191,165 @@ class LoggedMessage(BaseDBModel):
         return ret
 
     @classmethod
-    async def insert(cls, bot, message: discord.Message):
-        await cls.insert_bulk(bot, [message])
+    async def get_latest(cls, bot, limit: int) -> list[LoggedMessage]:
+        # message ids are snowflakes, so this walks the primary key backwards
+        msgs = await bot.db.fetch("SELECT * FROM message_log ORDER BY message_id DESC LIMIT $1;", limit)
+        await bot.message_codec.ensure_dictionaries({msg.get('dictionary_id') for msg in msgs})
+
+        return [cls(msg, bot) for msg in msgs]
+
+    @classmethod
+    async def create_table(cls, bot):
+        await super().create_table(bot)
+        await cls.create_partitions(bot)
+
+    @classmethod
+    async def create_partitions(cls, bot):
+        """Creates the partitions of the retained days, today and the next few days."""
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # the past ones are for edits of older messages, which are written with their original creation time
+        for i in range(-cls.RETENTION_DAYS, cls.PARTITION_DAYS_AHEAD + 1):
+            start = today + timedelta(days=i)
+            end = start + timedelta(days=1)
+
+            try:
+                await bot.db.execute(f"CREATE TABLE IF NOT EXISTS message_log_p{start:%Y%m%d} PARTITION OF message_log "
+                                     f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');")
+            except (asyncpg.InvalidObjectDefinitionError, asyncpg.DuplicateTableError, asyncpg.UniqueViolationError):
+                # the legacy partition covers it or another cluster has just created it
+                pass
+
+    @classmethod
+    async def drop_old_partitions(cls, bot) -> list[str]:
+        """Drops the partitions that only have messages older than RETENTION_DAYS. Returns their names."""
+        partitions = await bot.db.fetch(
+            """SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound 
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid 
+            WHERE i.inhparent = 'message_log'::regclass;""")
+
+        threshold = datetime.now(timezone.utc) - timedelta(days=cls.RETENTION_DAYS)
+
+        dropped = []
+        for partition in partitions:
+            # FOR VALUES FROM ('2022-01-01 00:00:00+00') TO ('2022-01-02 00:00:00+00')
+            match = re.search(r"TO \('([^']+)'\)", partition['bound'])
+            if match and datetime.fromisoformat(match.group(1)) <= threshold:
+                await bot.db.execute(f'DROP TABLE IF EXISTS "{partition["name"]}";')
+                dropped.append(partition['name'])
+
+        return dropped
+
+    @classmethod
+    def is_retained(cls, created_at: datetime) -> bool:
+        """Whether the partition of a message is sure to exist until the message is written.
+        A day of margin, as the expired partitions are dropped once an hour."""
+        return created_at > datetime.now(timezone.utc) - timedelta(days=cls.RETENTION_DAYS - 1)
 
     @classmethod
-    async def insert_bulk(cls, bot, messages: list[discord.Message]):
-        tup = (
+    def from_cached(cls, bot, message: CachedMessage) -> LoggedMessage:
+        return cls(message.to_row(), bot)
+
+    @classmethod
+    async def insert_bulk(cls, bot, messages: list[CachedMessage]):
+        # an edited message can come along with its earlier version. only the latest one is written
+        messages = list({message.id: message for message in messages}.values())
+
+        dictionary_id, blobs = await bot.message_codec.encode_messages(messages)
+
+        records = [
             (message.id,
-             message.author.id,
-             message.channel.id,
-             message.guild.id if message.guild else None,
-             message.content.replace("\u0000", ""),
-             tuple(json.dumps(e.to_dict()) for e in message.embeds),
+             message.author_id,
+             message.channel_id,
+             message.guild_id,
+             content_blob,
+             embeds_blob,
+             dictionary_id,
              message.created_at
-             ) for message in messages)
+             ) for message, (content_blob, embeds_blob) in zip(messages, blobs)]
+
+        # COPY can't update the rows we already have, so copy to a staging table and merge from there
+        async with bot.db.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""CREATE TEMPORARY TABLE IF NOT EXISTS message_log_staging 
+                (LIKE message_log INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;""")
+
+                await conn.copy_records_to_table('message_log_staging',
+                                                 records=records,
+                                                 columns=('message_id', 'author_id', 'channel_id', 'guild_id',
+                                                          'content_blob', 'embeds_blob', 'dictionary_id',
+                                                          'created_at'))
+
+                # rows that are already there belong to messages that have been edited since
+                await conn.execute("""INSERT INTO message_log SELECT * FROM message_log_staging 
+                ON CONFLICT (message_id, created_at) DO UPDATE SET 
+                content_blob = excluded.content_blob, 
+                embeds_blob = excluded.embeds_blob, 
+                dictionary_id = excluded.dictionary_id, 
+                message_content = NULL, 
+                message_embeds = excluded.message_embeds;""")
+
+
+class MessageDictionaryDB(BaseDBModel):
+    TABLE_DEFINITION = """CREATE TABLE IF NOT EXISTS message_log_dictionaries
+(
+    id         serial
+        CONSTRAINT message_log_dictionaries_pk
+            PRIMARY KEY,
+    data       bytea                                  NOT NULL,
+    created_at timestamp WITH TIME ZONE DEFAULT NOW() NOT NULL
+);
+"""
+
+    def __init__(self, data: Record, bot):
+        super().__init__(data, bot)
 
-        await bot.db.executemany("""
-             INSERT INTO message_log(
-             message_id, 
-             author_id, 
-             channel_id, 
-             guild_id, 
-             message_content, 
-             message_embeds, 
-             created_at) 
-             VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT DO NOTHING;
-            """, tup)
+        self.dictionary: bytes = data.get('data')
+        self.created_at: datetime = data.get('created_at')
 
-        # update active guilds with this info
-        guild_id_list = list(dict.fromkeys([x.guild.id for x in messages if x.guild]))
-        await GuildDB.update_active_guilds(bot, guild_id_list)
+    @classmethod
+    async def create(cls, bot, data: bytes) -> MessageDictionaryDB:
+        created = await bot.db.fetchrow("INSERT INTO message_log_dictionaries(data) VALUES ($1) RETURNING *;", data)
+        return cls(created, bot)
 
     @classmethod
-    async def delete_old_messages(cls, bot: ShinobuBot):
-        await bot.wait_until_ready()
+    async def get_ids(cls, bot) -> list[int]:
+        return [row['id'] for row in await bot.db.fetch("SELECT id FROM message_log_dictionaries ORDER BY id;")]
 
-        # delete messages that are older than 7 days
-        await bot.db.execute("DELETE FROM message_log WHERE created_at < (NOW() - INTERVAL '7 days')")
+    @classmethod
+    async def get_bulk(cls, bot, dictionary_ids: list[int]) -> list[MessageDictionaryDB]:
+        rows = await bot.db.fetch("SELECT * FROM message_log_dictionaries WHERE id=ANY($1) ORDER BY id;",
+                                  dictionary_ids)
+        return [cls(row, bot) for row in rows]
+
+    @classmethod
+    async def delete_expired(cls, bot, keep_days: int):
+        """Deletes the dictionaries that were replaced long enough ago that no message uses them anymore."""
+        await bot.db.execute(
+            """DELETE FROM message_log_dictionaries d WHERE EXISTS (
+            SELECT 1 FROM message_log_dictionaries n WHERE n.id > d.id AND n.created_at < NOW() - $1 * INTERVAL '1 day');""",
+            keep_days)
+
+
+class ClusterJobRunDB(BaseDBModel):
+    TABLE_DEFINITION = """CREATE TABLE IF NOT EXISTS cluster_job_runs
+(
+    name        text                     NOT NULL
+        CONSTRAINT cluster_job_runs_pk
+            PRIMARY KEY,
+    last_run_at timestamp WITH TIME ZONE NOT NULL
+);
+"""
+
+    @classmethod
+    async def get_last_run(cls, bot, name: str) -> datetime | None:
+        return await bot.db.fetchval("SELECT last_run_at FROM cluster_job_runs WHERE name=$1;", name)
+
+    @classmethod
+    async def set_last_run(cls, bot, name: str):
+        await bot.db.execute(
+            """INSERT INTO cluster_job_runs(name, last_run_at) VALUES ($1, NOW())
+            ON CONFLICT (name) DO UPDATE SET last_run_at=excluded.last_run_at;""", name)
 
 
 class ReminderDB(BaseDBModel):
@@ -980,11 +1364,36 @@ class ReminderDB(BaseDBModel):
     content           text                                   NOT NULL,
     length_in_seconds bigint                                 NOT NULL,
     creation_date     timestamp WITH TIME ZONE DEFAULT NOW() NOT NULL,
-    done              boolean                  DEFAULT FALSE NOT NULL
+    done              boolean                  DEFAULT FALSE NOT NULL,
+    due_at            timestamp WITH TIME ZONE,
+    guild_id          bigint
 );
 
+DO
+$$
+    BEGIN
+        IF NOT EXISTS(SELECT 1
+                      FROM information_schema.columns
+                      WHERE table_schema = current_schema() AND table_name = 'reminders' AND column_name = 'due_at') THEN
+            ALTER TABLE reminders
+                ADD COLUMN IF NOT EXISTS due_at timestamp WITH TIME ZONE;
+            UPDATE reminders
+            SET due_at = creation_date + length_in_seconds * INTERVAL '1 second'
+            WHERE done IS FALSE;
+        END IF;
+    END
+$$;
+-- null for dm reminders
+ALTER TABLE reminders
+    ADD COLUMN IF NOT EXISTS guild_id bigint;
+
+CREATE INDEX IF NOT EXISTS reminders_due_at_index
+    ON reminders (due_at) WHERE done IS FALSE;
 """
 
+    # how many rows are fetched at once while streaming the reminders of a cluster
+    CURSOR_PREFETCH = 500
+
     class ChannelType(Enum):
         DM = 0
         TEXT_CHANNEL = 1
@@ -994,6 +1403,7 @@ class ReminderDB(BaseDBModel):
 
         self.author_id: int = data.get('author_id')
 
+        self.guild_id: int | None = data.get('guild_id')
         self.channel_id: int = data.get('channel_id')
         self.channel_type = self.ChannelType(data.get('channel_type'))
 
@@ -1012,28 +1422,82 @@ class ReminderDB(BaseDBModel):
                      channel_id: int,
                      channel_type: ChannelType,
                      content: str,
-                     date_obj: mido_utils.Time):
+                     date_obj: mido_utils.Time,
+                     guild_id: int = None):
         created = await bot.db.fetchrow(
             """INSERT INTO 
-            reminders(channel_id, channel_type, length_in_seconds, author_id, content) 
-            VALUES ($1, $2, $3, $4, $5) RETURNING *;""",
-            channel_id, channel_type.value, date_obj.initial_remaining_seconds, author_id, content)
+            reminders(channel_id, channel_type, length_in_seconds, author_id, content, guild_id, due_at) 
+            VALUES ($1, $2, $3, $4, $5, $6, NOW() + $3 * INTERVAL '1 second') RETURNING *;""",
+            channel_id, channel_type.value, date_obj.initial_remaining_seconds, author_id, content, guild_id)
 
         return cls(created, bot)
 
     @classmethod
-    async def get_uncompleted_reminders(cls, bot, user_id: int = None):
-        if user_id is not None:
-            reminders = await bot.db.fetch("""SELECT * FROM reminders WHERE author_id=$1 AND done IS NOT TRUE;""",
-                                           user_id)
-        else:
-            reminders = await bot.db.fetch("""SELECT * FROM reminders WHERE done IS NOT TRUE;""")
+    async def get(cls, bot, reminder_id: int) -> ReminderDB | None:
+        reminder = await bot.db.fetchrow("""SELECT * FROM reminders WHERE id=$1;""", reminder_id)
+
+        return cls(reminder, bot) if reminder else None
+
+    @classmethod
+    async def get_uncompleted_reminders(cls, bot, user_id: int):
+        reminders = await bot.db.fetch("""SELECT * FROM reminders WHERE author_id=$1 AND done IS NOT TRUE;""",
+                                       user_id)
 
         return list(sorted((cls(reminder, bot) for reminder in reminders), key=lambda x: x.time_obj.end_date))
 
-    async def complete(self):
+    @classmethod
+    async def iterate_due_reminders_of_cluster(cls, bot, due_before: datetime):
+        """
+        Streams the due reminders that belong to this cluster.
+
+        Guild reminders belong to the cluster that has the shard of the guild.
+        DM reminders (and the old guild reminders that don't have a guild ID) are spread by their author.
+        """
+        async with bot.db.acquire() as conn:
+            async with conn.transaction():
+                async for reminder in conn.cursor(
+                        """
+                        SELECT 
+                            * 
+                        FROM 
+                            reminders 
+                        WHERE 
+                            done IS FALSE AND due_at < $1
+                            AND CASE 
+                                WHEN guild_id IS NOT NULL THEN (guild_id >> 22) % $2 = ANY($3::bigint[])
+                                ELSE author_id % $4 = $5
+                            END;""",
+                        due_before, bot.shard_count, list(bot.shard_ids), bot.cluster_count, bot.cluster_id,
+                        prefetch=cls.CURSOR_PREFETCH):
+                    yield cls(reminder, bot)
+
+    @classmethod
+    async def set_missing_guild_ids(cls, bot) -> int:
+        """Sets the guild IDs of the old guild reminders whose channel we can see. Returns how many are set."""
+        reminders = await bot.db.fetch(
+            """SELECT id, channel_id FROM reminders WHERE guild_id IS NULL AND channel_type=$1 AND done IS FALSE;""",
+            cls.ChannelType.TEXT_CHANNEL.value)
+
+        ids, guild_ids = [], []
+        for reminder in reminders:
+            channel = bot.get_channel(reminder['channel_id'])
+            if channel and getattr(channel, 'guild', None):
+                ids.append(reminder['id'])
+                guild_ids.append(channel.guild.id)
+
+        if ids:
+            await bot.db.execute(
+                """UPDATE reminders SET guild_id=u.guild_id 
+                FROM UNNEST($1::int[], $2::bigint[]) AS u(id, guild_id) WHERE reminders.id=u.id;""",
+                ids, guild_ids)
+
+        return len(ids)
+
+    async def complete(self) -> bool:
+        """Marks the reminder as done. Returns False if it was already done, so that only one caller sends it."""
         self.done = True
-        await self.db.execute("""UPDATE reminders SET done=TRUE WHERE id=$1;""", self.id)
+        return await self.db.fetchval("""UPDATE reminders SET done=TRUE WHERE id=$1 AND done IS FALSE RETURNING id;""",
+                                      self.id) is not None
 
     def __eq__(self, other):
         if isinstance(other, ReminderDB):
@@ -1109,31 +1573,10 @@ class CustomReaction(BaseDBModel):
 
         return [cls(cr, bot) for cr in ret]
 
-    @classmethod
-    async def try_get(cls, bot, msg: str, guild_id):
+    @staticmethod
+    def normalize_message(bot, msg: str) -> str:
         msg = msg.strip().lower().replace('%mention%', '')  # remove any manually typed %mention%
-        msg = re.sub(f'<@(!?){bot.user.id}>', '%mention%', msg)  # replace actual mention with %mention%
-
-        # guild crs
-        ret = await bot.db.fetch("""SELECT * FROM custom_reactions 
-        WHERE (trigger = $1
-        OR (contains_anywhere=TRUE AND ($1 LIKE CONCAT('%', f_like_escape(trigger), '%')) 
-        OR (response LIKE '%\%target\%%' AND $1 LIKE CONCAT(trigger, '%')))
-        ) AND guild_id=$2;""", msg, guild_id)
-
-        if not ret:
-            # global crs
-            ret = await bot.db.fetch("""SELECT * FROM custom_reactions 
-            WHERE (
-            trigger = $1 
-            OR contains_anywhere=TRUE AND ($1 LIKE CONCAT('%', f_like_escape(trigger), '%')) 
-            OR (response LIKE '%\%target\%%' AND $1 LIKE CONCAT(trigger, '%'))
-            ) AND guild_id IS NULL;""", msg)
-
-            if not ret:
-                return None
-
-        return cls(random.choice(ret), bot)
+        return re.sub(f'<@(!?){bot.user.id}>', '%mention%', msg)  # replace actual mention with %mention%
 
     async def increase_use_count(self):
         self.use_count += 1
@@ -1247,7 +1690,10 @@ class CachedImage(BaseDBModel, NSFWImage):
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS api_cache_url_uindex
-    ON api_cache (url);"""
+    ON api_cache (url);
+
+CREATE INDEX IF NOT EXISTS api_cache_last_url_check_index
+    ON api_cache (last_url_check);"""
 
     def __init__(self, data: Record, bot):
         super().__init__(data, bot)
@@ -1295,8 +1741,11 @@ CREATE UNIQUE INDEX IF NOT EXISTS api_cache_url_uindex
         await self.bot.db.execute("UPDATE api_cache SET report_count = report_count + 1 WHERE id=$1;", self.id)
 
     @classmethod
-    async def get_oldest_checked_images(cls, bot, limit: int = 100) -> list[CachedImage]:
-        images = await bot.db.fetch("SELECT * FROM api_cache ORDER BY last_url_check ASC LIMIT $1;", limit)
+    async def get_oldest_checked_images(cls, bot, limit: int = 100,
+                                        partition: int = 0, partition_count: int = 1) -> list[CachedImage]:
+        images = await bot.db.fetch(
+            "SELECT * FROM api_cache WHERE id % $2 = $3 ORDER BY last_url_check ASC LIMIT $1;",
+            limit, partition_count, partition)
 
         return [cls(img, bot) for img in images]
 
@@ -1352,6 +1801,9 @@ class DonutEvent(BaseDBModel):
     start_date         timestamp WITH TIME ZONE,
     message_is_deleted boolean  DEFAULT FALSE          NOT NULL
 );
+
+CREATE INDEX IF NOT EXISTS donut_events_end_date_index
+    ON donut_events (end_date) WHERE message_is_deleted IS FALSE;
 """
 
     def __init__(self, data: Record, bot):
@@ -1399,6 +1851,14 @@ class DonutEvent(BaseDBModel):
 
         return [cls(x, bot) for x in ret]
 
+    @classmethod
+    async def get_ending_ones(cls, bot, ends_before: datetime) -> list[DonutEvent]:
+        ret = await bot.db.fetch("SELECT * FROM donut_events "
+                                 "WHERE end_date < $1 AND message_is_deleted IS FALSE AND guild_id=ANY($2);",
+                                 ends_before, [x.id for x in bot.guilds])
+
+        return [cls(x, bot) for x in ret]
+
     @classmethod
     async def create(cls,
                      bot,
@@ -1440,11 +1900,7 @@ class DonutEvent(BaseDBModel):
         except discord.Forbidden:
             pass
 
-    async def delete_msg_and_mark_as_deleted(self, delay: float = None):
-        """delay in seconds"""
-        if delay:
-            await asyncio.sleep(delay)
-
+    async def delete_msg_and_mark_as_deleted(self):
         msg = await self.fetch_message_object()
         if msg:
             await msg.delete()
@@ -1516,6 +1972,15 @@ class BlacklistDB(BaseDBModel):
         else:
             return cls(ret, bot)
 
+    @classmethod
+    async def get_all_ids(cls, bot) -> dict[BlacklistType, set[int]]:
+        ret = {bl_type: set() for bl_type in cls.BlacklistType}
+
+        for record in await bot.db.fetch("SELECT user_or_guild_id, type FROM blacklist;"):
+            ret[cls.BlacklistType[record['type']]].add(record['user_or_guild_id'])
+
+        return ret
+
     @classmethod
     async def blacklist(cls,
                         bot,
@@ -1647,8 +2112,27 @@ CREATE TABLE IF NOT EXISTS guilds_repeat
     delete_previous      boolean                  DEFAULT TRUE  NOT NULL,
     last_post_date       timestamp WITH TIME ZONE,
     created_by           bigint                                 NOT NULL,
-    last_post_message_id bigint
+    last_post_message_id bigint,
+    due_at               timestamp WITH TIME ZONE
 );
+
+-- date of the next post
+DO
+$$
+    BEGIN
+        IF NOT EXISTS(SELECT 1
+                      FROM information_schema.columns
+                      WHERE table_schema = current_schema() AND table_name = 'guilds_repeat' AND column_name = 'due_at') THEN
+            ALTER TABLE guilds_repeat
+                ADD COLUMN IF NOT EXISTS due_at timestamp WITH TIME ZONE;
+            UPDATE guilds_repeat
+            SET due_at = COALESCE(last_post_date, creation_date) + post_interval * INTERVAL '1 second';
+        END IF;
+    END
+$$;
+
+CREATE INDEX IF NOT EXISTS guilds_repeat_due_at_index
+    ON guilds_repeat (due_at);
 """
 
     def __init__(self, data: Record, bot):
@@ -1667,6 +2151,8 @@ CREATE TABLE IF NOT EXISTS guilds_repeat
             data.get('last_post_date', datetime(2000, 1, 1, tzinfo=timezone.utc)))
         self.last_post_message_id: int = data.get('last_post_message_id')
 
+        self.due_at: datetime = data.get('due_at')
+
         self.created_by_id: int = data.get('created_by')
 
     @property
@@ -1688,16 +2174,17 @@ CREATE TABLE IF NOT EXISTS guilds_repeat
                      delete_previous: bool = True) -> RepeatDB:
         created = await bot.db.fetchrow(
             """INSERT INTO 
-            guilds_repeat(guild_id, channel_id, message, post_interval, delete_previous, created_by) 
-            VALUES ($1, $2, $3, $4, $5, $6) RETURNING *;""",
+            guilds_repeat(guild_id, channel_id, message, post_interval, delete_previous, created_by, due_at) 
+            VALUES ($1, $2, $3, $4, $5, $6, NOW() + $4 * INTERVAL '1 second') RETURNING *;""",
             guild_id, channel_id, message, post_interval, delete_previous, created_by_id)
 
         return cls(created, bot)
 
     @classmethod
-    async def get_all(cls, bot) -> list[RepeatDB]:
+    async def get_due(cls, bot, due_before: datetime) -> list[RepeatDB]:
         guild_ids = [x.id for x in bot.guilds]
-        ret = await bot.db.fetch("SELECT * FROM guilds_repeat WHERE guild_id=ANY($1);", guild_ids)
+        ret = await bot.db.fetch("SELECT * FROM guilds_repeat WHERE due_at < $1 AND guild_id=ANY($2);",
+                                 due_before, guild_ids)
 
         return [cls(repeat, bot) for repeat in ret]
 
@@ -1710,8 +2197,10 @@ CREATE TABLE IF NOT EXISTS guilds_repeat
     async def just_posted(self, message_id: int):
         self.last_post_date = mido_utils.Time()
         self.last_post_message_id = message_id
-        await self.bot.db.execute("UPDATE guilds_repeat SET last_post_date=$1, last_post_message_id=$2 WHERE id=$3;",
-                                  self.last_post_date.start_date, message_id, self.id)
+        self.due_at = self.last_post_date.start_date + timedelta(seconds=self.post_interval)
+        await self.bot.db.execute(
+            "UPDATE guilds_repeat SET last_post_date=$1, last_post_message_id=$2, due_at=$3 WHERE id=$4;",
+            self.last_post_date.start_date, message_id, self.due_at, self.id)
 
     async def delete(self):
         await self.bot.db.execute("DELETE FROM guilds_repeat WHERE id=$1;", self.id)
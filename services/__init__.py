@@ -1,4 +1,11 @@
 # TODO: move more services to here.
 from .cache import BaseCache, LocalCache, RedisCache
+from .cluster_jobs import *
+from .custom_reactions import *
+from .message_cache import *
+from .message_codec import *
 from .reminders import *
 from .repeaters import *
+from .scheduler import *
+from .webhook_outbox import *
+from .xp import *
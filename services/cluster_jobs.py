@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+import asyncpg
+
+from models import ClusterJobRunDB
+from ._base_service import BaseShinobuService
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+
+__all__ = ['ClusterJobService']
+
+
+class _ClusterJob:
+    __slots__ = ('name', 'func', 'partitioned', 'lock_key')
+
+    def __init__(self, bot_name: str, name: str, func: Callable[[int, int], Awaitable], partitioned: bool):
+        self.name = name
+        self.func = func
+        self.partitioned = partitioned
+
+        # advisory locks take 2 int4 keys. the second one is the partition
+        self.lock_key = zlib.crc32(f'{bot_name}:{name}'.encode()) - 2 ** 31
+
+
+class ClusterJobService(BaseShinobuService):
+    """
+    Runs the background jobs that work on shared data on a single cluster instead of every cluster.
+
+    Every job (or every partition of a partitioned job) is guarded by a Postgres advisory lock
+    that is held on a dedicated connection. If the cluster that holds a lock dies, its connection is closed,
+    the lock is released and another cluster takes the job over in the next check.
+
+    Partitioned jobs have a partition per cluster. A cluster takes over the partition of another cluster
+    only while that cluster is down, and gives it back once it's up again.
+
+    A job that keeps crashing is restarted with an exponential backoff.
+    """
+    CHECK_INTERVAL = 15.0
+
+    MAX_BACKOFF = 60.0 * 60
+    # a job that crashes after running this long is not crash looping, so its backoff starts over
+    STABLE_AFTER = 60.0 * 10
+
+    def __init__(self, bot: ShinobuBot):
+        super().__init__(bot)
+
+        self.jobs: dict[str, _ClusterJob] = dict()
+
+        # (job name, partition) -> task of the jobs we hold the lock of
+        self.running: dict[tuple[str, int], asyncio.Task] = dict()
+        # locks of the removed jobs, which are released in the next check
+        self.to_release: list[tuple[int, int]] = list()
+
+        # (job name, partition) -> consecutive crashes, and the monotonic time it can be restarted at
+        self.failures: dict[tuple[str, int], int] = dict()
+        self.retry_at: dict[tuple[str, int], float] = dict()
+
+        self.conn: asyncpg.Connection | None = None
+
+        self.check_task = self.bot.loop.create_task(self.check_loop())
+
+    def add_singleton_job(self, name: str, func: Callable[[], Awaitable]):
+        """Runs func on exactly one cluster."""
+        self.jobs[name] = _ClusterJob(self.bot.name, name, lambda partition, partition_count: func(), False)
+
+    def add_periodic_job(self, name: str, func: Callable[[], Awaitable], interval: timedelta):
+        """
+        Runs func on exactly one cluster every interval.
+        The time of the last run is kept in the db, so that restarts and takeovers don't run it early.
+        """
+
+        async def run_periodically():
+            while True:
+                last_run = await ClusterJobRunDB.get_last_run(self.bot, name)
+                if last_run is not None:
+                    wait = (last_run + interval - datetime.now(timezone.utc)).total_seconds()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                await func()
+                await ClusterJobRunDB.set_last_run(self.bot, name)
+
+        self.add_singleton_job(name, run_periodically)
+
+    def add_partitioned_job(self, name: str, func: Callable[[int, int], Awaitable]):
+        """Runs func(partition, partition_count) for every partition, each on exactly one cluster."""
+        self.jobs[name] = _ClusterJob(self.bot.name, name, func, True)
+
+    def remove_job(self, name: str):
+        job = self.jobs.pop(name, None)
+        if not job:
+            return
+
+        for key in [key for key in self.running if key[0] == name]:
+            self.running.pop(key).cancel()
+            self.to_release.append((job.lock_key, key[1]))
+
+        for key in [key for key in self.failures if key[0] == name]:
+            del self.failures[key]
+            self.retry_at.pop(key, None)
+
+    def _cluster_is_up(self, cluster_id: int) -> bool:
+        stats = self.bot.stats_board.read(cluster_id)
+        return stats is not None and stats.updated_at > time.time() - self.bot.stats_board.STALE_AFTER
+
+    def _wants(self, job: _ClusterJob, partition: int) -> bool:
+        if not job.partitioned or partition == self.bot.cluster_id:
+            return True
+
+        # take over the partitions of the clusters that are down
+        return not self._cluster_is_up(partition)
+
+    def _start(self, job: _ClusterJob, partition: int):
+        partition_count = self.bot.cluster_count if job.partitioned else 1
+        self.running[(job.name, partition)] = self.bot.loop.create_task(
+            self._run(job, partition, partition_count), name=f'{job.name}_{partition}')
+
+    def _can_start(self, key: tuple[str, int]) -> bool:
+        return time.monotonic() >= self.retry_at.get(key, 0.0)
+
+    async def _run(self, job: _ClusterJob, partition: int, partition_count: int):
+        key = (job.name, partition)
+        started_at = time.monotonic()
+
+        try:
+            await job.func(partition, partition_count)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            failures = 0 if time.monotonic() - started_at > self.STABLE_AFTER else self.failures.get(key, 0)
+            self.failures[key] = failures + 1
+
+            delay = min(self.CHECK_INTERVAL * 2 ** failures, self.MAX_BACKOFF)
+            self.retry_at[key] = time.monotonic() + delay
+
+            self.bot.logger.exception(f"Cluster job {job.name} (partition {partition}) crashed. "
+                                      f"It will be restarted in {delay:.0f} seconds.")
+        else:
+            self.failures.pop(key, None)
+            self.retry_at.pop(key, None)
+
+    def _stop_all(self):
+        for task in self.running.values():
+            task.cancel()
+
+        self.running = dict()
+        self.to_release = list()
+
+    async def check_jobs(self):
+        if self.conn is None or self.conn.is_closed():
+            # our locks are gone with the old connection
+            self._stop_all()
+            self.conn = await asyncpg.connect(**self.bot.config.db_credentials)
+
+        while self.to_release:
+            await self.conn.execute("SELECT pg_advisory_unlock($1, $2);", *self.to_release.pop())
+
+        for job in list(self.jobs.values()):
+            for partition in range(self.bot.cluster_count if job.partitioned else 1):
+                key = (job.name, partition)
+
+                if key in self.running:
+                    if not self._wants(job, partition):
+                        self.running.pop(key).cancel()
+                        await self.conn.execute("SELECT pg_advisory_unlock($1, $2);", job.lock_key, partition)
+                        self.bot.logger.info(f"Gave cluster job {job.name} (partition {partition}) back.")
+
+                    elif self.running[key].done() and self._can_start(key):
+                        self._start(job, partition)
+
+                elif self._wants(job, partition) and self._can_start(key):
+                    if await self.conn.fetchval("SELECT pg_try_advisory_lock($1, $2);", job.lock_key, partition):
+                        self._start(job, partition)
+                        self.bot.logger.info(f"Took cluster job {job.name} (partition {partition}) over.")
+
+    async def check_loop(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                await self.check_jobs()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception("Error while checking the cluster jobs. "
+                                          "Stopping them until we get a new connection.")
+                self._stop_all()
+
+                if self.conn is not None:
+                    self.conn.terminate()
+
+            await asyncio.sleep(self.CHECK_INTERVAL)
+
+    def stop(self):
+        self.check_task.cancel()
+        self._stop_all()
+
+        # closing the connection releases the locks
+        if self.conn is not None:
+            self.conn.terminate()
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from collections import deque
+from typing import TYPE_CHECKING
+
+from models import CustomReaction
+from ._base_service import BaseShinobuService
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+
+
+class _TrieNode:
+    __slots__ = ('children', 'fail', 'outputs')
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = dict()
+        self.fail: _TrieNode | None = None
+        self.outputs: list[CustomReaction] = []
+
+
+class _PrefixTrie:
+    """Finds every trigger that the message starts with."""
+
+    def __init__(self, crs: list[CustomReaction]):
+        self.root = _TrieNode()
+
+        for cr in crs:
+            node = self.root
+            for char in cr.trigger:
+                node = node.children.setdefault(char, _TrieNode())
+            node.outputs.append(cr)
+
+    def find(self, msg: str) -> list[CustomReaction]:
+        node = self.root
+        ret = list(node.outputs)
+
+        for char in msg:
+            node = node.children.get(char)
+            if node is None:
+                break
+            ret.extend(node.outputs)
+
+        return ret
+
+
+class _AhoCorasick(_PrefixTrie):
+    """Finds every trigger that appears anywhere in the message in a single pass."""
+
+    def __init__(self, crs: list[CustomReaction]):
+        super().__init__(crs)
+
+        # build the failure links using BFS
+        queue = deque()
+        for child in self.root.children.values():
+            child.fail = self.root
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in node.children.items():
+                fail = node.fail
+                while fail is not None and char not in fail.children:
+                    fail = fail.fail
+
+                child.fail = fail.children[char] if fail is not None else self.root
+                child.outputs.extend(x for x in child.fail.outputs if x not in child.outputs)
+                queue.append(child)
+
+    def find(self, msg: str) -> list[CustomReaction]:
+        node = self.root
+        found: dict[int, CustomReaction] = {cr.id: cr for cr in node.outputs}
+
+        for char in msg:
+            while node is not self.root and char not in node.children:
+                node = node.fail
+
+            node = node.children.get(char, self.root)
+            for cr in node.outputs:
+                found[cr.id] = cr
+
+        return list(found.values())
+
+
+class CustomReactionMatcher:
+    """Matches messages against a set of custom reactions without touching the database.
+
+    A custom reaction matches if:
+        - its trigger is the message itself,
+        - it has contains_anywhere enabled and its trigger is in the message,
+        - its response has %target% in it and the message starts with its trigger.
+    """
+
+    def __init__(self, crs: list[CustomReaction]):
+        self.crs: dict[int, CustomReaction] = {cr.id: cr for cr in crs}
+
+        self._exact: dict[str, list[CustomReaction]] = dict()
+        self._contains: _AhoCorasick | None = None
+        self._prefix: _PrefixTrie | None = None
+
+        self._dirty = True
+
+    def add(self, cr: CustomReaction):
+        self.crs[cr.id] = cr
+        self._dirty = True
+
+    def remove(self, cr_id: int):
+        if self.crs.pop(cr_id, None):
+            self._dirty = True
+
+    def _build(self):
+        self._exact = dict()
+        for cr in self.crs.values():
+            self._exact.setdefault(cr.trigger, []).append(cr)
+
+        contains_crs = [cr for cr in self.crs.values() if cr.contains_anywhere]
+        self._contains = _AhoCorasick(contains_crs) if contains_crs else None
+
+        target_crs = [cr for cr in self.crs.values() if '%target%' in cr.response]
+        self._prefix = _PrefixTrie(target_crs) if target_crs else None
+
+        self._dirty = False
+
+    def match(self, msg: str) -> list[CustomReaction]:
+        if not self.crs:
+            return []
+
+        if self._dirty:
+            self._build()
+
+        found: dict[int, CustomReaction] = {cr.id: cr for cr in self._exact.get(msg, ())}
+
+        if self._contains:
+            found.update((cr.id, cr) for cr in self._contains.find(msg))
+
+        if self._prefix:
+            found.update((cr.id, cr) for cr in self._prefix.find(msg))
+
+        return list(found.values())
+
+    def __len__(self):
+        return len(self.crs)
+
+
+class CustomReactionService(BaseShinobuService):
+    """Keeps a matcher per guild (and one for global custom reactions) which are loaded lazily."""
+
+    GLOBAL = None
+
+    def __init__(self, bot: ShinobuBot):
+        super().__init__(bot)
+
+        self.matchers: dict[int | None, CustomReactionMatcher] = dict()
+        self._loading: dict[int | None, asyncio.Task] = dict()
+
+    async def get_matcher(self, guild_id: int | None) -> CustomReactionMatcher:
+        try:
+            return self.matchers[guild_id]
+        except KeyError:
+            pass
+
+        # make sure we query the db only once if a lot of messages arrive at the same time
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = self._loading[guild_id] = self.bot.loop.create_task(self._load(guild_id))
+            task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+
+        return await asyncio.shield(task)
+
+    async def _load(self, guild_id: int | None) -> CustomReactionMatcher:
+        crs = await CustomReaction.get_all(bot=self.bot, guild_id=guild_id)
+
+        matcher = self.matchers[guild_id] = CustomReactionMatcher(crs)
+        return matcher
+
+    async def find(self, msg: str, guild_id: int) -> CustomReaction | None:
+        msg = CustomReaction.normalize_message(self.bot, msg)
+
+        found = (await self.get_matcher(guild_id)).match(msg)
+        if not found:
+            found = (await self.get_matcher(self.GLOBAL)).match(msg)
+
+            if not found:
+                return None
+
+        return random.choice(found)
+
+    def add(self, cr: CustomReaction):
+        # if it's not loaded yet, it'll be in the db query anyway
+        if cr.guild_id in self.matchers:
+            self.matchers[cr.guild_id].add(cr)
+
+    def remove(self, cr: CustomReaction):
+        if cr.guild_id in self.matchers:
+            self.matchers[cr.guild_id].remove(cr.id)
+
+    def update(self, cr: CustomReaction):
+        self.remove(cr)
+        self.add(cr)
+
+    def drop(self, guild_id: int | None):
+        """Forgets the custom reactions of a guild so that they're loaded again on the next message."""
+        self.matchers.pop(guild_id, None)
+
+    def stop(self):
+        for task in self._loading.values():
+            task.cancel()
+
+        self._loading = dict()
+        self.matchers = dict()
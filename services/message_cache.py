@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import discord
+
+__all__ = ['CachedMessage', 'MessageCache']
+
+_NO_EMBEDS = ()
+
+
+class CachedMessage:
+    """The parts of a message that the Logging cog needs. Uses the column names of the message_log table."""
+    __slots__ = ('id', 'author_id', 'channel_id', 'guild_id', 'content', 'embeds', 'created_at')
+
+    def __init__(self, message_id: int, author_id: int, channel_id: int, guild_id: int | None,
+                 content: str, embeds: tuple[str, ...], created_at: datetime):
+        self.id = message_id
+        self.author_id = author_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.content = content
+        self.embeds = embeds  # json strings
+        self.created_at = created_at
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> CachedMessage:
+        return cls(message_id=message.id,
+                   author_id=message.author.id,
+                   channel_id=message.channel.id,
+                   guild_id=message.guild.id if message.guild else None,
+                   content=message.content.replace("\u0000", ""),
+                   embeds=tuple(json.dumps(e.to_dict()) for e in message.embeds) if message.embeds else _NO_EMBEDS,
+                   created_at=message.created_at)
+
+    @classmethod
+    def from_data(cls, data: dict, guild_id: int | None) -> CachedMessage:
+        """From a message payload of the gateway, which has to include the author."""
+        message_id = int(data['id'])
+
+        return cls(message_id=message_id,
+                   author_id=int(data['author']['id']),
+                   channel_id=int(data['channel_id']),
+                   guild_id=guild_id,
+                   content=data.get('content', '').replace("\u0000", ""),
+                   embeds=tuple(json.dumps(e) for e in data['embeds']) if data.get('embeds') else _NO_EMBEDS,
+                   created_at=discord.utils.snowflake_time(message_id))
+
+    def to_row(self) -> dict:
+        return {'message_id'     : self.id,
+                'author_id'      : self.author_id,
+                'channel_id'     : self.channel_id,
+                'guild_id'       : self.guild_id,
+                'message_content': self.content,
+                'message_embeds' : self.embeds,
+                'created_at'     : self.created_at}
+
+
+class MessageCache:
+    """
+    Recent messages keyed by their ID, bounded by count and age.
+
+    Messages that are added are also kept in a pending list until they're taken to be written to the db,
+    so that evicted messages are still written.
+    """
+
+    def __init__(self, max_size: int = 50_000, max_age: float = 60 * 60 * 6):
+        self.max_size = max_size
+        self.max_age = max_age
+
+        # message id -> (added at, message)
+        self._data: OrderedDict[int, tuple[float, CachedMessage]] = OrderedDict()
+        self.pending: list[CachedMessage] = list()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.dropped = 0  # pending messages that were never written
+
+    def __len__(self):
+        return len(self._data)
+
+    def add(self, message: CachedMessage):
+        now = time.monotonic()
+
+        # edited messages are added again, and they're as fresh as the new ones
+        self._data[message.id] = (now, message)
+        self._data.move_to_end(message.id)
+        self.pending.append(message)
+
+        # oldest ones are at the start
+        threshold = now - self.max_age
+        while self._data and (len(self._data) > self.max_size or next(iter(self._data.values()))[0] < threshold):
+            self._data.popitem(last=False)
+            self.evicted += 1
+
+    def get(self, message_id: int) -> CachedMessage | None:
+        try:
+            message = self._data[message_id][1]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return message
+
+    def pop(self, message_id: int) -> CachedMessage | None:
+        entry = self._data.pop(message_id, None)
+        return entry[1] if entry else None
+
+    def take_pending(self) -> list[CachedMessage]:
+        pending, self.pending = self.pending, list()
+        return pending
+
+    def restore_pending(self, messages: list[CachedMessage]):
+        """Puts taken messages that couldn't be written back in front of the pending ones.
+        The oldest ones are dropped if there are more than max_size."""
+        self.pending = messages + self.pending
+
+        overflow = len(self.pending) - self.max_size
+        if overflow > 0:
+            del self.pending[:overflow]
+            self.dropped += overflow
+
+    def get_stats(self) -> dict[str, int]:
+        return {'hits'   : self.hits,
+                'misses' : self.misses,
+                'evicted': self.evicted,
+                'dropped': self.dropped,
+                'size'   : len(self._data),
+                'pending': len(self.pending)}
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+
+from models import LoggedMessage, MessageDictionaryDB
+from ._base_service import BaseShinobuService
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+    from .message_cache import CachedMessage
+
+__all__ = ['MessageCodec', 'MessageCodecService']
+
+# a word along with the whitespace after it
+_TOKEN = re.compile(rb'\S+\s*')
+
+
+class MessageCodec:
+    """
+    Compresses the content and embeds of logged messages with raw deflate and a preset dictionary.
+
+    Most messages are too short to compress on their own. The dictionary, which is trained on recent messages,
+    gives deflate something to refer to. Dictionaries never change once they're made,
+    and every blob is decoded with the dictionary it was encoded with.
+    """
+    # deflate can't refer further back than this
+    DICTIONARY_SIZE = 32 * 1024
+    LEVEL = 6
+    WBITS = -15  # raw deflate, without the header and the checksum
+
+    # the first byte of every blob
+    STORED = b'\x00'
+    DEFLATED = b'\x01'
+
+    def __init__(self):
+        # dictionary id -> dictionary
+        self.dictionaries: dict[int, bytes] = dict()
+        self.current_id: int | None = None
+
+        # primed with their dictionaries. copying them is much cheaper than loading a dictionary every time
+        self._compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, self.WBITS)
+        self._decompressors = {None: zlib.decompressobj(self.WBITS)}
+
+    def add_dictionary(self, dictionary_id: int, dictionary: bytes):
+        self.dictionaries[dictionary_id] = dictionary
+        self._decompressors[dictionary_id] = zlib.decompressobj(self.WBITS, zdict=dictionary)
+
+        if self.current_id is None or dictionary_id > self.current_id:
+            self.current_id = dictionary_id
+            self._compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, self.WBITS, zdict=dictionary)
+
+    def remove_dictionary(self, dictionary_id: int):
+        self.dictionaries.pop(dictionary_id, None)
+        self._decompressors.pop(dictionary_id, None)
+
+    def get_encoder(self):
+        """Returns the current dictionary id and a function that encodes with it, even if it's replaced meanwhile."""
+        compressor = self._compressor
+
+        def encode(data: bytes) -> bytes:
+            c = compressor.copy()
+            compressed = c.compress(data) + c.flush()
+
+            if len(compressed) < len(data):
+                return self.DEFLATED + compressed
+            return self.STORED + data
+
+        return self.current_id, encode
+
+    def decode(self, blob: bytes, dictionary_id: int | None) -> bytes:
+        if blob[:1] == self.STORED:
+            return blob[1:]
+
+        d = self._decompressors[dictionary_id].copy()
+        return d.decompress(blob[1:]) + d.flush()
+
+    @staticmethod
+    def encode_message(encode, message: CachedMessage) -> tuple[bytes, bytes | None]:
+        """Returns the content blob and the embeds blob of a message."""
+        content = encode(message.content.encode('utf-8', 'surrogatepass'))
+
+        # embeds are already json strings, so they're joined into an array instead of being loaded and dumped again
+        embeds = encode(f"[{','.join(message.embeds)}]".encode('utf-8', 'surrogatepass')) if message.embeds else None
+
+        return content, embeds
+
+    @classmethod
+    def train(cls, samples: list[bytes]) -> bytes:
+        """Builds a dictionary out of the words and word pairs that are common among the samples."""
+        counts = Counter()
+        for sample in samples:
+            tokens = _TOKEN.findall(sample)
+
+            # counted once per sample so that a long message that repeats itself doesn't take over the dictionary
+            counts.update(set(tokens + [a + b for a, b in zip(tokens, tokens[1:])]))
+
+        # roughly how many bytes a substring would save over the whole corpus
+        scored = sorted(((count * len(substring), substring)
+                         for substring, count in counts.items() if count > 1 and len(substring) > 3), reverse=True)
+
+        picked, size = list(), 0
+        for _, substring in scored:
+            if size + len(substring) > cls.DICTIONARY_SIZE:
+                break
+
+            picked.append(substring)
+            size += len(substring)
+
+        # the end of the dictionary is referred to with shorter distances, so the best ones go last
+        return b''.join(reversed(picked))
+
+
+class MessageCodecService(BaseShinobuService):
+    """Keeps the dictionaries of the message codec in sync with the db. Every cluster compresses with the newest one."""
+    REFRESH_INTERVAL = 60 * 15
+    RETRAIN_AFTER = timedelta(days=1)
+
+    TRAINING_SAMPLES = 20_000
+    MIN_TRAINING_SAMPLES = 1000
+
+    def __init__(self, bot: ShinobuBot):
+        super().__init__(bot)
+
+        self.codec = MessageCodec()
+        self.current_created_at: datetime | None = None
+
+        self.refresh_task = self.bot.loop.create_task(self.refresh_loop())
+
+    async def load_dictionaries(self):
+        ids = await MessageDictionaryDB.get_ids(self.bot)
+
+        # they have expired along with the messages that were compressed with them
+        for dictionary_id in self.codec.dictionaries.keys() - set(ids):
+            self.codec.remove_dictionary(dictionary_id)
+
+        missing = [dictionary_id for dictionary_id in ids if dictionary_id not in self.codec.dictionaries]
+        if missing:
+            for dictionary in await MessageDictionaryDB.get_bulk(self.bot, missing):
+                self.codec.add_dictionary(dictionary.id, dictionary.dictionary)
+
+                if dictionary.id == self.codec.current_id:
+                    self.current_created_at = dictionary.created_at
+
+    async def ensure_dictionaries(self, dictionary_ids: set[int | None]):
+        """Loads the dictionaries that were made by other clusters since our last refresh."""
+        if dictionary_ids - self.codec.dictionaries.keys() - {None}:
+            await self.load_dictionaries()
+
+    async def refresh_loop(self):
+        while True:
+            try:
+                await self.load_dictionaries()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception("Error while loading the message dictionaries.")
+
+            await asyncio.sleep(self.REFRESH_INTERVAL)
+
+    async def encode_messages(self,
+                              messages: list[CachedMessage]) -> tuple[int | None, list[tuple[bytes, bytes | None]]]:
+        """Compresses messages in a thread. Returns the dictionary id they were compressed with and their blobs."""
+        dictionary_id, encode = self.codec.get_encoder()
+
+        blobs = await self.bot.loop.run_in_executor(
+            None, lambda: [self.codec.encode_message(encode, message) for message in messages])
+
+        return dictionary_id, blobs
+
+    def decode(self, blob: bytes, dictionary_id: int | None) -> bytes:
+        return self.codec.decode(blob, dictionary_id)
+
+    def needs_training(self) -> bool:
+        return self.current_created_at is None \
+            or datetime.now(timezone.utc) - self.current_created_at > self.RETRAIN_AFTER
+
+    async def train_dictionary(self) -> int | None:
+        """Trains a new dictionary on the latest messages. Returns its id, or None if there aren't enough messages."""
+        messages = await LoggedMessage.get_latest(self.bot, self.TRAINING_SAMPLES)
+        if len(messages) < self.MIN_TRAINING_SAMPLES:
+            return None
+
+        samples = list()
+        for message in messages:
+            samples.append(message.raw_content.encode('utf-8', 'surrogatepass'))
+            if message.embed_dicts:
+                samples.append(json.dumps(message.embed_dicts).encode('utf-8', 'surrogatepass'))
+
+        dictionary = await self.bot.loop.run_in_executor(None, MessageCodec.train, samples)
+        created = await MessageDictionaryDB.create(self.bot, dictionary)
+
+        self.codec.add_dictionary(created.id, created.dictionary)
+        self.current_created_at = created.created_at
+
+        return created.id
+
+    def stop(self):
+        self.refresh_task.cancel()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-import asyncio
+from datetime import datetime
 from typing import TYPE_CHECKING
 
 import discord
@@ -14,51 +14,83 @@ if TYPE_CHECKING:
 
 
 class ReminderService(BaseShinobuService):
+    """Every reminder is sent by a single cluster. Check get_cluster_id_of_reminder for which one."""
+    JOB_KIND = 'reminder'
+
     def __init__(self, bot: ShinobuBot):
         super().__init__(bot)
 
-        self.active_reminders = list()
+        self.missing_guild_ids_are_set = False
 
-        self.launch_reminders_task = self.bot.loop.create_task(self.launch_reminders())
+        self.bot.scheduler.register(self.JOB_KIND, load=self.load_reminders, run=self.complete_reminder)
 
-    async def launch_reminders(self):
-        await self.bot.wait_until_ready()
+    def get_cluster_id_of_reminder(self, reminder: ReminderDB) -> int:
+        if reminder.guild_id is not None:
+            return self.bot.ipc.get_cluster_id_of_guild(reminder.guild_id)
 
-        reminders = await ReminderDB.get_uncompleted_reminders(bot=self.bot)
+        # has to match ReminderDB.iterate_due_reminders_of_cluster
+        return reminder.author_id % self.bot.cluster_count
 
-        for reminder in reminders:
-            self.add_reminder(reminder)
+    async def load_reminders(self, due_before: datetime):
+        # reminders that were created before we stored guild ids would be sent by the wrong cluster
+        if not self.missing_guild_ids_are_set:
+            await ReminderDB.set_missing_guild_ids(bot=self.bot)
+            self.missing_guild_ids_are_set = True
 
-    def add_reminder(self, reminder: ReminderDB):
-        task = self.bot.loop.create_task(self.complete_reminder(reminder), name=str(reminder.id))
-        task.add_done_callback(self.task_complete)
+        async for reminder in ReminderDB.iterate_due_reminders_of_cluster(bot=self.bot, due_before=due_before):
+            yield reminder.id, reminder.time_obj.end_date, reminder
 
-        self.active_reminders.append(task)
+    def schedule_reminder(self, reminder: ReminderDB):
+        self.bot.scheduler.schedule(self.JOB_KIND, reminder.id, reminder.time_obj.end_date, reminder)
 
-    def cancel_reminder(self, reminder: ReminderDB):
-        # find the repeater
-        for task in self.active_reminders:
-            if task.get_name() == str(reminder.id):
-                task.cancel()
-                self.active_reminders.remove(task)
+    def unschedule_reminder(self, reminder_id: int):
+        self.bot.scheduler.cancel(self.JOB_KIND, reminder_id)
 
-    async def complete_reminder(self, reminder: ReminderDB):
-        # sleep until its time
-        await asyncio.sleep(delay=reminder.time_obj.remaining_seconds)
+    async def add_reminder(self, reminder: ReminderDB):
+        cluster_id = self.get_cluster_id_of_reminder(reminder)
+
+        if cluster_id == self.bot.cluster_id:
+            self.schedule_reminder(reminder)
+        else:
+            await self.bot.ipc.schedule_reminder(cluster_id, reminder.id)
+
+    async def cancel_reminder(self, reminder: ReminderDB):
+        cluster_id = self.get_cluster_id_of_reminder(reminder)
+
+        if cluster_id == self.bot.cluster_id:
+            self.unschedule_reminder(reminder.id)
+        else:
+            await self.bot.ipc.cancel_reminder(cluster_id, reminder.id)
 
-        channel = author = self.bot.get_user(reminder.author_id)
+    async def get_author(self, reminder: ReminderDB) -> discord.User | None:
+        """Returns the author of the reminder, or None if their account doesn't exist anymore."""
+        # dm reminders are sent by the cluster of the author id, which usually doesn't have the user cached
+        author = self.bot.get_user(reminder.author_id)
+        if author:
+            return author
+
+        # other errors are raised, so that the reminder is retried with the next refill of the scheduler
+        try:
+            return await self.bot.fetch_user(reminder.author_id)
+        except discord.NotFound:
+            return None
+
+    async def complete_reminder(self, reminder: ReminderDB):
+        channel = author = await self.get_author(reminder)
         # value has to be used due to importlib bug
         if reminder.channel_type.value != ReminderDB.ChannelType.DM.value:
             channel = self.bot.get_channel(reminder.channel_id)
 
-        if not channel:
-            return await reminder.complete()
+        # another cluster might have loaded it too, while the reminders are being moved between clusters.
+        # claimed before sending, so that only one of them sends it
+        if not await reminder.complete() or not channel:
+            return
 
         e = mido_utils.Embed(bot=self.bot,
                              title="A Friendly Reminder:",
                              description=reminder.content)
         e.add_field(name="Creator",
-                    value=f"**{str(author)}**")
+                    value=f"**{str(author) if author else 'Deleted User'}**")
         e.add_field(name="Creation Date",
                     value=f"{reminder.time_obj.start_date_string}\n"
                           f"(**{reminder.time_obj.initial_remaining_string} ago**)")
@@ -68,24 +100,5 @@ class ReminderService(BaseShinobuService):
         except discord.Forbidden:
             pass
 
-        await reminder.complete()
-
-    def task_complete(self, task):
-        try:
-            if task.exception():
-                task.print_stack()
-        except asyncio.CancelledError:
-            pass
-
-        try:
-            self.active_reminders.remove(task)
-        except ValueError:
-            pass
-
     def stop(self):
-        self.launch_reminders_task.cancel()
-
-        for task in self.active_reminders:
-            task.cancel()
-
-        self.active_reminders = list()
+        self.bot.scheduler.unregister(self.JOB_KIND)
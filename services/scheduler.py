@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, TYPE_CHECKING
+
+from ._base_service import BaseShinobuService
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+
+__all__ = ['SchedulerService']
+
+# job id, due date, payload
+JobRow = tuple[int, datetime, Any]
+JobLoader = Callable[[datetime], Awaitable[Iterable[JobRow]] | AsyncIterable[JobRow]]
+
+
+async def _iterate_rows(rows: Awaitable[Iterable[JobRow]] | AsyncIterable[JobRow]):
+    if inspect.isawaitable(rows):
+        rows = await rows
+
+    if hasattr(rows, '__aiter__'):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+
+class _ScheduledJob:
+    __slots__ = ('kind', 'id', 'due_at', 'payload', 'cancelled')
+
+    def __init__(self, kind: str, job_id: int, due_at: float, payload: Any):
+        self.kind = kind
+        self.id = job_id
+        self.due_at = due_at
+        self.payload = payload
+
+        self.cancelled = False
+
+    @property
+    def key(self) -> tuple[str, int]:
+        return self.kind, self.id
+
+
+class _JobKind:
+    __slots__ = ('load', 'run', 'loaded_until', 'settled', 'load_task')
+
+    def __init__(self, load: JobLoader, run: Callable[[Any], Awaitable]):
+        self.load = load
+        self.run = run
+
+        # jobs that are due after this are left in the db until the horizon reaches them
+        self.loaded_until = 0.0
+
+        # ids of the jobs that have run or have been cancelled since the last load started.
+        # a load that was already in flight could return them as pending, so it must skip these
+        self.settled: set[int] = set()
+
+        # a single load at a time, as a failed one is retried until it gets through
+        self.load_task: asyncio.Task | None = None
+
+
+class SchedulerService(BaseShinobuService):
+    """
+    Runs timed jobs of every kind (reminders, repeaters, temporary bans etc.) from a single min-heap.
+
+    Only the jobs that are due within HORIZON are kept in memory. The rest are loaded from the db
+    by the loader of their kind as the horizon rolls forward, so memory and task count stay flat
+    no matter how many jobs there are.
+
+    Cancelled jobs are marked and skipped once they reach the top of the heap,
+    and the heap is rebuilt when they make up most of it.
+    """
+    HORIZON = timedelta(hours=1)
+    REFILL_INTERVAL = HORIZON / 2
+
+    # doubles with every failed load, up to the refill interval
+    LOAD_RETRY_DELAY = 5.0
+
+    def __init__(self, bot: ShinobuBot):
+        super().__init__(bot)
+
+        self.kinds: dict[str, _JobKind] = dict()
+
+        # (due_at, insertion order, job)
+        self.heap: list[tuple[float, int, _ScheduledJob]] = list()
+        self.jobs: dict[tuple[str, int], _ScheduledJob] = dict()
+        self.cancelled_count = 0
+        self._counter = itertools.count()
+
+        self.running: set[tuple[str, int]] = set()
+        self.running_tasks: set[asyncio.Task] = set()
+
+        self.wakeup = asyncio.Event()
+
+        self.dispatch_task = self.bot.loop.create_task(self.dispatch_loop())
+        self.refill_task = self.bot.loop.create_task(self.refill_loop())
+
+    def register(self, kind: str, load: JobLoader, run: Callable[[Any], Awaitable]):
+        """
+        Registers a kind of job.
+
+        `load` gets a date and returns the (id, due date, payload) of every pending job that is due before it.
+        It can be a coroutine function or an async generator, which lets big tables be streamed.
+        `run` gets the payload of a job once it's due.
+        """
+        previous = self.kinds.get(kind)
+        if previous and previous.load_task:
+            previous.load_task.cancel()
+
+        self.kinds[kind] = _JobKind(load, run)
+        self._start_loading(kind)
+
+    def unregister(self, kind: str):
+        """Drops the pending jobs of a kind. Jobs that are already running are left to finish."""
+        job_kind = self.kinds.pop(kind, None)
+        if job_kind and job_kind.load_task:
+            job_kind.load_task.cancel()
+
+        for key in [key for key in self.jobs if key[0] == kind]:
+            self._cancel(self.jobs.pop(key))
+
+    def schedule(self, kind: str, job_id: int, due_at: datetime, payload: Any):
+        """Schedules a job, or reschedules it if it's already scheduled."""
+        job_kind = self.kinds.get(kind)
+        if not job_kind:
+            return
+
+        if (kind, job_id) in self.jobs:
+            self._cancel(self.jobs.pop((kind, job_id)))
+
+        due_at = due_at.timestamp()
+        if due_at > job_kind.loaded_until:
+            # the loader will pick it up from the db once the horizon reaches it
+            return
+
+        job = _ScheduledJob(kind, job_id, due_at, payload)
+        self.jobs[job.key] = job
+        heapq.heappush(self.heap, (due_at, next(self._counter), job))
+
+        if self.heap[0][2] is job:
+            self.wakeup.set()
+
+    def cancel(self, kind: str, job_id: int):
+        job = self.jobs.pop((kind, job_id), None)
+        if job:
+            self._cancel(job)
+
+        if kind in self.kinds:
+            self.kinds[kind].settled.add(job_id)
+
+    def _cancel(self, job: _ScheduledJob):
+        job.cancelled = True
+        self.cancelled_count += 1
+
+        if self.cancelled_count > len(self.heap) // 2:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled_count = 0
+
+    def _start_loading(self, kind: str):
+        job_kind = self.kinds[kind]
+        if job_kind.load_task is None or job_kind.load_task.done():
+            job_kind.load_task = self.bot.loop.create_task(self.load_jobs(kind))
+
+    async def load_jobs(self, kind: str):
+        await self.bot.wait_until_ready()
+
+        job_kind = self.kinds.get(kind)
+        delay = self.LOAD_RETRY_DELAY
+
+        # the kind might have been unregistered or re-registered while we were waiting to retry
+        while job_kind and self.kinds.get(kind) is job_kind:
+            job_kind.settled.clear()
+            until = datetime.now(timezone.utc) + self.HORIZON
+
+            # jobs that are created while we're loading are scheduled directly, as the query might miss them
+            previously_loaded_until = job_kind.loaded_until
+            job_kind.loaded_until = max(job_kind.loaded_until, until.timestamp())
+
+            try:
+                async for job_id, due_at, payload in _iterate_rows(job_kind.load(until)):
+                    # the kind might have been re-registered while we were loading
+                    if self.kinds.get(kind) is not job_kind:
+                        return
+
+                    if job_id in job_kind.settled or (kind, job_id) in self.jobs or (kind, job_id) in self.running:
+                        continue
+
+                    self.schedule(kind, job_id, due_at, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # the jobs that we didn't get to are only in the db, so the retry has to cover them again
+                job_kind.loaded_until = previously_loaded_until
+
+                self.bot.logger.exception(f"Error while loading the scheduled {kind} jobs. "
+                                          f"Retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.REFILL_INTERVAL.total_seconds())
+            else:
+                return
+
+    async def refill_loop(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            await asyncio.sleep(self.REFILL_INTERVAL.total_seconds())
+
+            for kind in list(self.kinds):
+                self._start_loading(kind)
+
+    async def dispatch_loop(self):
+        while True:
+            self.wakeup.clear()
+
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+                self.cancelled_count -= 1
+
+            timeout = None
+            if self.heap:
+                timeout = self.heap[0][0] - time.time()
+
+                if timeout <= 0:
+                    self._start(heapq.heappop(self.heap)[2])
+                    continue
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start(self, job: _ScheduledJob):
+        del self.jobs[job.key]
+
+        job_kind = self.kinds.get(job.kind)
+        if not job_kind:
+            return
+
+        self.running.add(job.key)
+
+        task = self.bot.loop.create_task(self._run(job_kind, job))
+        self.running_tasks.add(task)
+        task.add_done_callback(self.running_tasks.discard)
+
+    async def _run(self, job_kind: _JobKind, job: _ScheduledJob):
+        try:
+            await job_kind.run(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.bot.logger.exception(f"Error while running the scheduled {job.kind} job #{job.id}.")
+        finally:
+            self.running.discard(job.key)
+            job_kind.settled.add(job.id)
+
+    def stop(self):
+        self.dispatch_task.cancel()
+        self.refill_task.cancel()
+
+        for job_kind in self.kinds.values():
+            if job_kind.load_task:
+                job_kind.load_task.cancel()
+
+        for task in self.running_tasks:
+            task.cancel()
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+import discord
+
+from ._base_service import BaseShinobuService
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+
+__all__ = ['WebhookOutbox']
+
+
+class _OutboxEntry:
+    __slots__ = ('content', 'embed', 'file')
+
+    def __init__(self, content: str | None, embed: discord.Embed | None, file: discord.File | None):
+        self.content = content
+        self.embed = embed
+        self.file = file
+
+
+class _ChannelOutbox:
+    __slots__ = ('channel', 'entries', 'task', 'sent_at', 'dropped')
+
+    def __init__(self, channel: discord.TextChannel):
+        self.channel = channel
+        self.entries: deque[_OutboxEntry] = deque()
+        self.task: asyncio.Task | None = None
+
+        # monotonic times of the recent sends, for the rate limits
+        self.sent_at: deque[float] = deque()
+        # entries that were dropped since the last send
+        self.dropped = 0
+
+
+class WebhookOutbox(BaseShinobuService):
+    """
+    Sends entries to their channels as webhook messages, batching the ones that come in within a short window.
+
+    A batch becomes a single message with up to 10 embeds and the contents of its entries joined together.
+    Sends to a channel are paced to stay within Discord's webhook rate limits. When a channel falls too far behind,
+    new entries are dropped and the next message says how many were.
+    """
+    BATCH_WINDOW = 2.0
+    MAX_PENDING = 250
+
+    # (sends, per this many seconds) for every channel
+    RATE_LIMITS = ((5, 2.0), (30, 60.0))
+
+    MAX_EMBEDS = 10
+    MAX_EMBED_CHARS = 6000
+    MAX_CONTENT = 2000
+    MAX_FILES = 10
+
+    def __init__(self, bot: ShinobuBot, on_forbidden: Callable[[discord.TextChannel], Awaitable]):
+        super().__init__(bot)
+
+        # called when we can't send to a channel anymore
+        self.on_forbidden = on_forbidden
+
+        # channel id -> outbox
+        self.outboxes: dict[int, _ChannelOutbox] = dict()
+
+        self.entries = 0
+        self.messages = 0
+        self.dropped = 0
+
+    def send(self,
+             channel: discord.TextChannel,
+             content: str | None = None,
+             embed: discord.Embed | None = None,
+             file: discord.File | None = None):
+        try:
+            outbox = self.outboxes[channel.id]
+        except KeyError:
+            outbox = self.outboxes[channel.id] = _ChannelOutbox(channel)
+
+        # the channel object could be a new one
+        outbox.channel = channel
+
+        if len(outbox.entries) >= self.MAX_PENDING:
+            outbox.dropped += 1
+            self.dropped += 1
+
+            if file:
+                file.close()
+        else:
+            outbox.entries.append(_OutboxEntry(content, embed, file))
+            self.entries += 1
+
+        if outbox.task is None or outbox.task.done():
+            outbox.task = self.bot.loop.create_task(self._drain(outbox))
+
+    def _take_batch(self, outbox: _ChannelOutbox) -> dict:
+        contents, embeds, files = list(), list(), list()
+        content_length = embed_chars = 0
+
+        if outbox.dropped:
+            contents.append(f":warning: {outbox.dropped} events were not logged as they came in too fast.")
+            content_length += len(contents[0])
+            outbox.dropped = 0
+
+        while outbox.entries:
+            entry = outbox.entries[0]
+
+            entry_content_length = len(entry.content) + 1 if entry.content else 0
+            entry_embed_chars = len(entry.embed) if entry.embed else 0
+
+            if (embeds or files or contents) and (
+                    content_length + entry_content_length > self.MAX_CONTENT
+                    or len(embeds) + bool(entry.embed) > self.MAX_EMBEDS
+                    or embed_chars + entry_embed_chars > self.MAX_EMBED_CHARS
+                    or len(files) + bool(entry.file) > self.MAX_FILES):
+                break
+
+            outbox.entries.popleft()
+
+            if entry.content:
+                contents.append(entry.content)
+                content_length += entry_content_length
+            if entry.embed:
+                embeds.append(entry.embed)
+                embed_chars += entry_embed_chars
+            if entry.file:
+                files.append(entry.file)
+
+            # embeds go below the content, so the content of an entry that refers to its embed has to come last
+            if entry.content and entry.embed:
+                break
+
+        return {'content': '\n'.join(contents)[:self.MAX_CONTENT] or None,
+                'embeds' : embeds or discord.utils.MISSING,
+                'files'  : files or discord.utils.MISSING}
+
+    async def _wait_for_rate_limits(self, outbox: _ChannelOutbox):
+        longest_period = max(period for _, period in self.RATE_LIMITS)
+
+        while True:
+            now = time.monotonic()
+            while outbox.sent_at and outbox.sent_at[0] <= now - longest_period:
+                outbox.sent_at.popleft()
+
+            wait = 0.0
+            for limit, period in self.RATE_LIMITS:
+                recent = [x for x in outbox.sent_at if x > now - period]
+                if len(recent) >= limit:
+                    # until the oldest of the last `limit` sends leaves the period
+                    wait = max(wait, recent[-limit] + period - now)
+
+            if wait <= 0:
+                break
+
+            await asyncio.sleep(wait)
+
+        outbox.sent_at.append(time.monotonic())
+
+    async def _drain(self, outbox: _ChannelOutbox):
+        # let the rest of the burst come in
+        await asyncio.sleep(self.BATCH_WINDOW)
+
+        while outbox.entries or outbox.dropped:
+            await self._wait_for_rate_limits(outbox)
+
+            previously_dropped, pending = outbox.dropped, len(outbox.entries)
+            batch = self._take_batch(outbox)
+            taken = pending - len(outbox.entries)
+
+            try:
+                # waiting for the message is the only way to tell a send from giving up, which returns None
+                sent = await self.bot.send_as_webhook(outbox.channel,
+                                                      **batch,
+                                                      wait=True,
+                                                      allowed_mentions=discord.AllowedMentions.none())
+            except discord.Forbidden:
+                outbox.entries.clear()
+                outbox.dropped = 0
+
+                await self.on_forbidden(outbox.channel)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception(f"Error while sending a batch of entries to channel {outbox.channel.id}.")
+                sent = None
+
+            if sent is None:
+                # the next message says how many were lost, along with the ones that it was supposed to say
+                outbox.dropped += previously_dropped + taken
+                self.dropped += taken
+
+                # don't keep retrying only the notice. it goes out with the next entry
+                if not outbox.entries:
+                    return
+            else:
+                self.messages += 1
+
+    def get_stats(self) -> dict[str, int]:
+        return {'entries' : self.entries,
+                'messages': self.messages,
+                'dropped' : self.dropped,
+                'pending' : sum(len(x.entries) for x in self.outboxes.values())}
+
+    def stop(self):
+        for outbox in self.outboxes.values():
+            if outbox.task:
+                outbox.task.cancel()
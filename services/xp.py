@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, TYPE_CHECKING
+
+from models import MemberDB, UserDB
+from ._base_service import BaseShinobuService
+
+if TYPE_CHECKING:
+    from shinobu import ShinobuBot
+
+
+class _XpState:
+    __slots__ = ('total_xp', 'last_gain', 'last_seen')
+
+    def __init__(self, total_xp: int, last_gain: datetime | None):
+        self.total_xp = total_xp
+        self.last_gain = last_gain
+        self.last_seen = datetime.now(timezone.utc)
+
+
+class XpGain(NamedTuple):
+    member_xp: int
+    user_xp: int
+    added_in_guild: bool
+    added_globally: bool
+
+
+class XpService(BaseShinobuService):
+    """
+    Keeps XP totals and cooldowns in memory and writes the gained XP to the database in batches.
+
+    Totals are loaded once per member, then every message is handled without a database round trip.
+    XP that is gained in the last FLUSH_INTERVAL seconds before a crash is lost.
+    """
+    FLUSH_INTERVAL = 5.0
+    IDLE_SECONDS = 60 * 15  # states of people who haven't talked for this long are dropped
+
+    def __init__(self, bot: ShinobuBot):
+        super().__init__(bot)
+
+        self.cooldown = timedelta(seconds=self.bot.config.cooldowns['xp'])
+
+        self.members: dict[tuple[int, int], _XpState] = dict()
+        self.users: dict[int, _XpState] = dict()
+
+        # xp that is not written to the db yet
+        self.pending_member_xp: dict[tuple[int, int], list[int, datetime]] = dict()
+        self.pending_user_xp: dict[int, list[int, datetime]] = dict()
+
+        self.flush_task = self.bot.loop.create_task(self.flush_loop())
+
+    async def _load_states(self, guild_id: int, user_id: int) -> tuple[_XpState, _XpState]:
+        member_key = (guild_id, user_id)
+
+        if member_key not in self.members or user_id not in self.users:
+            data = await MemberDB.get_xp_state(bot=self.bot, guild_id=guild_id, user_id=user_id)
+
+            # add the xp that is waiting to be written, so that we don't lose it when states are reloaded
+            pending_member_xp = self.pending_member_xp.get(member_key, (0,))[0]
+            pending_user_xp = self.pending_user_xp.get(user_id, (0,))[0]
+
+            # setdefault, because another message might have loaded these while we were waiting
+            self.members.setdefault(
+                member_key, _XpState((data['member_xp'] or 0) + pending_member_xp, data['member_last_xp_gain']))
+            self.users.setdefault(
+                user_id, _XpState((data['user_xp'] or 0) + pending_user_xp, data['user_last_xp_gain']))
+
+        return self.members[member_key], self.users[user_id]
+
+    def _is_on_cooldown(self, state: _XpState, now: datetime) -> bool:
+        return state.last_gain is not None and now - state.last_gain < self.cooldown
+
+    async def gain_xp(self, guild_id: int, user_id: int, amount: int) -> XpGain | None:
+        """Adds XP to the member and the user if they're not on cooldown. Returns None if both are on cooldown."""
+        member_state, user_state = await self._load_states(guild_id, user_id)
+
+        now = datetime.now(timezone.utc)
+        member_state.last_seen = user_state.last_seen = now
+
+        can_gain_xp = not self._is_on_cooldown(member_state, now)
+        can_gain_xp_global = not self._is_on_cooldown(user_state, now)
+
+        if not can_gain_xp and not can_gain_xp_global:
+            return None
+
+        if can_gain_xp:
+            member_state.total_xp += amount
+            member_state.last_gain = now
+            self._add_pending(self.pending_member_xp, (guild_id, user_id), amount, now)
+
+        if can_gain_xp_global:
+            user_state.total_xp += amount
+            user_state.last_gain = now
+            self._add_pending(self.pending_user_xp, user_id, amount, now)
+
+        return XpGain(member_xp=member_state.total_xp,
+                      user_xp=user_state.total_xp,
+                      added_in_guild=can_gain_xp,
+                      added_globally=can_gain_xp_global)
+
+    @staticmethod
+    def _add_pending(pending: dict, key, amount: int, date: datetime):
+        try:
+            pending[key][0] += amount
+            pending[key][1] = date
+        except KeyError:
+            pending[key] = [amount, date]
+
+    def forget(self, guild_id: int = None, user_id: int = None):
+        """Drops the in-memory states so that they're reloaded from the db. Used after manual XP changes."""
+        if guild_id is not None:
+            self.members.pop((guild_id, user_id), None)
+        if user_id is not None:
+            self.users.pop(user_id, None)
+
+    async def flush(self):
+        member_xp, self.pending_member_xp = self.pending_member_xp, dict()
+        user_xp, self.pending_user_xp = self.pending_user_xp, dict()
+
+        try:
+            if member_xp:
+                await MemberDB.add_xp_bulk(bot=self.bot,
+                                           rows=[(*key, amount, date) for key, (amount, date) in member_xp.items()])
+                member_xp = dict()
+
+            if user_xp:
+                await UserDB.add_xp_bulk(bot=self.bot,
+                                         rows=[(key, amount, date) for key, (amount, date) in user_xp.items()],
+                                         cooldown=self.cooldown)
+                user_xp = dict()
+        finally:
+            # put back whatever we could not write so that we try again in the next flush
+            for key, (amount, date) in member_xp.items():
+                self._add_pending(self.pending_member_xp, key, amount, date)
+            for key, (amount, date) in user_xp.items():
+                self._add_pending(self.pending_user_xp, key, amount, date)
+
+        self._drop_idle_states()
+
+    def _drop_idle_states(self):
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=self.IDLE_SECONDS)
+
+        for states, pending in ((self.members, self.pending_member_xp), (self.users, self.pending_user_xp)):
+            for key in [k for k, state in states.items() if state.last_seen < threshold and k not in pending]:
+                del states[key]
+
+    async def flush_loop(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.bot.logger.exception("Error while writing XP to the database. Will try again.")
+
+    def stop(self):
+        self.flush_task.cancel()
+
+        # write what's left
+        if self.pending_member_xp or self.pending_user_xp:
+            self.bot.loop.create_task(self.flush())
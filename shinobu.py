@@ -5,6 +5,7 @@ import logging
 import multiprocessing
 import os
 import re
+import time
 from functools import cached_property
 from typing import TYPE_CHECKING, Type
 
@@ -19,11 +20,15 @@ from discord.ext import commands
 import ipc
 import mido_utils
 import models
+import services
 from models.db import run_create_table_funcs
 
 if TYPE_CHECKING:
     from cogs.games import Race
 
+# discord lets max_concurrency shards identify in every window of this many seconds
+IDENTIFY_WINDOW = 5.0
+
 
 class ShinobuBot(commands.AutoShardedBot):
     # noinspection PyTypeChecker
@@ -33,6 +38,11 @@ class ShinobuBot(commands.AutoShardedBot):
 
         self.cluster_id: int = cluster_kwargs.pop('cluster_id')
         self.cluster_count = cluster_kwargs.pop('total_clusters')
+        self.shards_per_cluster: int | None = cluster_kwargs.pop('shards_per_cluster', None)
+        self.stats_board_name: str | None = cluster_kwargs.pop('stats_board_name', None)
+        # false while we're replacing another process, which is still publishing to our slot
+        self.publish_stats: bool = cluster_kwargs.pop('publish_stats', True)
+        self.identify_buckets: multiprocessing.Array | None = cluster_kwargs.pop('identify_buckets', None)
         self.pipe_connection: multiprocessing.connection.Connection = cluster_kwargs.pop('pipe')
 
         loop = asyncio.new_event_loop()
@@ -56,6 +66,11 @@ class ShinobuBot(commands.AutoShardedBot):
         self._BotBase__cogs = commands.core._CaseInsensitiveDict()
 
         self.ipc: ipc.IPCClient = None
+        self.stats_board: ipc.StatsBoard = None
+        self.stats_publisher: ipc.StatsPublisher = None
+        self.scheduler: services.SchedulerService = None
+        self.cluster_jobs: services.ClusterJobService = None
+        self.message_codec: services.MessageCodecService = None
         self.db: asyncpg.pool.Pool = None
         self.uptime: mido_utils.Time = None
 
@@ -165,6 +180,9 @@ class ShinobuBot(commands.AutoShardedBot):
     async def on_ready(self):
         self.logger.info(f'Ready called.')
 
+        # the launcher waits for this in rolling restarts
+        self.send_to_launcher({'type': 'ready'})
+
     def should_listen_to_msg(self, msg: discord.Message, guild_only=False) -> bool:
         return self.is_ready() and not msg.author.bot and (not guild_only or msg.guild)
 
@@ -176,6 +194,51 @@ class ShinobuBot(commands.AutoShardedBot):
 
         await self.process_commands(message)
 
+    def send_to_launcher(self, message: dict):
+        """Sends a message to the cluster manager. Does nothing if we're not launched by it."""
+        if self.pipe_connection is None:
+            return
+
+        try:
+            self.pipe_connection.send(message)
+        except (BrokenPipeError, OSError) as e:
+            self.logger.debug(f"Could not send a message to the launcher: {e}")
+
+    def _receive_from_launcher(self):
+        try:
+            message: dict = self.pipe_connection.recv()
+        except (EOFError, OSError):
+            # launcher is gone
+            return self.loop.remove_reader(self.pipe_connection.fileno())
+
+        if message['type'] == 'close':
+            # we've been replaced by a new process
+            self.logger.info("Launcher asked us to close.")
+            self.loop.create_task(self.close())
+
+        elif message['type'] == 'publish_stats':
+            # the process we've replaced is gone
+            self.stats_publisher.publishing = True
+            self.stats_publisher.publish()
+
+        elif message['type'] == 'log':
+            self.loop.create_task(self.ipc.send_to_log_channel(message['content']))
+
+    async def before_identify_hook(self, shard_id: int | None, *, initial: bool = False) -> None:
+        """Waits for the identify bucket of the shard, which is shared with the other clusters."""
+        if self.identify_buckets is None:
+            return await super().before_identify_hook(shard_id, initial=initial)
+
+        bucket = (shard_id or 0) % len(self.identify_buckets)
+        while True:
+            with self.identify_buckets.get_lock():
+                wait_for = self.identify_buckets[bucket] + IDENTIFY_WINDOW - time.time()
+                if wait_for <= 0:
+                    self.identify_buckets[bucket] = time.time()
+                    return
+
+            await asyncio.sleep(wait_for)
+
     async def get_context(self, origin: discord.Message | discord.Interaction,
                           cls: Type[commands.Context] = None) -> mido_utils.Context:
         """
@@ -197,7 +260,7 @@ class ShinobuBot(commands.AutoShardedBot):
                          f'of guild: {guild.name}')
 
     async def _guild_announcer(self, guild: discord.Guild, left=False):
-        guild_count = await self.ipc.get_guild_count()
+        guild_count = self.stats_board.get_totals().guilds
 
         humans = 0
         bots = 0
@@ -279,51 +342,55 @@ class ShinobuBot(commands.AutoShardedBot):
     async def get_user_using_ipc(self, user_id: int) -> discord.User | ipc.SerializedObject | None:
         return super().get_user(user_id) or await self.ipc.get_user(user_id)
 
-    async def send_as_webhook(self, channel: discord.TextChannel, *args, **kwargs):
-        try:
+    async def send_as_webhook(self, channel: discord.TextChannel, *args, attempts: int = 3, **kwargs):
+        for attempt in range(1, attempts + 1):
             try:
-                webhook = self.webhook_cache[channel.id]
-            except KeyError:
                 try:
-                    webhook = self.webhook_cache[channel.id] = next(
-                        x for x in await channel.webhooks() if x.name.casefold() == self.user.display_name.casefold())
-                except StopIteration:
-                    webhook = self.webhook_cache[channel.id] = await channel.create_webhook(name=self.user.display_name)
-
-            await webhook.send(*args, **kwargs, username=self.user.display_name,
-                               avatar_url=self.user.display_avatar.url)
-
-        except discord.Forbidden as e:
-            # probably no manage webhooks permission
-            await channel.send("I need **Manage Webhooks** permission to continue.")
-            raise e
-
-        except discord.NotFound:
-            # webhook is probably deleted, so delete it from cache as well
-            del self.webhook_cache[channel.id]
-
-            self.logger.info(f"The webhook of channel ID {channel.id} could not be found. Retrying...")
-            return await self.send_as_webhook(channel, *args, **kwargs)
-
-        except (discord.DiscordServerError,
-                aiohttp.ServerDisconnectedError,
-                aiohttp.ClientOSError,
-                asyncio.TimeoutError,
-                discord.HTTPException
-                ) as e:
-            if mido_utils.better_is_instance(e, discord.HTTPException) and e.status < 500:
-                # if it's not a server error and something wrong from our side, raise again
+                    webhook = self.webhook_cache[channel.id]
+                except KeyError:
+                    try:
+                        webhook = self.webhook_cache[channel.id] = next(
+                            x for x in await channel.webhooks() if x.name.casefold() == self.user.display_name.casefold())
+                    except StopIteration:
+                        webhook = self.webhook_cache[channel.id] = await channel.create_webhook(
+                            name=self.user.display_name)
+
+                return await webhook.send(*args, **kwargs, username=self.user.display_name,
+                                          avatar_url=self.user.display_avatar.url)
+
+            except discord.Forbidden as e:
+                # probably no manage webhooks permission
+                await channel.send("I need **Manage Webhooks** permission to continue.")
                 raise e
 
-            # probably discord servers dying
-            self.logger.info(f"There was an error while trying to send a webhook to {channel.id}. Error: {e}\n"
-                             f"Retrying...")
+            except discord.NotFound:
+                # webhook is probably deleted, so delete it from cache as well
+                self.webhook_cache.pop(channel.id, None)
+
+                self.logger.info(f"The webhook of channel ID {channel.id} could not be found. Retrying...")
+
+            except (discord.DiscordServerError,
+                    aiohttp.ServerDisconnectedError,
+                    aiohttp.ClientOSError,
+                    asyncio.TimeoutError,
+                    discord.HTTPException
+                    ) as e:
+                if mido_utils.better_is_instance(e, discord.HTTPException) and e.status < 500:
+                    # if it's not a server error and something wrong from our side, raise again
+                    raise e
 
-            await asyncio.sleep(5.0)
-            return await self.send_as_webhook(channel, *args, **kwargs)
+                # probably discord servers dying
+                self.logger.info(f"There was an error while trying to send a webhook to {channel.id}. Error: {e}\n"
+                                 f"Retrying... ({attempt}/{attempts})")
 
-        except Exception as e:
-            await self.get_cog('ErrorHandling').on_error(str(e))
+                if attempt < attempts:
+                    await asyncio.sleep(5.0 * attempt)
+
+            except Exception as e:
+                await self.get_cog('ErrorHandling').on_error(str(e))
+                return
+
+        self.logger.warning(f"Gave up on sending a webhook to {channel.id} after {attempts} attempts.")
 
     @discord.utils.cached_property
     def color(self):
@@ -367,6 +434,16 @@ class ShinobuBot(commands.AutoShardedBot):
         # connect to IPC
         self.ipc = ipc.IPCClient(self)
 
+        if self.pipe_connection is not None:
+            self.loop.add_reader(self.pipe_connection.fileno(), self._receive_from_launcher)
+
+        # the launcher creates the stats board. create our own if we're launched without it
+        if self.stats_board_name:
+            self.stats_board = ipc.StatsBoard.attach(self.stats_board_name)
+        else:
+            self.stats_board = ipc.StatsBoard.create(None, cluster_count=self.cluster_count)
+        self.stats_publisher = ipc.StatsPublisher(self)
+
         while not self.db:
             try:
                 self.db = await asyncpg.create_pool(**self.config.db_credentials,
@@ -395,10 +472,20 @@ class ShinobuBot(commands.AutoShardedBot):
 
         self.prefix_cache = dict(await self.db.fetch("""SELECT id, prefix FROM guilds;"""))
 
+        # cogs register their timed jobs to this
+        self.scheduler = services.SchedulerService(self)
+        # and their background jobs that should run on a single cluster to this
+        self.cluster_jobs = services.ClusterJobService(self)
+        # compresses the logged messages
+        self.message_codec = services.MessageCodecService(self)
+
         await self.load_or_reload_cogs()
 
         await self.update_status()
 
+        # nothing is loaded from the gateway yet. the launcher uses this as the fixed memory cost of a cluster
+        self.send_to_launcher({'type': 'baseline', 'memory': self.stats_publisher.process.memory_info().rss / 10 ** 6})
+
         self.logger.info("Setup hook complete.")
         # await self.chunk_active_guilds()
 
@@ -422,6 +509,19 @@ class ShinobuBot(commands.AutoShardedBot):
         if self.ipc:  # close ipc connection
             await self.ipc.close_ipc(f"Cluster {self.cluster_id} has shut down.")
 
+        if self.stats_publisher:  # stop publishing stats
+            self.stats_publisher.stop()
+            self.stats_board.close()
+
+        if self.scheduler:  # stop running timed jobs
+            self.scheduler.stop()
+
+        if self.cluster_jobs:  # let other clusters take our background jobs over
+            self.cluster_jobs.stop()
+
+        if self.message_codec:  # stop refreshing the message dictionaries
+            self.message_codec.stop()
+
         if self.db:  # close the db connection
             await self.db.close()
 
@@ -0,0 +1,29 @@
+import unittest
+
+from ipc.ipc_funcs import IPCMessage
+from ipc.ipc_wire import MessageType
+
+
+class IPCMessageTests(unittest.TestCase):
+    def test_drop_db_cache_round_trip(self):
+        msg = IPCMessage(author=1,
+                         type=MessageType.EVENT,
+                         key=987654321,
+                         data={'endpoint': 'drop_db_cache', 'model_name': 'GuildDB', 'entity_id': 123456789})
+
+        received = IPCMessage.loads(msg.dumps())
+
+        self.assertEqual(received.endpoint, 'drop_db_cache')
+        self.assertEqual(received.model_name, 'GuildDB')
+        self.assertEqual(received.entity_id, 123456789)
+
+        # the correlation key stays apart from the payload
+        self.assertEqual(received.key, 987654321)
+
+    def test_data_fields_cannot_shadow_slots(self):
+        with self.assertRaises(ValueError):
+            IPCMessage(author=1, type=MessageType.EVENT, key=1, data={'endpoint': 'drop_db_cache', 'key': 5})
+
+
+if __name__ == '__main__':
+    unittest.main()